@@ -0,0 +1,115 @@
+"""
+Compare loading the posts listing with one query per post (the old
+recursive ``find_posts`` walk) against :func:`unsafe.db.post.find_thread_forest`.
+
+Usage::
+
+    python benchmarks/bench_posts.py [--sizes 1000 10000 100000]
+
+A temporary database is created for each size with roughly one top-level
+post per ten replies. Both strategies are run against the same data and
+must produce identical trees. Both rely on the ``post(reply_to, updated_at)``
+index created by the schema migrations.
+"""
+import argparse
+import datetime
+import os
+import random
+import sys
+import tempfile
+import time
+
+import unsafe.db as db
+from unsafe.db import post as postdb
+
+
+def populate(conn, count, seed=0):
+    rnd = random.Random(seed)
+    user_ids = [row[0] for row in conn.execute('SELECT user_id FROM user')]
+    conn.execute('DELETE FROM post')
+    # Distinct timestamps keep the ordering of both strategies comparable
+    base = datetime.datetime(2019, 1, 1)
+    offsets = rnd.sample(range(count * 60), count)
+    rows = []
+    for post_id in range(1, count + 1):
+        if post_id == 1 or rnd.random() < 0.1:
+            reply_to = None
+        else:
+            reply_to = rnd.randint(1, post_id - 1)
+        ts = str(base + datetime.timedelta(seconds=offsets[post_id - 1]))
+        rows.append((post_id, rnd.choice(user_ids), reply_to,
+                     f'Post {post_id}', ts, ts))
+    conn.executemany('INSERT INTO post(post_id, user_id, reply_to, content,'
+                     ' created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)',
+                     rows)
+    conn.commit()
+
+
+def load_recursive(conn):
+    """The listing as it was loaded before find_thread_forest."""
+    posts = postdb.find_posts(conn)
+
+    def load_replies(post):
+        post.replies = postdb.find_posts(conn, reply_to=post.post_id,
+                                         order='ASC')
+        for reply in post.replies:
+            load_replies(reply)
+
+    for post in posts:
+        load_replies(post)
+    return posts
+
+
+def shape(posts):
+    return [(p.post_id, shape(p.replies)) for p in posts]
+
+
+def measure(conn, loader, repeat):
+    statements = []
+    conn.set_trace_callback(statements.append)
+    best = None
+    result = None
+    try:
+        for _ in range(repeat):
+            statements.clear()
+            start = time.perf_counter()
+            result = loader(conn)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+    finally:
+        conn.set_trace_callback(None)
+    queries = sum(1 for s in statements if s.lstrip().upper().startswith(
+        ('SELECT', 'WITH')))
+    return result, queries, best
+
+
+def main(argv=sys.argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[1000, 10000, 100000])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args(argv[1:])
+
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), 10000))
+    print(f'{"posts":>8} {"strategy":<10} {"queries":>8} {"ms":>10}')
+    with tempfile.TemporaryDirectory() as tmp:
+        dbname = os.path.join(tmp, 'bench.db')
+        db.init(dbname)
+        conn = db.connect(dbname)
+        for size in args.sizes:
+            populate(conn, size)
+            old, old_queries, old_time = measure(conn, load_recursive,
+                                                 args.repeat)
+            new, new_queries, new_time = measure(conn,
+                                                 postdb.find_thread_forest,
+                                                 args.repeat)
+            assert shape(old) == shape(new), 'Strategies disagree'
+            print(f'{size:>8} {"recursive":<10} {old_queries:>8}'
+                  f' {old_time * 1000:>10.1f}')
+            print(f'{size:>8} {"forest":<10} {new_queries:>8}'
+                  f' {new_time * 1000:>10.1f}')
+        conn.close()
+
+
+if __name__ == '__main__':  # pragma: no cover
+    sys.exit(main() or 0)
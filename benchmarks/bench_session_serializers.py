@@ -0,0 +1,81 @@
+"""
+Compare session data serialization formats.
+
+Usage::
+
+    python benchmarks/bench_session_serializers.py [--number 20000]
+
+For a few representative session payloads, reports encode and decode time
+per session and the size of the stored value for the original
+``json.dumps`` text and each :class:`unsafe.session_serializer.SessionSerializer`
+configuration.
+"""
+import argparse
+import json
+import os
+import sys
+import timeit
+
+from unsafe.session_serializer import SessionSerializer
+
+PAYLOADS = {
+    'auth': {
+        'auth.userid': 3,
+        '_csrft_': os.urandom(20).hex(),
+    },
+    'flash': {
+        'auth.userid': 3,
+        '_csrft_': os.urandom(20).hex(),
+        '_f_': ['Anteckningen sparades', 'Inlägget publicerades'],
+        'last_search': {'from': '2019-01-01', 'to': '2019-12-31',
+                        'search': 'semlor'},
+    },
+    'large': {
+        'auth.userid': 3,
+        '_csrft_': os.urandom(20).hex(),
+        'history': [{'path': f'/notes/{i}', 'ts': 1560000000 + i}
+                    for i in range(200)],
+    },
+}
+
+
+class LegacyJSON:
+    """Serialization as done before SessionSerializer"""
+
+    dumps = staticmethod(json.dumps)
+    loads = staticmethod(json.loads)
+
+
+SERIALIZERS = {
+    'legacy json': LegacyJSON(),
+    'json': SessionSerializer('json'),
+    'json+zlib': SessionSerializer('json', compress_threshold=256),
+    'marshal': SessionSerializer('marshal'),
+    'marshal+zlib': SessionSerializer('marshal', compress_threshold=256),
+}
+
+
+def main(argv=sys.argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--number', type=int, default=20000)
+    args = parser.parse_args(argv[1:])
+
+    print(f'{"payload":<8} {"serializer":<14} {"bytes":>7}'
+          f' {"encode us":>10} {"decode us":>10}')
+    for payload_name, payload in PAYLOADS.items():
+        for name, serializer in SERIALIZERS.items():
+            value = serializer.dumps(payload)
+            assert serializer.loads(value) == payload
+            size = len(value.encode('utf-8') if isinstance(value, str)
+                       else value)
+            encode = min(timeit.repeat(lambda: serializer.dumps(payload),
+                                       number=args.number, repeat=3))
+            decode = min(timeit.repeat(lambda: serializer.loads(value),
+                                       number=args.number, repeat=3))
+            print(f'{payload_name:<8} {name:<14} {size:>7}'
+                  f' {encode / args.number * 1e6:>10.2f}'
+                  f' {decode / args.number * 1e6:>10.2f}')
+
+
+if __name__ == '__main__':  # pragma: no cover
+    sys.exit(main() or 0)
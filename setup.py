@@ -72,8 +72,10 @@ setup(name='unsafe',
       entry_points={
           'console_scripts': [
               'unsafe-initdb = unsafe.scripts.initdb:main',
+              'unsafe-precompile = unsafe.scripts.precompile:main',
               'unsafe-evilsite= unsafe.scripts.evilsite:main',
               'unsafe-sessions = unsafe.scripts.sessions:main',
+              'unsafe-users = unsafe.scripts.users:main',
               'unsafe = unsafe.scripts.runner:main'
           ],
           'paste.app_factory': [
@@ -0,0 +1,90 @@
+from unsafe.cache import LRUCache
+
+
+def test_lru_evicts_least_recently_used():
+    cache = LRUCache(2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1
+    cache.put('c', 3)
+    assert 'b' not in cache
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+    assert cache.stats()['evictions'] == 1
+
+
+def test_lru_counters():
+    cache = LRUCache(2)
+    cache.put('a', 1)
+    cache.get('a')
+    cache.get('b')
+    stats = cache.stats()
+    assert stats['hits'] == 1
+    assert stats['misses'] == 1
+    assert stats['hit_rate'] == 0.5
+
+
+def test_lru_pop():
+    cache = LRUCache(2)
+    cache.put('a', 1)
+    assert cache.pop('a') == 1
+    assert cache.pop('a') is None
+    assert len(cache) == 0
+
+
+def test_lru_pop_matching():
+    cache = LRUCache(3)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    cache.put('c', 3)
+    assert cache.pop_matching(lambda key, value: value % 2) == 2
+    assert 'b' in cache
+    assert len(cache) == 1
+
+
+def test_lru_ttl(monkeypatch):
+    import time
+    now = time.monotonic()
+    monkeypatch.setattr(time, 'monotonic', lambda: now)
+    cache = LRUCache(2, ttl=10)
+    cache.put('a', 1)
+    assert cache.get('a') == 1
+    monkeypatch.setattr(time, 'monotonic', lambda: now + 10)
+    assert 'a' not in cache
+    assert cache.get('a') is None
+    stats = cache.stats()
+    assert stats['expirations'] == 1
+    assert stats['misses'] == 1
+    assert stats['size'] == 0
+
+
+def test_lru_replace_keeps_expiry_time(monkeypatch):
+    import time
+    now = time.monotonic()
+    monkeypatch.setattr(time, 'monotonic', lambda: now)
+    cache = LRUCache(2, ttl=10)
+    cache.put('a', 1)
+    monkeypatch.setattr(time, 'monotonic', lambda: now + 5)
+    assert cache.replace('a', 2)
+    assert not cache.replace('b', 2)
+    assert cache.get('a') == 2
+    monkeypatch.setattr(time, 'monotonic', lambda: now + 10)
+    assert cache.get('a') is None
+    assert not cache.replace('a', 3)
+
+
+def test_lru_maxbytes():
+    evicted = []
+    cache = LRUCache(10, maxbytes=5,
+                     on_evict=lambda key, value: evicted.append(key))
+    cache.put('a', 'xx')
+    cache.put('b', 'yy')
+    cache.put('c', 'zz')
+    assert evicted == ['a']
+    assert cache.stats()['bytes'] == 4
+    cache.put('b', 'y')
+    assert cache.stats()['bytes'] == 3
+    cache.put('d', 'toolarge')
+    assert 'd' not in cache
+    assert cache.pop('c') == 'zz'
+    assert cache.stats()['bytes'] == 1
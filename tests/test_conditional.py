@@ -0,0 +1,118 @@
+import os
+
+import pytest
+from webtest import TestApp as App
+
+import unsafe.app
+from unsafe import db
+
+DBNAME_APP = 'test-conditional.db'
+DBNAME_SESSIONS = 'test-conditional-sessions.db'
+
+
+def setup_module():
+    for fn in (DBNAME_APP, DBNAME_SESSIONS):
+        try:
+            os.remove(fn)
+        except FileNotFoundError:  # pragma: no cover
+            pass
+
+    db.init(DBNAME_APP)
+
+
+@pytest.fixture()
+def app() -> App:
+    settings = {
+        'db.app': DBNAME_APP,
+        'db.sessions': DBNAME_SESSIONS,
+    }
+    return App(unsafe.app.main({}, **settings))
+
+
+def test_posts_not_modified(app: App):
+    response = app.get('/posts')
+    etag = response.headers['ETag']
+    assert response.headers['Vary'] == 'Cookie'
+
+    response = app.get('/posts', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.body == b''
+    assert response.headers['ETag'] == etag
+
+
+def test_posts_modified_by_like(app: App):
+    etag = app.get('/posts').headers['ETag']
+    conn = db.connect(DBNAME_APP)
+    try:
+        with conn:
+            db.post.like_post(conn, 1)
+    finally:
+        conn.close()
+
+    response = app.get('/posts', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+
+
+def test_query_string_changes_etag(app: App):
+    etag = app.get('/posts').headers['ETag']
+    response = app.get('/posts?user=1', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+
+
+def test_topic_not_modified(app: App):
+    response = app.get('/topics/csrf')
+    # Topics show the login state, so only the ETag identifies the user
+    assert 'Last-Modified' not in response.headers
+    response = app.get('/topics/csrf',
+                       headers={'If-None-Match': response.headers['ETag']})
+    assert response.status_code == 304
+
+
+@pytest.mark.slow
+def test_topic_modified_by_login(app: App):
+    app.get('/topics/csrf')
+    app.get('/login')
+    app.post('/login', dict(csrf_token=app.cookies['csrf_token'],
+                            username='bosse',
+                            password='hemligt',
+                            submit=''))
+    response = app.get('/topics/csrf', headers={
+        'If-Modified-Since': 'Fri, 01 Jan 2100 00:00:00 GMT'})
+    assert response.status_code == 200
+
+
+def test_posts_modified_by_username(app: App):
+    etag = app.get('/posts').headers['ETag']
+    conn = db.connect(DBNAME_APP)
+    try:
+        with conn:
+            conn.execute("UPDATE user SET username = username || '2'"
+                         ' WHERE user_id = (SELECT user_id FROM post'
+                         ' WHERE post_id = 1)')
+        response = app.get('/posts', headers={'If-None-Match': etag})
+        with conn:
+            conn.execute("UPDATE user SET username = substr(username, 1,"
+                         ' length(username) - 1) WHERE user_id ='
+                         ' (SELECT user_id FROM post WHERE post_id = 1)')
+    finally:
+        conn.close()
+    assert response.status_code == 200
+
+
+def test_unknown_topic_not_conditional(app: App):
+    response = app.get('/topics/nope',
+                       headers={'If-Modified-Since':
+                                'Fri, 01 Jan 2100 00:00:00 GMT'})
+    assert response.status_code != 304
+    assert 'ETag' not in response.headers
+
+
+def test_disabled():
+    settings = {
+        'db.app': DBNAME_APP,
+        'db.sessions': DBNAME_SESSIONS,
+        'conditional_get': 'false',
+    }
+    app = App(unsafe.app.main({}, **settings))
+    assert 'ETag' not in app.get('/posts').headers
@@ -0,0 +1,68 @@
+import time
+
+import pytest
+from pyramid import testing
+
+from unsafe.csrf import HMACCSRFStoragePolicy
+
+
+class DummySession(dict):
+    def __init__(self, session_id=None):
+        super().__init__()
+        self.session_id = session_id
+
+
+def make_request(session_id=None):
+    request = testing.DummyRequest()
+    request.session = DummySession(session_id)
+    return request
+
+
+@pytest.fixture()
+def policy():
+    return HMACCSRFStoragePolicy('secret', window=60)
+
+
+def test_token_roundtrip(policy):
+    request = make_request('abc')
+    token = policy.get_csrf_token(request)
+    assert token == policy.new_csrf_token(request)
+    assert policy.check_csrf_token(request, token)
+    assert not request.session
+
+
+def test_token_bound_to_session(policy):
+    token = policy.get_csrf_token(make_request('abc'))
+    assert not policy.check_csrf_token(make_request('def'), token)
+    assert not policy.check_csrf_token(make_request(), token)
+
+
+def test_token_rejected_without_session(policy):
+    request = make_request()
+    assert not policy.check_csrf_token(request, policy.get_csrf_token(request))
+
+
+def test_token_bound_to_secret(policy):
+    request = make_request('abc')
+    other = HMACCSRFStoragePolicy('other', window=60)
+    assert not policy.check_csrf_token(request, other.get_csrf_token(request))
+
+
+def test_previous_window_accepted(policy, monkeypatch):
+    request = make_request('abc')
+    now = time.time()
+    token = policy.get_csrf_token(request)
+    monkeypatch.setattr(time, 'time', lambda: now + 60)
+    assert policy.check_csrf_token(request, token)
+    monkeypatch.setattr(time, 'time', lambda: now + 120)
+    assert not policy.check_csrf_token(request, token)
+
+
+@pytest.mark.parametrize('token', ['', 'x', '-', '1-abc', None])
+def test_malformed_token(policy, token):
+    assert not policy.check_csrf_token(make_request('abc'), token)
+
+
+def test_requires_secret():
+    with pytest.raises(ValueError):
+        HMACCSRFStoragePolicy('')
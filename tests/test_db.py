@@ -0,0 +1,312 @@
+import os
+import sqlite3
+import threading
+import time
+
+import pytest
+
+import unsafe.db as db
+from unsafe.db.pool import ConnectionPool, PoolTimeoutError
+
+DBNAME = 'test-db.db'
+
+
+def setup_module(module):
+    try:
+        os.remove(DBNAME)
+    except FileNotFoundError:  # pragma: no cover
+        pass
+
+    db.init(DBNAME)
+
+
+@pytest.fixture
+def pool():
+    p = ConnectionPool(DBNAME, size=2, timeout=0.1)
+    yield p
+    p.close()
+
+
+def test_pool_reuses_connections(pool):
+    conn = pool.acquire()
+    pool.release(conn)
+    assert pool.acquire() is conn
+    assert pool.stats()['hits'] == 1
+    assert pool.stats()['misses'] == 1
+
+
+def test_pool_connection_is_warmed(pool):
+    conn = pool.acquire()
+    assert conn.execute('PRAGMA foreign_keys').fetchone()[0] == 1
+    assert conn.execute('SELECT username FROM user').fetchone()['username']
+    pool.release(conn)
+
+
+def test_pool_release_rolls_back(pool):
+    conn = pool.acquire()
+    conn.execute("INSERT INTO user(username, groups) VALUES('tmp', '')")
+    assert conn.in_transaction
+    pool.release(conn)
+    conn = pool.acquire()
+    assert not conn.in_transaction
+    row = conn.execute("SELECT * FROM user WHERE username = 'tmp'").fetchone()
+    assert row is None
+    pool.release(conn)
+
+
+def test_pool_timeout(pool):
+    conns = [pool.acquire(), pool.acquire()]
+    with pytest.raises(PoolTimeoutError):
+        pool.acquire()
+    stats = pool.stats()
+    assert stats['open'] == 2
+    assert stats['waits'] == 1
+    assert stats['wait_time'] > 0
+    for conn in conns:
+        pool.release(conn)
+
+
+def test_pool_connection_usable_from_other_thread(pool):
+    conn = pool.acquire()
+    pool.release(conn)
+    result = []
+
+    def run():
+        c = pool.acquire()
+        result.append(c.execute('SELECT COUNT(*) FROM user').fetchone()[0])
+        pool.release(c)
+
+    t = threading.Thread(target=run)
+    t.start()
+    t.join()
+    assert result and result[0] > 0
+
+
+def test_pool_closes_connections_released_after_close(pool):
+    conn = pool.acquire()
+    pool.close()
+    pool.release(conn)
+    assert pool.stats()['idle'] == 0
+    assert pool.stats()['open'] == 0
+    with pytest.raises(sqlite3.ProgrammingError):
+        conn.execute('SELECT 1')
+
+
+def test_pool_waiter_opens_connection_when_slot_is_freed():
+    pool = ConnectionPool(DBNAME, size=1, timeout=5)
+    broken = pool.acquire()
+    result = []
+
+    def run():
+        c = pool.acquire()
+        result.append(c)
+        pool.release(c)
+
+    t = threading.Thread(target=run)
+    t.start()
+    time.sleep(0.1)
+    assert pool.stats()['waits'] == 1
+    # A connection that can not be reset is discarded on release
+    broken.close()
+    pool.release(broken)
+    t.join(2)
+    assert result and result[0] is not broken
+    pool.close()
+
+
+@pytest.fixture
+def conn():
+    c = db.connect(DBNAME)
+    yield c
+    c.close()
+
+
+def test_find_thread_forest(conn):
+    posts = db.post.find_thread_forest(conn)
+    assert [p.post_id for p in posts] == [1]
+    replies = posts[0].replies
+    assert [r.reply_to for r in replies] == [1, 1]
+    assert all(r.replies == [] for r in replies)
+
+
+def test_find_thread_forest_nested(conn):
+    reply = db.post.Post(None, user_id=1, content='nested', reply_to=2)
+    reply = db.post.save_post(conn, reply)
+    try:
+        posts = db.post.find_thread_forest(conn)
+        nested = next(r for r in posts[0].replies if r.post_id == 2).replies
+        assert [r.post_id for r in nested] == [reply.post_id]
+    finally:
+        conn.rollback()
+
+
+def test_find_thread_forest_user(conn):
+    assert db.post.find_thread_forest(conn, user_id=1) == []
+
+
+def test_init_applies_migrations(conn):
+    assert db.schema_version(conn) == db.migrations()[-1].version
+    assert db.pending_migrations(conn) == []
+    plan = conn.execute('EXPLAIN QUERY PLAN'
+                        ' SELECT * FROM user WHERE username = ?',
+                        ('joe',)).fetchall()
+    assert any('user_username' in row['detail'] for row in plan)
+
+
+def test_migrate_existing_database(tmp_path):
+    dbname = str(tmp_path / 'old.db')
+    sql_path = os.path.join(os.path.dirname(db.__file__), '..', 'sql')
+    db.runscripts(dbname, 'db-create.sql', 'db-init.sql',
+                  script_path=sql_path)
+
+    applied = db.migrate(dbname)
+    assert [m.version for m in applied] == \
+        [m.version for m in db.migrations()]
+    assert db.migrate(dbname) == []
+
+    c = db.connect(dbname)
+    indexes = {row[0] for row in c.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'index'")}
+    c.close()
+    assert {'user_username', 'note_user_id_updated_at',
+            'post_reply_to_updated_at'} <= indexes
+
+
+def test_schema_version_does_not_write(tmp_path):
+    c = db.connect(str(tmp_path / 'empty.db'))
+    try:
+        assert db.schema_version(c) == 0
+        assert db.pending_migrations(c) == db.migrations()
+        count = c.execute('SELECT COUNT(*) FROM sqlite_master').fetchone()[0]
+        assert count == 0
+    finally:
+        c.close()
+
+
+def test_migrate_commits_index_builds_separately(tmp_path):
+    dbname = str(tmp_path / 'index.db')
+    (tmp_path / '0001-index.sql').write_text(
+        'CREATE TABLE a (x INTEGER);\n'
+        '-- comment\n'
+        'CREATE INDEX a_x ON a(x);\n'
+        'INSERT INTO nope VALUES (1);\n')
+    with pytest.raises(Exception):
+        db.migrate(dbname, script_path=str(tmp_path))
+
+    c = db.connect(dbname)
+    try:
+        assert c.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+        names = {row[0] for row in c.execute('SELECT name FROM sqlite_master')}
+        assert db.schema_version(c) == 0
+    finally:
+        c.close()
+    # Committed before the failing statement
+    assert {'a', 'a_x'} <= names
+
+
+def test_migrate_failure_rolls_back(tmp_path):
+    dbname = str(tmp_path / 'bad.db')
+    (tmp_path / '0001-ok.sql').write_text('CREATE TABLE a (x INTEGER);')
+    (tmp_path / '0002-bad.sql').write_text('CREATE TABLE b (x INTEGER);'
+                                           ' INSERT INTO nope VALUES (1);')
+    with pytest.raises(Exception):
+        db.migrate(dbname, script_path=str(tmp_path))
+
+    c = db.connect(dbname)
+    tables = {row[0] for row in c.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table'")}
+    assert db.schema_version(c) == 1
+    c.close()
+    assert 'a' in tables
+    assert 'b' not in tables
+
+
+def test_cursor_roundtrip():
+    cursor = db.make_cursor('2019-05-29 12:25:01', 3)
+    assert db.parse_cursor(cursor) == ('2019-05-29 12:25:01', 3)
+    assert db.parse_cursor('') is None
+    with pytest.raises(ValueError):
+        db.parse_cursor('garbage')
+
+
+def test_find_notes_keyset(conn):
+    notes = db.note.find_notes(conn, user_id=4)
+    assert len(notes) == 3
+
+    first = db.note.find_notes(conn, user_id=4, limit=2)
+    assert first == notes[:2]
+
+    after = (first[-1].updated_at, first[-1].note_id)
+    rest = db.note.find_notes(conn, user_id=4, after=after, limit=2)
+    assert rest == notes[2:]
+
+
+def test_find_posts_keyset(conn):
+    replies = db.post.find_posts(conn, reply_to=1, order='ASC')
+    first = db.post.find_posts(conn, reply_to=1, order='ASC', limit=1)
+    assert first == replies[:1]
+    after = (first[0].updated_at, first[0].post_id)
+    rest = db.post.find_posts(conn, reply_to=1, order='ASC', after=after)
+    assert rest == replies[1:]
+
+
+def test_find_thread_forest_keyset(conn):
+    for content in ('a', 'b'):
+        db.post.save_post(conn, db.post.Post(None, user_id=2, content=content))
+    try:
+        threads = db.post.find_thread_forest(conn)
+        assert len(threads) == 3
+        first = db.post.find_thread_forest(conn, limit=2)
+        assert [p.post_id for p in first] == [p.post_id for p in threads[:2]]
+        after = (first[-1].updated_at, first[-1].post_id)
+        rest = db.post.find_thread_forest(conn, after=after, limit=2)
+        assert [p.post_id for p in rest] == [threads[2].post_id]
+        assert len(rest[0].replies) == 2
+    finally:
+        conn.rollback()
+
+
+def test_fts_query():
+    assert db.fts_query('') is None
+    assert db.fts_query('chili  Sal') == '"chili"* "Sal"*'
+    assert db.fts_query('a"b OR') == '"a""b"* "OR"*'
+
+
+def test_find_notes_search(conn):
+    notes = db.note.find_notes(conn, search='papaya CHILI')
+    assert [n.content.split('\n')[0] for n in notes] == ['Som tam']
+    # Prefix match, diacritics ignored
+    assert len(db.note.find_notes(conn, search='sälj')) == 1
+    assert len(db.note.find_notes(conn, search='salj')) == 1
+    assert db.note.find_notes(conn, search='"') == []
+
+
+def test_search_index_follows_updates(conn):
+    post = db.post.save_post(conn, db.post.Post(None, user_id=2,
+                                                content='blåbärssoppa'))
+    try:
+        assert [p.post_id for p in db.post.search_posts(conn, 'blåbär')] \
+            == [post.post_id]
+        conn.execute('UPDATE post SET content = ? WHERE post_id = ?',
+                     ('lingonsylt', post.post_id))
+        assert db.post.search_posts(conn, 'blåbär') == []
+        assert len(db.post.search_posts(conn, 'lingon')) == 1
+        conn.execute('DELETE FROM post WHERE post_id = ?', (post.post_id,))
+        assert db.post.search_posts(conn, 'lingon') == []
+    finally:
+        conn.rollback()
+
+
+def test_search_posts_ranked_with_snippet(conn):
+    for content in ('genius once', 'genius genius genius twice'):
+        db.post.save_post(conn, db.post.Post(None, user_id=2,
+                                             content=content))
+    try:
+        posts = db.post.search_posts(conn, 'geni')
+        assert posts[0].content == 'genius genius genius twice'
+        assert len(posts) == 3
+        once = next(p for p in posts if p.content == 'genius once')
+        assert once.snippet == '\x02genius\x03 once'
+        assert db.post.search_posts(conn, 'geni', limit=1) == posts[:1]
+    finally:
+        conn.rollback()
@@ -1,4 +1,5 @@
-from unsafe.filters import since_filter
+from unsafe.db.post import Post
+from unsafe.filters import highlight_filter, since_filter, thread_key_filter
 from datetime import datetime, timedelta
 
 
@@ -69,3 +70,21 @@ def test_since_second():
 def test_since_seconds():
     assert since_filter('2019-01-01 13:14:00', '2019-01-01 13:14:00') == '0 sekunder'
     assert since_filter('2019-01-01 13:14:00', '2019-01-01 13:14:02') == '2 sekunder'
+
+
+def test_highlight():
+    assert highlight_filter('') == ''
+    assert highlight_filter('<b>\x02hit\x03</b>') == \
+        '&lt;b&gt;<mark>hit</mark>&lt;/b&gt;'
+
+
+def test_thread_key():
+    post = Post(1, user_id=1, content='a', likes=0, updated_at='t')
+    reply = Post(2, user_id=1, content='b', reply_to=1, updated_at='t')
+    post.replies = [reply]
+    key = thread_key_filter(post)
+    reply.likes = 1
+    assert thread_key_filter(post) != key
+    reply.likes = 0
+    reply.content = 'c'
+    assert thread_key_filter(post) != key
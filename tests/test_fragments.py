@@ -0,0 +1,63 @@
+from jinja2 import DictLoader, Environment
+
+from unsafe.fragments import FragmentCacheExtension
+
+TEMPLATE = '''\
+{%- macro greet(name) %}Hi {{ name }} from {{ viewer }}{% endmacro -%}
+{%- macro item(n) -%}
+{% cache n, version %}[{{ counter() }}:{{ n }} {{ hole('greet', n) }}]{% endcache %}
+{%- endmacro -%}
+{% cache 'list', version, items | join(',') %}{% for n in items %}{{ item(n) }}{% endfor %}{% endcache %}'''
+
+
+def make_env():
+    env = Environment(loader=DictLoader({'t': TEMPLATE}), autoescape=True,
+                      extensions=[FragmentCacheExtension])
+    calls = []
+    env.globals['counter'] = lambda: calls.append(1) or len(calls)
+    return env, calls
+
+
+def test_fragment_cached_with_holes_filled():
+    env, calls = make_env()
+    template = env.get_template('t')
+    first = template.render(items=[1, 2], version=1, viewer='a')
+    assert first == '[1:1 Hi 1 from a][2:2 Hi 2 from a]'
+    second = template.render(items=[1, 2], version=1, viewer='<b>')
+    assert second == '[1:1 Hi 1 from &lt;b&gt;][2:2 Hi 2 from &lt;b&gt;]'
+    assert len(calls) == 2
+
+
+def test_nested_fragments_reused():
+    env, calls = make_env()
+    template = env.get_template('t')
+    template.render(items=[1, 2], version=1, viewer='a')
+    # The outer fragment changes, the inner fragment of 1 is reused
+    result = template.render(items=[1, 3], version=1, viewer='a')
+    assert result == '[1:1 Hi 1 from a][3:3 Hi 3 from a]'
+    assert len(calls) == 3
+
+
+def test_key_change_renders_again():
+    env, calls = make_env()
+    template = env.get_template('t')
+    template.render(items=[1], version=1, viewer='a')
+    template.render(items=[1], version=2, viewer='a')
+    assert len(calls) == 2
+
+
+def test_cache_disabled():
+    env, calls = make_env()
+    env.fragment_cache = None
+    template = env.get_template('t')
+    template.render(items=[1], version=1, viewer='a')
+    template.render(items=[1], version=1, viewer='a')
+    assert len(calls) == 2
+
+
+def test_fake_hole_in_content_ignored():
+    env, _ = make_env()
+    template = env.from_string(
+        "{% cache 1 %}{{ content | safe }}{% endcache %}")
+    content = '<!--hole:0000000000000000:["greet", 1]-->'
+    assert template.render(content=content) == content
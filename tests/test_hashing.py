@@ -0,0 +1,63 @@
+import os
+import time
+
+import pytest
+
+import unsafe.db as db
+import unsafe.db.user as userdb
+from unsafe.hashing import HashingOverloadError, HashPool
+
+DBNAME = 'test-hashing.db'
+
+
+def setup_module():
+    try:
+        os.remove(DBNAME)
+    except FileNotFoundError:  # pragma: no cover
+        pass
+
+    db.init(DBNAME)
+
+
+@pytest.fixture(scope='module')
+def pool():
+    p = HashPool(userdb.pwdctx, workers=1, queue_size=2, timeout=30)
+    yield p
+    p.close()
+
+
+@pytest.mark.slow
+def test_hash_and_verify(pool):
+    hash = pool.hash('secret')
+    assert userdb.pwdctx.verify('secret', hash)
+    assert pool.verify('secret', hash) == (True, False)
+    assert pool.verify('wrong', hash) == (False, False)
+    assert pool.verify('hemligt', 'hemligt') == (True, True)
+
+
+@pytest.mark.slow
+def test_overload(pool):
+    futures = [pool._submit(time.sleep, 0.5) for _ in range(2)]
+    with pytest.raises(HashingOverloadError):
+        pool.hash('secret')
+    for future in futures:
+        future.result()
+    assert pool.stats()['rejected'] == 1
+
+
+@pytest.mark.slow
+def test_authenticate_rehashes_in_background(pool):
+    conn = db.connect(DBNAME)
+    try:
+        user = userdb.authenticate(conn, 'bosse', 'hemligt', hash_pool=pool)
+        assert user is not None
+        assert userdb.authenticate(conn, 'bosse', 'fel', hash_pool=pool) is None
+
+        for _ in range(100):
+            if userdb.from_username(conn, 'bosse').password != 'hemligt':
+                break
+            time.sleep(0.1)
+        assert userdb.pwdctx.verify(
+            'hemligt', userdb.from_username(conn, 'bosse').password)
+    finally:
+        conn.close()
@@ -134,6 +134,41 @@ def test_login_clears_csrf_cookie():
     assert cookie.max_age == b'0'
 
 
+def test_login_overloaded():
+    from pyramid.httpexceptions import HTTPServiceUnavailable
+    from unsafe.hashing import HashingOverloadError
+
+    class OverloadedPool:
+        def verify(self, password, hash):
+            raise HashingOverloadError()
+
+    request = make_request(path='/login',
+                           post={'csrf_token': 'x', 'submit': '',
+                                 'username': 'bosse', 'password': 'hemligt'},
+                           cookies={csrf_cookie_name: 'x'})
+    request.registry.hash_pool = OverloadedPool()
+    try:
+        with pytest.raises(HTTPServiceUnavailable):
+            login_view(request)
+    finally:
+        del request.registry.hash_pool
+
+
+def test_posts_do_not_create_session(app: App):
+    response = app.get('/posts')
+    assert response.status_code == 200
+    assert 'csrf_token' in response.text
+    assert 'session' not in app.cookies
+
+
+def test_posts_search(app: App):
+    response = app.get('/posts', params={'q': 'viagra'})
+    assert response.status_code == 200
+    assert '<mark>viagra</mark>' in response.text
+    assert '<script>document' not in response.text
+    assert 'Äldre inlägg' not in response.text
+
+
 def test_login_view_does_not_create_session():
     request = make_request()
     login_view(request)
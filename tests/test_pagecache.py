@@ -0,0 +1,137 @@
+import os
+import time
+
+import pytest
+from webtest import TestApp as App
+
+import unsafe.app
+from unsafe import db
+from unsafe.pagecache import CachedPage, PageCache
+
+DBNAME_APP = 'test-pagecache.db'
+DBNAME_SESSIONS = 'test-pagecache-sessions.db'
+
+
+def setup_module():
+    for fn in (DBNAME_APP, DBNAME_SESSIONS):
+        try:
+            os.remove(fn)
+        except FileNotFoundError:  # pragma: no cover
+            pass
+
+    db.init(DBNAME_APP)
+
+
+@pytest.fixture()
+def app() -> App:
+    settings = {
+        'db.app': DBNAME_APP,
+        'db.sessions': DBNAME_SESSIONS,
+        'page_cache': 'true',
+    }
+    return App(unsafe.app.main({}, **settings))
+
+
+def page(body: bytes, versions=(), ttl=60) -> CachedPage:
+    return CachedPage(status='200 OK', headerlist=[], body=body,
+                      versions=versions, expires=time.time() + ttl)
+
+
+def test_invalidate_tags():
+    cache = PageCache(1000)
+    cache.put('a', page(b'a', cache.versions(('post',))))
+    cache.put('b', page(b'b'))
+    assert cache.get('a', ('post',)).body == b'a'
+
+    db.invalidate_tables('post')
+    assert cache.get('a', ('post',)) is None
+    assert cache.get('b', ()).body == b'b'
+    assert cache.take_pending() == {'post'}
+    assert cache.take_pending() == set()
+
+
+def test_expired():
+    cache = PageCache(1000)
+    cache.put('a', page(b'a', ttl=-1))
+    assert cache.get('a', ()) is None
+
+
+def test_disk_tier(tmp_path):
+    (tmp_path / 'old.page').write_bytes(b'stale')
+    cache = PageCache(10, directory=str(tmp_path))
+    assert not (tmp_path / 'old.page').exists()
+
+    cache.put('a', page(b'aaaaaaaa'))
+    cache.put('b', page(b'bbbbbbbb'))
+    assert len(list(tmp_path.glob('*.page'))) == 1
+    assert cache.get('a', ()).body == b'aaaaaaaa'
+    assert cache.stats()['disk_hits'] == 1
+    # b was spilled when a moved back to memory
+    assert cache.get('b', ()).body == b'bbbbbbbb'
+
+
+def test_disk_tier_invalidated(tmp_path):
+    cache = PageCache(10, directory=str(tmp_path))
+    cache.put('a', page(b'aaaaaaaa', cache.versions(('post',))))
+    cache.put('b', page(b'bbbbbbbb'))
+    cache.invalidate('post')
+    assert cache.get('a', ('post',)) is None
+    assert cache.stats()['stale'] == 1
+    # Only b, which was spilled when a was moved back to memory
+    assert len(list(tmp_path.glob('*.page'))) == 1
+    assert cache.get('b', ()).body == b'bbbbbbbb'
+
+
+def test_anonymous_page_cached(app: App):
+    cache = app.app.registry.page_cache
+    app.get('/topics/csrf')
+    assert cache.stats()['hits'] == 0
+    response = app.get('/topics/csrf')
+    assert cache.stats()['hits'] == 1
+    assert b'CSRF' in response.body
+
+    # The embedded variant is a different page
+    app.get('/topics/csrf?embedded')
+    assert cache.stats()['hits'] == 1
+
+
+def test_page_cached_per_host(app: App):
+    cache = app.app.registry.page_cache
+    one = app.get('/topics', headers={'Host': 'one.example.com'})
+    two = app.get('/topics', headers={'Host': 'two.example.com'})
+    assert cache.stats()['hits'] == 0
+    assert 'http://one.example.com/' in one.text
+    assert 'http://one.example.com/' not in two.text
+    assert 'http://two.example.com/' in two.text
+
+
+def test_like_invalidates_posts(app: App):
+    cache = app.app.registry.page_cache
+    before = app.get('/posts').text
+    assert app.get('/posts').text == before
+    assert cache.stats()['hits'] == 1
+
+    conn = db.connect(DBNAME_APP)
+    try:
+        with conn:
+            likes = db.post.like_post(conn, 1).likes
+    finally:
+        conn.close()
+
+    after = app.get('/posts').text
+    assert cache.stats()['hits'] == 1
+    assert f'>{likes}</span>' in after
+
+
+@pytest.mark.slow
+def test_authenticated_bypass(app: App):
+    cache = app.app.registry.page_cache
+    app.get('/login')
+    app.post('/login', dict(csrf_token=app.cookies['csrf_token'],
+                            username='bosse',
+                            password='hemligt',
+                            submit=''))
+    app.get('/topics')
+    app.get('/topics')
+    assert cache.stats()['hits'] == 0
+    assert len(cache._memory) == 0
@@ -0,0 +1,70 @@
+import os
+
+from pyramid_jinja2 import IJinja2Environment
+
+import unsafe.app
+from unsafe import db
+from unsafe.precompile import precompile, template_names
+from unsafe.scripts.precompile import main as precompile_main
+
+DBNAME_APP = 'test-precompile.db'
+DBNAME_SESSIONS = 'test-precompile-sessions.db'
+
+
+def setup_module():
+    for fn in (DBNAME_APP, DBNAME_SESSIONS):
+        try:
+            os.remove(fn)
+        except FileNotFoundError:  # pragma: no cover
+            pass
+
+    db.init(DBNAME_APP)
+
+
+def make_app(cache_dir, **settings):
+    settings = {
+        'db.app': DBNAME_APP,
+        'db.sessions': DBNAME_SESSIONS,
+        'jinja2.bytecode_caching': 'true',
+        'jinja2.bytecode_caching_directory': str(cache_dir),
+        **settings,
+    }
+    return unsafe.app.main({}, **settings)
+
+
+def test_template_names():
+    names = template_names()
+    assert 'layout.jinja2' in names
+    assert 'posts/list-posts.jinja2' in names
+
+
+def test_precompile_follows_references(tmp_path):
+    app = make_app(tmp_path / 'cache')
+    env = app.registry.getUtility(IJinja2Environment, name='.jinja2')
+    names = precompile(env, ['posts/list-posts.jinja2'])
+    assert names[0] == 'layout.jinja2@@FROM_PARENT@@posts/list-posts.jinja2'
+    assert 'posts/list-posts.jinja2' in names
+    assert len(os.listdir(tmp_path / 'cache')) == len(names)
+
+
+def test_startup_precompile_and_warm_up(tmp_path):
+    app = make_app(tmp_path / 'cache', **{'templates.precompile': 'true',
+                                          'templates.warm_up': 'true',
+                                          'page_cache': 'true'})
+    assert len(os.listdir(tmp_path / 'cache')) > len(template_names())
+    # Warm-up requests to localhost are not cached
+    stats = app.registry.page_cache.stats()
+    assert stats['size'] == 0
+    assert stats['misses'] == 0
+
+
+def test_script(tmp_path, capsys):
+    cache_dir = tmp_path / 'cache'
+    ini = tmp_path / 'test.ini'
+    ini.write_text('[app:main]\n'
+                   'use = egg:unsafe\n'
+                   'jinja2.bytecode_caching = true\n'
+                   f'jinja2.bytecode_caching_directory = {cache_dir}\n')
+    precompile_main(['unsafe-precompile', str(ini)])
+    assert f'into {cache_dir}' in capsys.readouterr().out
+    assert os.listdir(cache_dir)
@@ -1,11 +1,14 @@
 import json
 import os
+import time
 
 from http.cookies import SimpleCookie
 from typing import Optional
 
+import pytest
 from pyramid import testing
 from pyramid.config import Configurator
+from pyramid.interfaces import ISessionFactory
 from webtest import TestApp as App, TestResponse as Response
 
 from unsafe.session import MySessionFactory
@@ -159,3 +162,306 @@ def test_unsigned_cookie():
     session_cookie = jar['session']
     session_data = load_session(session_cookie.value)
     assert session_data == {'foo': 'bar'}
+
+
+def test_cache_write_through_and_hit():
+    def count_view(request):
+        request.session['count'] = request.session.get('count', 0) + 1
+        return Response(str(request.session['count']))
+
+    app = make_app(count_view, cache_size=10)
+    factory = app.app.registry.queryUtility(ISessionFactory)
+    cache = factory.cache
+
+    app.get('/')
+    session_id = deserialize_cookie(app.cookies['session'])
+    assert session_id in cache
+
+    # Served from the cache even though the row is changed behind its back
+    with db.cursor(DBNAME) as cur:
+        cur.execute('UPDATE session_store SET userdata = ? WHERE session_id = ?',
+                    (json.dumps({'count': 100}), session_id))
+    assert app.get('/').text == '2'
+    assert load_session(session_id) == {'count': 2}
+    assert cache.stats()['hits'] >= 1
+
+
+def test_cache_evicted_on_invalidate():
+    def view(request):
+        if 'logout' in request.params:
+            request.session.invalidate()
+        else:
+            request.session['foo'] = 'bar'
+        return Response('OK')
+
+    app = make_app(view, cache_size=10)
+    factory = app.app.registry.queryUtility(ISessionFactory)
+    app.get('/')
+    session_id = deserialize_cookie(app.cookies['session'])
+    assert session_id in factory.cache
+    app.get('/?logout')
+    assert session_id not in factory.cache
+    assert load_session(session_id) is None
+
+
+def session_view(request):
+    if 'login' in request.params:
+        request.session['foo'] = 'bar'
+    return Response(str(request.session.get('foo')))
+
+
+def test_cached_session_deleted_elsewhere_is_dropped():
+    app = make_app(session_view, cache_size=10)
+    app.get('/?login')
+    session_id = deserialize_cookie(app.cookies['session'])
+    # Deleted by another process, which does not see this cache
+    with db.cursor(DBNAME) as cur:
+        cur.execute('DELETE FROM session_store WHERE session_id = ?',
+                    (session_id,))
+    # The refresh of the expiry time finds no session to update
+    response = app.get('/')
+    assert 'Max-Age=0' in response.headers['Set-Cookie']
+    factory = app.app.registry.queryUtility(ISessionFactory)
+    assert session_id not in factory.cache
+    assert app.get('/').text == 'None'
+
+
+def test_cached_session_reloaded_after_ttl(monkeypatch):
+    app = make_app(session_view, cache_size=10, cache_ttl=10,
+                   refresh_threshold=0.5)
+    app.get('/?login')
+    session_id = deserialize_cookie(app.cookies['session'])
+    with db.cursor(DBNAME) as cur:
+        cur.execute('DELETE FROM session_store WHERE session_id = ?',
+                    (session_id,))
+    assert app.get('/').text == 'bar'
+
+    now = time.monotonic()
+    monkeypatch.setattr(time, 'monotonic', lambda: now + 10)
+    assert app.get('/').text == 'None'
+
+
+def get_expires_at(session_id):
+    with db.cursor(DBNAME) as cur:
+        cur.execute('SELECT expires_at FROM session_store WHERE session_id = ?',
+                    (session_id,))
+        return cur.fetchone()[0]
+
+
+def read_view(request):
+    return Response(str(request.session.get('foo')))
+
+
+def test_refresh_skipped_below_threshold():
+    session_id = test_refresh_skipped_below_threshold.__name__
+    save_session(session_id, {'foo': 'bar'}, expires_at=int(time.time()) + 1100)
+    app = make_app(read_view, refresh_threshold=0.5)
+    app.set_cookie('session', serialize_cookie(session_id))
+    assert app.get('/').text == 'bar'
+    assert get_expires_at(session_id) == pytest.approx(time.time() + 1100, abs=2)
+
+
+def test_refresh_above_threshold():
+    session_id = test_refresh_above_threshold.__name__
+    save_session(session_id, {'foo': 'bar'}, expires_at=int(time.time()) + 100)
+    app = make_app(read_view, refresh_threshold=0.5)
+    app.set_cookie('session', serialize_cookie(session_id))
+    app.get('/')
+    assert get_expires_at(session_id) == pytest.approx(time.time() + 1200, abs=2)
+
+
+def test_refresh_write_behind():
+    session_id = test_refresh_write_behind.__name__
+    save_session(session_id, {'foo': 'bar'}, expires_at=int(time.time()) + 600)
+    app = make_app(read_view, refresh_delay=60)
+    factory = app.app.registry.queryUtility(ISessionFactory)
+    app.set_cookie('session', serialize_cookie(session_id))
+    app.get('/')
+    assert get_expires_at(session_id) == pytest.approx(time.time() + 600, abs=2)
+    assert factory.refresher.flush() == 1
+    assert get_expires_at(session_id) == pytest.approx(time.time() + 1200, abs=2)
+    factory.refresher.close()
+
+
+def test_refresh_write_behind_close_to_expiry():
+    session_id = test_refresh_write_behind_close_to_expiry.__name__
+    save_session(session_id, {'foo': 'bar'}, expires_at=int(time.time()) + 30)
+    app = make_app(read_view, refresh_delay=60)
+    app.set_cookie('session', serialize_cookie(session_id))
+    app.get('/')
+    assert get_expires_at(session_id) == pytest.approx(time.time() + 1200, abs=2)
+
+
+def test_refresh_staleness_bound():
+    with pytest.raises(ValueError):
+        MySessionFactory('secret', database=DBNAME, refresh_threshold=0.5,
+                         refresh_delay=600)
+
+
+def test_memory_backend():
+    from unsafe.session_backend import MemorySessionBackend
+
+    backend = MemorySessionBackend()
+    app = make_app(backend=backend)
+    app.get('/')
+    session_id = deserialize_cookie(app.cookies['session'])
+    assert json.loads(backend.load(session_id).userdata) == {'foo': 'bar'}
+    assert load_session(session_id) is None
+    backend.close()
+
+
+def test_marshal_serializer_loads_json_sessions():
+    session_id = test_marshal_serializer_loads_json_sessions.__name__
+    save_session(session_id, {'foo': 'json'})
+    app = make_app(read_view, serializer='marshal')
+    app.set_cookie('session', serialize_cookie(session_id))
+    assert app.get('/').text == 'json'
+
+    app = make_app(serializer='marshal')
+    app.get('/')
+    session_id = deserialize_cookie(app.cookies['session'])
+    with db.cursor(DBNAME) as cur:
+        cur.execute('SELECT userdata FROM session_store WHERE session_id = ?',
+                    (session_id,))
+        assert isinstance(cur.fetchone()[0], bytes)
+
+
+def test_expire_and_purge_sessions():
+    from unsafe.session import expire_sessions, purge_sessions, remove_sessions
+
+    now = int(time.time())
+    purge_sessions(DBNAME)
+    for i in range(5):
+        save_session(f'expired{i}', {}, expires_at=now - 10)
+    save_session('valid1', {})
+    save_session('valid2', {})
+    assert expire_sessions(database=DBNAME, batch_size=2) == 5
+    assert load_session('valid1') == {}
+    assert remove_sessions(['valid1'], database=DBNAME) == 1
+    assert load_session('valid1') is None
+    assert purge_sessions(DBNAME) == 1
+
+
+def cookie_store_app(view=foo_bar_view, **kwargs) -> App:
+    from unsafe.session import RevocationList
+    return make_app(view, cookie_store=True, revocations=RevocationList(),
+                    **kwargs)
+
+
+def test_cookie_store():
+    app = cookie_store_app()
+    app.get('/')
+    payload = deserialize_cookie(app.cookies['session'])
+    assert payload['d'] == {'foo': 'bar'}
+    assert load_session(payload['id']) is None
+
+    app = cookie_store_app(read_view)
+    app.set_cookie('session', serialize_cookie(payload))
+    assert app.get('/').text == 'bar'
+
+
+def test_cookie_store_requires_secret():
+    with pytest.raises(ValueError):
+        MySessionFactory(None, database=DBNAME, cookie_store=True)
+
+
+def test_cookie_store_fallback_when_too_large():
+    def view(request):
+        request.session['foo'] = 'x' * 1000
+        return Response('OK')
+
+    app = cookie_store_app(view, cookie_max_size=500)
+    app.get('/')
+    session_id = deserialize_cookie(app.cookies['session'])
+    assert load_session(session_id) == {'foo': 'x' * 1000}
+
+
+def test_cookie_store_invalidate_revokes():
+    def logout(request):
+        request.session.invalidate()
+        return Response('OK')
+
+    app = cookie_store_app()
+    app.get('/')
+    cookie = app.cookies['session']
+    payload = deserialize_cookie(cookie)
+    revocations = app.app.registry.queryUtility(ISessionFactory).revocations
+
+    logout_app = make_app(logout, cookie_store=True, revocations=revocations)
+    logout_app.set_cookie('session', cookie)
+    logout_app.get('/')
+    assert payload['id'] in revocations
+
+    replay = make_app(read_view, cookie_store=True, revocations=revocations)
+    replay.set_cookie('session', cookie)
+    assert replay.get('/').text == 'None'
+
+
+def test_revocation_list_persisted():
+    from unsafe.session import RevocationList
+
+    now = int(time.time())
+    revocations = RevocationList(DBNAME)
+    revocations.revoke('revoked', now + 100)
+    revocations.revoke('expired', now - 100)
+    other = RevocationList(DBNAME)
+    assert 'revoked' in other
+    assert 'expired' not in other
+    revocations.close()
+    other.close()
+
+
+def test_user_id_stored():
+    from unsafe.session import remove_user_sessions, user_session_counts
+
+    def login_view(request):
+        request.session['auth.userid'] = 42
+        return Response('OK')
+
+    app = make_app(login_view)
+    app.get('/')
+    session_id = deserialize_cookie(app.cookies['session'])
+    with db.cursor(DBNAME) as cur:
+        cur.execute('SELECT user_id FROM session_store WHERE session_id = ?',
+                    (session_id,))
+        assert cur.fetchone()[0] == 42
+
+    assert user_session_counts(DBNAME)[42] == 1
+    assert remove_user_sessions(42, DBNAME) == 1
+    assert load_session(session_id) is None
+
+
+def test_remove_user_sessions_logs_out_cached_session():
+    def view(request):
+        if 'login' in request.params:
+            request.session['auth.userid'] = 43
+        return Response(str(request.session.get('auth.userid')))
+
+    app = make_app(view, cache_size=10)
+    other = make_app(view, cache_size=10)
+    factory = app.app.registry.queryUtility(ISessionFactory)
+    assert app.get('/?login').text == '43'
+    assert app.get('/').text == '43'
+    other.get('/?login')
+
+    assert factory.remove_user_sessions(43) == 2
+    assert app.get('/').text == 'None'
+
+
+def test_session_stats_and_optimize():
+    from unsafe.session import optimize_sessions, purge_sessions, session_stats
+
+    now = int(time.time())
+    purge_sessions(DBNAME)
+    save_session('small', {'a': 1})
+    save_session('large', {'a': 'x' * 2000}, expires_at=now - 10)
+    stats = session_stats(DBNAME)
+    assert stats['rows'] == 2
+    assert stats['expired'] == 1
+    assert stats['sizes'][256] == 1
+    assert stats['sizes'][4096] == 1
+    assert stats['file_size'] == stats['page_count'] * stats['page_size']
+
+    purge_sessions(DBNAME)
+    assert optimize_sessions(DBNAME, full=True) >= 0
+    assert session_stats(DBNAME)['freelist_count'] == 0
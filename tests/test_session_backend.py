@@ -0,0 +1,163 @@
+import time
+
+import pytest
+
+from unsafe.session_backend import (
+    MemorySessionBackend,
+    SessionRecord,
+    SessionSweeper,
+    ShardedSQLiteSessionBackend,
+    SQLiteSessionBackend,
+    shard_databases,
+)
+
+
+@pytest.fixture(params=['sqlite', 'sharded', 'memory'])
+def backend(request, tmp_path):
+    database = str(tmp_path / 'sessions.db')
+    if request.param == 'sqlite':
+        b = SQLiteSessionBackend(database)
+    elif request.param == 'sharded':
+        b = ShardedSQLiteSessionBackend(database, 3)
+    else:
+        b = MemorySessionBackend(database)
+    yield b
+    b.close()
+
+
+def record(expires_in=100, userdata='{}', user_id=None):
+    now = int(time.time())
+    return SessionRecord(now + expires_in, now, userdata, user_id)
+
+
+def test_insert_load(backend):
+    backend.insert('a', record(userdata='{"foo": 1}'))
+    assert backend.load('a').userdata == '{"foo": 1}'
+    assert backend.load('b') is None
+
+
+def test_update_touch_delete(backend):
+    r = record()
+    backend.insert('a', r)
+    assert backend.update('a', r.expires_at + 10, '{"x": 2}')
+    assert backend.load('a') == (r.expires_at + 10, r.created_at, '{"x": 2}',
+                                 None)
+    assert backend.touch('a', r.expires_at + 20)
+    assert backend.load('a').expires_at == r.expires_at + 20
+    backend.delete('a')
+    assert backend.load('a') is None
+    assert not backend.update('a', r.expires_at, '{}')
+    assert not backend.touch('a', r.expires_at)
+
+
+def test_touch_many_never_moves_backwards(backend):
+    r = record()
+    backend.insert('a', r)
+    backend.insert('b', r)
+    assert backend.touch_many({'a': r.expires_at + 10,
+                               'b': r.expires_at - 10,
+                               'c': r.expires_at}) == 1
+    assert backend.load('a').expires_at == r.expires_at + 10
+    assert backend.load('b').expires_at == r.expires_at
+
+
+def test_expire(backend):
+    backend.insert('old', record(expires_in=-10))
+    backend.insert('new', record())
+    assert backend.expire() == 1
+    assert backend.load('old') is None
+    assert backend.load('new') is not None
+
+
+def test_expire_limit(backend):
+    for i in range(10):
+        backend.insert(f'old{i}', record(expires_in=-10))
+    backend.insert('new', record())
+    assert backend.expire(limit=4) == 4
+    assert backend.expire(limit=4) == 4
+    assert backend.expire(limit=4) == 2
+    assert backend.expire(limit=4) == 0
+    assert backend.load('new') is not None
+
+
+def test_sweeper(backend):
+    for i in range(25):
+        backend.insert(f'old{i}', record(expires_in=-10))
+    backend.insert('new', record())
+    sweeper = SessionSweeper(backend, batch_size=10, pause=0)
+    assert sweeper.sweep() == 25
+    assert backend.load('new') is not None
+    assert sweeper.sweep() == 0
+
+
+def test_sessions_by_user(backend):
+    backend.insert('a', record(user_id=1))
+    backend.insert('b', record(user_id=1))
+    backend.insert('c', record(user_id=2))
+    backend.insert('d', record(expires_in=-10, user_id=2))
+    backend.insert('anonymous', record())
+    assert backend.load('a').user_id == 1
+    assert backend.user_counts() == {1: 2, 2: 1}
+
+    backend.update('anonymous', int(time.time()) + 100, '{}', 2)
+    assert backend.user_counts() == {1: 2, 2: 2}
+
+    assert backend.delete_user(1) == 2
+    assert backend.load('a') is None
+    assert backend.load('c') is not None
+
+
+def test_sqlite_schema_upgrade(tmp_path):
+    import sqlite3
+    database = str(tmp_path / 'sessions.db')
+    conn = sqlite3.connect(database)
+    conn.execute('CREATE TABLE session_store (session_id TEXT PRIMARY KEY,'
+                 ' expires_at INTEGER NOT NULL, created_at INTEGER NOT NULL,'
+                 ' userdata TEXT NOT NULL)')
+    conn.execute("INSERT INTO session_store VALUES ('old', 1, 1, '{}')")
+    conn.commit()
+    conn.close()
+
+    backend = SQLiteSessionBackend(database)
+    assert backend.load('old') == SessionRecord(1, 1, '{}', None)
+    backend.close()
+
+
+def test_sqlite_schema(tmp_path):
+    backend = SQLiteSessionBackend(str(tmp_path / 'sessions.db'))
+    with backend._cursor() as cur:
+        cur.execute("SELECT name FROM sqlite_master WHERE type = 'index'"
+                    " AND tbl_name = 'session_store'")
+        assert 'session_store_expires_at' in {row[0] for row in cur}
+        cur.execute('PRAGMA auto_vacuum')
+        assert cur.fetchone()[0] == 2  # incremental
+    backend.close()
+
+
+def test_sharded_spreads_sessions(tmp_path):
+    database = str(tmp_path / 'sessions.db')
+    backend = ShardedSQLiteSessionBackend(database, 4)
+    for i in range(40):
+        backend.insert(f'session-{i}', record())
+    counts = []
+    for shard in backend.shards:
+        with shard._cursor() as cur:
+            cur.execute('SELECT COUNT(*) FROM session_store')
+            counts.append(cur.fetchone()[0])
+    backend.close()
+    assert sum(counts) == 40
+    assert all(counts)
+    assert backend.databases == shard_databases(database, 4)
+
+
+def test_memory_snapshot_restore(tmp_path):
+    database = str(tmp_path / 'snapshot.db')
+    backend = MemorySessionBackend(database)
+    backend.insert('a', record(userdata='{"a": 1}'))
+    backend.insert('expired', record(expires_in=-10))
+    backend.close()
+
+    restored = MemorySessionBackend(database)
+    assert restored.load('a').userdata == '{"a": 1}'
+    assert restored.load('expired') is None
+    restored.close()
@@ -0,0 +1,50 @@
+import json
+
+import pytest
+
+from unsafe.session_serializer import (
+    COMPRESSED,
+    FORMAT_JSON,
+    FORMAT_MARSHAL,
+    SessionSerializer,
+)
+
+DATA = {'auth.userid': 3, 'csrf': 'abc', 'notes': ['x' * 100] * 20}
+
+
+def test_json_is_text():
+    value = SessionSerializer('json').dumps(DATA)
+    assert isinstance(value, str)
+    assert json.loads(value) == DATA
+
+
+def test_marshal_roundtrip():
+    serializer = SessionSerializer('marshal')
+    value = serializer.dumps(DATA)
+    assert value[0] == FORMAT_MARSHAL
+    assert serializer.loads(value) == DATA
+
+
+@pytest.mark.parametrize('fmt,code', [('json', FORMAT_JSON),
+                                      ('marshal', FORMAT_MARSHAL)])
+def test_compressed_roundtrip(fmt, code):
+    serializer = SessionSerializer(fmt, compress_threshold=100)
+    value = serializer.dumps(DATA)
+    assert value[0] == code | COMPRESSED
+    assert serializer.loads(value) == DATA
+    assert serializer.dumps({'a': 1})[0] in (code, '{')
+
+
+def test_loads_any_format():
+    json_serializer = SessionSerializer('json')
+    marshal_serializer = SessionSerializer('marshal', compress_threshold=10)
+    legacy = json.dumps(DATA)
+    assert marshal_serializer.loads(legacy) == DATA
+    assert json_serializer.loads(marshal_serializer.dumps(DATA)) == DATA
+
+
+def test_unknown_format():
+    with pytest.raises(ValueError):
+        SessionSerializer('pickle')
+    with pytest.raises(ValueError):
+        SessionSerializer().loads(b'\x7fxyz')
@@ -0,0 +1,88 @@
+import os
+
+import pytest
+from pyramid.request import Request
+from pyramid.testing import DummyRequest
+
+import unsafe.app
+from unsafe import db
+from unsafe.streaming import StreamingAppIter
+
+DBNAME_APP = 'test-streaming.db'
+DBNAME_SESSIONS = 'test-streaming-sessions.db'
+
+
+def setup_module():
+    for fn in (DBNAME_APP, DBNAME_SESSIONS):
+        try:
+            os.remove(fn)
+        except FileNotFoundError:  # pragma: no cover
+            pass
+
+    db.init(DBNAME_APP)
+
+
+def make_app(**settings):
+    settings = {
+        'db.app': DBNAME_APP,
+        'db.sessions': DBNAME_SESSIONS,
+        **settings,
+    }
+    return unsafe.app.main({}, **settings)
+
+
+def make_request():
+    request = DummyRequest()
+    request.exception = None
+    return request
+
+
+def test_chunks_and_finished_callbacks():
+    request = make_request()
+    finished = []
+    request.add_finished_callback(lambda r: finished.append(r.exception))
+
+    app_iter = StreamingAppIter(request, iter(['ab', 'c', 'å', 'd']),
+                                chunk_size=3)
+    assert not request.finished_callbacks
+    assert list(app_iter) == [b'abc', 'åd'.encode('utf-8')]
+    assert finished == []
+    app_iter.close()
+    assert finished == [None]
+
+
+def test_error_reaches_finished_callbacks():
+    def output():
+        yield 'a'
+        raise ValueError('broken')
+
+    request = make_request()
+    finished = []
+    request.add_finished_callback(lambda r: finished.append(r.exception))
+    app_iter = StreamingAppIter(request, output())
+    with pytest.raises(ValueError):
+        list(app_iter)
+    app_iter.close()
+    assert isinstance(finished[0], ValueError)
+
+
+def test_same_page_as_renderer():
+    rendered = Request.blank('/posts?limit=1').get_response(make_app())
+    app = make_app(**{'templates.streaming': 'true'})
+    streamed = Request.blank('/posts?limit=1').get_response(app)
+    assert isinstance(streamed.app_iter, StreamingAppIter)
+    assert streamed.content_length is None
+    assert 'Äldre inlägg' in streamed.text
+    assert streamed.text == rendered.text
+
+
+def test_connection_released_on_close():
+    app = make_app(**{'templates.streaming': 'true'})
+    pool = app.registry.db_pool
+    response = Request.blank('/posts').get_response(app)
+    assert pool.stats()['idle'] == 0
+    chunks = list(response.app_iter)
+    assert chunks
+    assert pool.stats()['idle'] == 0
+    response.app_iter.close()
+    assert pool.stats()['idle'] == 1
@@ -0,0 +1,30 @@
+import threading
+
+from unsafe.tasks import PeriodicTask
+
+
+def test_periodic_task_runs_and_stops():
+    called = threading.Event()
+    task = PeriodicTask(called.set, 60)
+    task.start()
+    task.start()
+    task.wake()
+    assert called.wait(5)
+    task.stop(timeout=5)
+    assert not task.running
+
+
+def test_periodic_task_survives_errors():
+    calls = []
+    done = threading.Event()
+
+    def func():
+        calls.append(1)
+        if len(calls) == 1:
+            raise RuntimeError('boom')
+        done.set()
+
+    task = PeriodicTask(func, 0.01)
+    task.start()
+    assert done.wait(5)
+    task.stop(timeout=5)
@@ -0,0 +1,59 @@
+import pytest
+from pyramid import testing
+from pyramid.httpexceptions import HTTPTooManyRequests
+
+from unsafe.throttle import LoginThrottle, TokenBucket
+
+
+def test_token_bucket_burst_and_refill():
+    bucket = TokenBucket(1, 3)
+    assert [bucket.take('a', now=100) for _ in range(4)] == \
+        [True, True, True, False]
+    assert bucket.take('b', now=100)
+    assert bucket.take('a', now=101)
+    assert not bucket.take('a', now=101)
+
+
+def test_token_bucket_max_keys():
+    bucket = TokenBucket(1, 1, max_keys=2)
+    for key in 'abc':
+        bucket.take(key, now=100)
+    assert len(bucket) == 2
+    assert bucket.take('a', now=100)
+
+
+def make_request(client_addr='10.0.0.1'):
+    request = testing.DummyRequest()
+    request.client_addr = client_addr
+    return request
+
+
+def test_login_throttle_per_user():
+    throttle = LoginThrottle(ip_burst=100, user_burst=2)
+    throttle.check(make_request('10.0.0.1'), 'bosse')
+    throttle.check(make_request('10.0.0.2'), 'Bosse ')
+    with pytest.raises(HTTPTooManyRequests):
+        throttle.check(make_request('10.0.0.3'), 'bosse')
+    throttle.check(make_request('10.0.0.3'), 'joe')
+    assert throttle.stats() == {'allowed': 3, 'rejected_ip': 0,
+                                'rejected_user': 1}
+
+
+def test_login_throttle_per_ip():
+    throttle = LoginThrottle(ip_burst=2, user_burst=100)
+    assert throttle.allow('10.0.0.1', 'a')
+    assert throttle.allow('10.0.0.1', 'b')
+    assert not throttle.allow('10.0.0.1', 'c')
+    assert throttle.allow('10.0.0.2', 'c')
+    assert throttle.stats()['rejected_ip'] == 1
+
+
+def test_login_throttle_persisted(tmp_path):
+    database = str(tmp_path / 'throttle.db')
+    throttle = LoginThrottle(ip_burst=1, database=database)
+    assert throttle.allow('10.0.0.1', 'bosse')
+    throttle.close()
+
+    restored = LoginThrottle(ip_burst=1, database=database)
+    assert not restored.allow('10.0.0.1', 'bosse')
+    restored.close()
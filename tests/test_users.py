@@ -80,3 +80,168 @@ def test_authenticate_update_hash(conn):
     user3 = userdb.from_username(conn, 'bosse')
     assert user3 is not None
     assert user3.password == user2.password
+
+
+def test_from_ids(conn):
+    users = userdb.from_ids(conn, [1, 3, -1, 1])
+    assert sorted(users) == [1, 3]
+    assert users[1].username == 'admin'
+    assert users[3].username == 'joe'
+
+
+def test_from_ids_empty(conn):
+    assert userdb.from_ids(conn, []) == {}
+
+
+def test_user_loader_batches(conn):
+    statements = []
+    conn.set_trace_callback(statements.append)
+    loader = userdb.UserLoader(conn)
+    loader.queue(1, 2, 3)
+    assert loader[2].username == 'jane'
+    assert loader.load(1).username == 'admin'
+    assert sorted(loader.load_many([3, -1])) == [3]
+    conn.set_trace_callback(None)
+    assert len(statements) == 2
+
+
+def test_user_loader_raises(conn):
+    loader = userdb.UserLoader(conn)
+    with pytest.raises(userdb.UserNotFoundError):
+        loader.load(-1)
+
+
+def test_user_loader_uses_cache(conn):
+    cache = userdb.UserCache(10, ttl=60)
+    assert userdb.UserLoader(conn, cache).load(1).username == 'admin'
+
+    statements = []
+    conn.set_trace_callback(statements.append)
+    user = userdb.UserLoader(conn, cache).load(1)
+    conn.set_trace_callback(None)
+    assert user.username == 'admin'
+    assert not statements
+    assert cache.stats()['hits'] == 1
+
+    user.groups.append('hacker')
+    assert 'hacker' not in cache.get(1).groups
+
+
+def test_user_cache_invalidated_on_change(conn):
+    cache = userdb.UserCache(10, ttl=60)
+    user = userdb.UserLoader(conn, cache).load(2)
+    userdb._replace_user_hash(conn, 2, user.password + 'x')
+    assert cache.get(2) is None
+
+    # Committed before the cache was invalidated
+    other = db.connect(DBNAME)
+    try:
+        assert userdb.UserLoader(other).load(2).password == user.password + 'x'
+    finally:
+        other.close()
+    userdb._replace_user_hash(conn, 2, user.password)
+
+
+def test_insert_many(conn):
+    users = [userdb.User(None, f'bulk{i}', None, 'hash', ['g']) for i in range(3)]
+    with conn:
+        assert userdb.insert_many(conn, users) == 3
+    assert userdb.existing_usernames(conn, ['bulk1', 'bulk2', 'nobody']) == \
+        {'bulk1', 'bulk2'}
+    assert userdb.from_username(conn, 'bulk0').groups == ['g']
+
+
+@pytest.mark.slow
+def test_import_users(conn):
+    import io
+    from unsafe.scripts.users import import_users, parse_user
+
+    users = [parse_user({'username': 'imported', 'password': 'pw',
+                         'groups': 'a b'}, 1),
+             parse_user({'username': 'bosse', 'password': 'pw'}, 2)]
+    out = io.StringIO()
+    assert import_users(DBNAME, users, workers=1, out=out) == 1
+    assert 'Skipping existing user bosse' in out.getvalue()
+    user = userdb.authenticate(conn, 'imported', 'pw')
+    assert user.groups == ['a', 'b']
+
+
+def test_update_ini(tmp_path):
+    from unsafe.scripts.users import update_ini
+
+    path = tmp_path / 'test.ini'
+    path.write_text('[app:main]\n'
+                    'use = egg:unsafe\n'
+                    '# cost\n'
+                    'passwords.bcrypt.rounds = 12\n'
+                    '\n'
+                    '[server:main]\n'
+                    'port = 6543\n')
+    update_ini(str(path), {'passwords.bcrypt.rounds': 13,
+                           'passwords.pbkdf2_sha256.rounds': 300000})
+    assert path.read_text() == ('[app:main]\n'
+                                'use = egg:unsafe\n'
+                                '# cost\n'
+                                'passwords.bcrypt.rounds = 13\n'
+                                'passwords.pbkdf2_sha256.rounds = 300000\n'
+                                '\n'
+                                '[server:main]\n'
+                                'port = 6543\n')
+
+
+def test_main_uses_config_rounds_with_db(tmp_path):
+    from unsafe.scripts.users import main
+
+    config = tmp_path / 'test.ini'
+    config.write_text('[app:main]\n'
+                      'use = egg:unsafe\n'
+                      'db.app = other.db\n'
+                      'passwords.bcrypt.rounds = 5\n')
+    users = tmp_path / 'users.csv'
+    users.write_text('username,password\nconfigured,pw\n')
+    saved = userdb.pwdctx.to_dict()
+    try:
+        main(['unsafe-users', '--db', DBNAME, '--config', str(config),
+              'import', str(users)])
+    finally:
+        userdb.pwdctx.load(saved)
+
+    conn = db.connect(DBNAME)
+    try:
+        user = userdb.from_username(conn, 'configured')
+    finally:
+        conn.close()
+    assert user.password.startswith('$2b$05$')
+
+
+def test_main_db_without_config(tmp_path, monkeypatch):
+    from unsafe.scripts.users import main
+
+    users = tmp_path / 'users.csv'
+    users.write_text('username,password\nunconfigured,pw\n')
+    dbname = os.path.abspath(DBNAME)
+    monkeypatch.chdir(tmp_path)
+    main(['unsafe-users', '--db', dbname, 'import', str(users)])
+
+    conn = db.connect(dbname)
+    try:
+        assert userdb.from_username(conn, 'unconfigured').user_id
+    finally:
+        conn.close()
+
+
+def test_calibrate_write_requires_config(tmp_path, monkeypatch):
+    from unsafe.scripts.users import main
+
+    monkeypatch.chdir(tmp_path)
+    with pytest.raises(SystemExit, match='production.ini not found'):
+        main(['unsafe-users', '--db', 'x.db', 'calibrate', '--write'])
+
+
+def test_recommend_rounds():
+    from unsafe.hashing import recommend_rounds
+
+    ctx = userdb.pwdctx
+    assert recommend_rounds(ctx, 'bcrypt', 12, 0.4, 0.2) == 11
+    assert recommend_rounds(ctx, 'bcrypt', 4, 1.0, 0.001) == 4
+    assert recommend_rounds(ctx, 'pbkdf2_sha256', 200000, 0.1, 0.25) == 500000
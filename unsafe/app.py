@@ -1,3 +1,4 @@
+import os
 import urllib.parse
 
 from pyramid.config import Configurator
@@ -8,6 +9,7 @@ from pyramid.security import (
 from pyramid.view import view_config, notfound_view_config
 
 from .embed import embeddable
+from .precompile import prepare_templates
 
 __all__ = ['main']
 
@@ -29,24 +31,37 @@ class RootContextFactory:
             ]
 
 
-@view_config(route_name='index', renderer='templates/index.jinja2')
+@view_config(route_name='index', renderer='index.jinja2')
 def index(request):
     return {}
 
 
-@notfound_view_config(decorator=embeddable, renderer='templates/404.jinja2')
+@notfound_view_config(decorator=embeddable, renderer='404.jinja2')
 def not_found_view(request):
     return {
         'path': urllib.parse.unquote(request.path)
     }
 
 
+def configure_templates(config: Configurator):
+    """Set up the Jinja2 renderer with the templates, extensions and
+    filters of the app."""
+    directory = config.registry.settings.get(
+        'jinja2.bytecode_caching_directory')
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    config.include('pyramid_jinja2')
+    config.add_jinja2_search_path('unsafe:templates/')
+    config.include('unsafe.filters')
+    config.include('unsafe.fragments')
+
+
 def main(global_config, **settings):
     config = Configurator(settings=settings)
 
     # Jinja2 template support
-    config.include('pyramid_jinja2')
-    config.add_jinja2_search_path('unsafe:templates/')
+    configure_templates(config)
 
     # Set root context factory that provides a default ACL
     config.set_root_factory(RootContextFactory)
@@ -60,10 +75,12 @@ def main(global_config, **settings):
 
     # Include modules
     config.include('unsafe.auth')
+    config.include('unsafe.conditional')
+    config.include('unsafe.pagecache')
     config.include('unsafe.db')
     config.include('unsafe.embed')
-    config.include('unsafe.filters')
     config.include('unsafe.session')
+    config.include('unsafe.streaming')
 
     # Views
     # config.include('unsafe.admin')
@@ -74,4 +91,6 @@ def main(global_config, **settings):
     # Scan annotations
     config.scan()
 
-    return config.make_wsgi_app()
+    app = config.make_wsgi_app()
+    prepare_templates(app)
+    return app
@@ -3,22 +3,34 @@ import os
 
 from pyramid.config import Configurator
 from pyramid.exceptions import BadCSRFToken
-from pyramid.httpexceptions import HTTPFound, HTTPForbidden
+from pyramid.httpexceptions import (
+    HTTPFound,
+    HTTPForbidden,
+    HTTPServiceUnavailable,
+)
 from pyramid.request import Request
 from pyramid.security import remember, forget
+from pyramid.settings import asbool
 from pyramid.view import view_config, forbidden_view_config
 
 from .embed import embeddable
+from .hashing import HashingOverloadError, HashPool
+from .throttle import LoginThrottle
 from . import db
 
 
 def _get_user(request):
     userid = request.unauthenticated_userid
     if userid is not None:
-        user = db.user.from_id(request.db, userid)
+        user = request.users.load(userid)
         return user
 
 
+def _get_user_loader(request):
+    return db.user.UserLoader(request.db,
+                              getattr(request.registry, 'user_cache', None))
+
+
 def _groupfinder(userid, request):
     user = request.user
     if user is not None:
@@ -61,7 +73,16 @@ def login_view(request: Request):
         if not hmac.compare_digest(csrf_token, expected_csrf_token):
             raise BadCSRFToken()
 
-        user = db.user.authenticate(request.db, username, password)
+        throttle = getattr(request.registry, 'login_throttle', None)
+        if throttle is not None:
+            throttle.check(request, username)
+
+        try:
+            user = db.user.authenticate(
+                request.db, username, password,
+                hash_pool=getattr(request.registry, 'hash_pool', None))
+        except HashingOverloadError:
+            raise HTTPServiceUnavailable(headers={'Retry-After': '5'})
         if user:
             # Important - at the very least generate a new session id at
             # login/logout to prevent session fixation attacks.
@@ -118,12 +139,46 @@ def includeme(config: Configurator):
     """ Setup authentication/authorization.
 
     - Make user object on request object as ``user``
+    - Make a batching user loader available as ``users``
+    - Configure password hash costs from ``passwords.*`` settings
+    - Cache users by id for ``auth.user_cache.ttl`` seconds
+    - Hash passwords in ``auth.hash_pool.workers`` worker processes
+    - Limit login attempts if ``auth.throttle`` is enabled
     - Store authenticated user in session
     - Use ACL authorization (__acl__ in context)
     """
     from pyramid.authentication import SessionAuthenticationPolicy
     from pyramid.authorization import ACLAuthorizationPolicy
+
+    settings = config.registry.settings
+    db.user.configure_pwdctx(settings)
+
+    cache_size = int(settings.get('auth.user_cache.size', 1000))
+    if cache_size:
+        config.registry.user_cache = db.user.UserCache(
+            cache_size, ttl=float(settings.get('auth.user_cache.ttl', 60)))
+
+    workers = int(settings.get('auth.hash_pool.workers', 0))
+    if workers:
+        import atexit
+        hash_pool = HashPool(
+            db.user.pwdctx,
+            workers=workers,
+            queue_size=int(settings.get('auth.hash_pool.queue_size', 16)),
+            timeout=float(settings.get('auth.hash_pool.timeout', 5)))
+        atexit.register(hash_pool.close)
+        config.registry.hash_pool = hash_pool
+
+    if asbool(settings.get('auth.throttle', False)):
+        config.registry.login_throttle = LoginThrottle(
+            ip_rate=float(settings.get('auth.throttle.ip_rate', 10)),
+            ip_burst=float(settings.get('auth.throttle.ip_burst', 20)),
+            user_rate=float(settings.get('auth.throttle.user_rate', 5)),
+            user_burst=float(settings.get('auth.throttle.user_burst', 10)),
+            database=settings.get('auth.throttle.database') or None)
+
     config.add_request_method(_get_user, 'user', reify=True)
+    config.add_request_method(_get_user_loader, 'users', reify=True)
     authn_policy = SessionAuthenticationPolicy(callback=_groupfinder)
     authz_policy = ACLAuthorizationPolicy()
     config.set_authentication_policy(authn_policy)
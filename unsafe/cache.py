@@ -0,0 +1,175 @@
+"""
+In-process caches.
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+__all__ = ['LRUCache']
+
+_missing = object()
+
+
+class LRUCache:
+    """Thread-safe, size bounded least recently used cache.
+
+    Keeps hit/miss/eviction counters for reporting, see :meth:`stats`.
+
+    The cache can also be bounded by the total size of its values, as
+    measured by ``sizeof``, for values such as rendered pages whose sizes
+    vary a lot.
+
+    :param maxsize: maximum number of entries
+    :param ttl: seconds after which an entry expires, ``None`` to keep
+        entries until evicted
+    :param maxbytes: maximum total size of the values, ``None`` for no limit
+    :param sizeof: function returning the size of a value in bytes
+    :param on_evict: called with the key and value of entries evicted to
+        stay within the limits, outside of the cache lock
+    """
+
+    def __init__(self, maxsize: int, *, ttl: Optional[float] = None,
+                 maxbytes: Optional[int] = None,
+                 sizeof: Callable[[Any], int] = len,
+                 on_evict: Optional[Callable[[Hashable, Any], None]] = None):
+        if maxsize < 1:
+            raise ValueError('Cache size must be at least 1')
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.maxbytes = maxbytes
+        self.sizeof = sizeof
+        self.on_evict = on_evict
+        # key -> (value, expiry time, size)
+        self._data: OrderedDict = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._expirations = 0
+
+    def get(self, key: Hashable, default=None) -> Any:
+        """Get a cached value, marking it as recently used."""
+        with self._lock:
+            entry = self._data.get(key, _missing)
+            if entry is _missing:
+                self._misses += 1
+                return default
+            value, expires, size = entry
+            if expires is not None and expires <= time.monotonic():
+                del self._data[key]
+                self._bytes -= size
+                self._expirations += 1
+                self._misses += 1
+                return default
+            self._data.move_to_end(key)
+            self._hits += 1
+            return value
+
+    def put(self, key: Hashable, value: Any):
+        """Add or replace a value, evicting the least recently used entries
+        if the cache is full.
+
+        A value larger than ``maxbytes`` is not added.
+        """
+        expires = time.monotonic() + self.ttl if self.ttl else None
+        size = self.sizeof(value) if self.maxbytes is not None else 0
+        evicted: List[Tuple[Hashable, Any]] = []
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._bytes -= old[2]
+            if self.maxbytes is not None and size > self.maxbytes:
+                return
+            self._data[key] = (value, expires, size)
+            self._bytes += size
+            while (len(self._data) > self.maxsize or
+                   self.maxbytes is not None and self._bytes > self.maxbytes):
+                old_key, (old_value, _, old_size) = \
+                    self._data.popitem(last=False)
+                self._bytes -= old_size
+                self._evictions += 1
+                evicted.append((old_key, old_value))
+        if self.on_evict:
+            for item in evicted:
+                self.on_evict(*item)
+
+    def replace(self, key: Hashable, value: Any) -> bool:
+        """Replace the value of an unexpired entry, keeping its expiry time
+        and position.
+
+        Returns whether there was such an entry. Entries are only evicted
+        to stay within ``maxbytes`` on the next :meth:`put`.
+        """
+        with self._lock:
+            entry = self._data.get(key, _missing)
+            if entry is _missing:
+                return False
+            _, expires, size = entry
+            if expires is not None and expires <= time.monotonic():
+                return False
+            new_size = self.sizeof(value) if self.maxbytes is not None else 0
+            self._data[key] = (value, expires, new_size)
+            self._bytes += new_size - size
+            return True
+
+    def pop(self, key: Hashable, default=None) -> Any:
+        """Remove an entry, returning its value."""
+        with self._lock:
+            entry = self._data.pop(key, _missing)
+            if entry is _missing:
+                return default
+            self._bytes -= entry[2]
+            return entry[0]
+
+    def pop_matching(self, predicate: Callable[[Hashable, Any], bool]) -> int:
+        """Remove the entries for which ``predicate(key, value)`` is true,
+        returning the number removed."""
+        with self._lock:
+            keys = [key for key, (value, _, _) in self._data.items()
+                    if predicate(key, value)]
+            for key in keys:
+                self._bytes -= self._data.pop(key)[2]
+            return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            entry = self._data.get(key)
+            return entry is not None and (entry[1] is None
+                                          or entry[1] > time.monotonic())
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._data)
+
+    def stats(self) -> Dict[str, Any]:
+        """Cache counters.
+
+        - ``hits``, ``misses``: lookups that did or did not find a value
+        - ``hit_rate``: fraction of lookups that were hits
+        - ``evictions``: entries dropped to stay within ``maxsize``
+        - ``expirations``: entries dropped because they were older than
+          ``ttl``
+        - ``size``, ``maxsize``: current and maximum number of entries
+        - ``bytes``, ``maxbytes``: current and maximum total size of the
+          values, if the cache is bounded by size
+        """
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_rate': self._hits / lookups if lookups else 0.0,
+                'evictions': self._evictions,
+                'expirations': self._expirations,
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'bytes': self._bytes,
+                'maxbytes': self.maxbytes,
+            }
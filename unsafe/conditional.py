@@ -0,0 +1,184 @@
+"""
+Conditional GET for listing and topic pages.
+
+The posts and notes listings query the database and render a template on
+every request, even when nothing changed since the browser fetched the
+page. :func:`conditional_get_tween_factory` computes cheap validators for
+these pages before the view runs and answers a matching ``If-None-Match``
+or ``If-Modified-Since`` with ``304 Not Modified``, without calling the
+view or the renderer.
+"""
+import hashlib
+import os
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Callable, Dict, Optional
+
+from pyramid.config import Configurator
+from pyramid.csrf import get_csrf_token
+from pyramid.httpexceptions import HTTPNotModified
+from pyramid.interfaces import ICSRFStoragePolicy, IRoutesMapper
+from pyramid.request import Request
+from pyramid.response import Response
+from pyramid.settings import asbool
+
+from .csrf import HMACCSRFStoragePolicy
+
+__all__ = [
+    'Validators',
+    'conditional_get_tween_factory',
+]
+
+TEMPLATE_PATH = os.path.join(os.path.dirname(__file__), 'templates')
+
+
+@dataclass
+class Validators:
+    """What a page depends on.
+
+    :param key: values that change whenever the page changes
+    :param last_modified: time of the last change, if ``key`` changes only
+        when this time changes too. ``If-Modified-Since`` does not identify
+        the user, so pages that differ per user, which includes every page
+        showing the login state, must not set it.
+    """
+    key: tuple
+    last_modified: Optional[datetime] = None
+
+
+def template_mtime(path: str = TEMPLATE_PATH) -> float:
+    """Latest modification time of the templates under ``path``."""
+    mtime = 0.0
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            stat = os.stat(os.path.join(dirpath, filename))
+            mtime = max(mtime, stat.st_mtime)
+    return mtime
+
+
+def _csrf_key(request: Request) -> tuple:
+    token = get_csrf_token(request)
+    policy = request.registry.queryUtility(ICSRFStoragePolicy)
+    if isinstance(policy, HMACCSRFStoragePolicy):
+        # The token changes at the start of every window
+        return token, int(time.time()) // policy.window
+    return token,
+
+
+def posts_validators(request: Request, matchdict: dict) -> Validators:
+    counts = request.db.execute(
+        'SELECT COUNT(*), MAX(updated_at), TOTAL(likes) FROM post').fetchone()
+    # The page shows the names of the authors
+    authors = request.db.execute(
+        "SELECT group_concat(user_id || ':' || username, ' ') FROM"
+        ' (SELECT user_id, username FROM user'
+        '  WHERE user_id IN (SELECT user_id FROM post) ORDER BY user_id)'
+    ).fetchone()
+    return Validators(tuple(counts) + tuple(authors) + _csrf_key(request))
+
+
+def notes_validators(request: Request, matchdict: dict) -> Validators:
+    counts = request.db.execute(
+        'SELECT COUNT(*), MAX(updated_at) FROM note WHERE user_id = ?',
+        (request.unauthenticated_userid,)).fetchone()
+    return Validators(tuple(counts))
+
+
+def topic_validators(request: Request,
+                     matchdict: dict) -> Optional[Validators]:
+    topic = matchdict.get('topic')
+    if topic is not None:
+        template = os.path.join(TEMPLATE_PATH, 'topics', f'{topic}.jinja2')
+        if not os.path.isfile(template):
+            return None
+    # Topics are static, only the templates and the login state in the
+    # layout change, which are part of the ETag
+    return Validators(())
+
+
+#: Functions computing the validators of a page by route name. A function
+#: may return ``None`` to skip conditional handling of a request.
+ROUTE_VALIDATORS: Dict[str, Callable[..., Optional[Validators]]] = {
+    'notes': notes_validators,
+    'posts': posts_validators,
+    'topic': topic_validators,
+    'topics': topic_validators,
+}
+
+
+def conditional_get_tween_factory(handler, registry):
+    """Tween answering conditional GET requests for the routes in
+    :data:`ROUTE_VALIDATORS`.
+
+    The ETag is a digest of the route validators, the query string, the
+    user id and the modification time of the templates. Pages differ per
+    user, so responses are marked ``private`` with ``Vary: Cookie``, and
+    must be revalidated on every use.
+
+    Validators are computed before the view runs. If the data changes
+    while the view runs, the next request gets a fresh page instead of a
+    ``304`` since its ETag no longer matches.
+    """
+    settings = registry.settings
+    reload_templates = asbool(settings.get('pyramid.reload_templates', False))
+    templates_changed = template_mtime()
+
+    def tween(request: Request) -> Response:
+        nonlocal templates_changed
+
+        if request.method not in ('GET', 'HEAD'):
+            return handler(request)
+        mapper = registry.queryUtility(IRoutesMapper)
+        info = mapper(request) if mapper else None
+        route = info and info['route']
+        compute = route and ROUTE_VALIDATORS.get(route.name)
+        if not compute:
+            return handler(request)
+        validators = compute(request, info['match'])
+        if validators is None:
+            return handler(request)
+
+        if reload_templates:
+            templates_changed = template_mtime()
+        key = (route.name, request.query_string,
+               request.unauthenticated_userid, templates_changed) + \
+            validators.key
+        etag = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+        last_modified = None
+        if validators.last_modified is not None:
+            last_modified = max(
+                validators.last_modified,
+                datetime.fromtimestamp(int(templates_changed), timezone.utc))
+
+        def set_validators(response: Response):
+            response.etag = etag
+            response.last_modified = last_modified
+            response.cache_control = 'private, no-cache'
+            response.vary = tuple(response.vary or ()) + ('Cookie',)
+
+        if request.if_none_match:
+            not_modified = etag in request.if_none_match
+        else:
+            not_modified = (last_modified is not None and
+                            request.if_modified_since is not None and
+                            last_modified <= request.if_modified_since)
+        if not_modified:
+            response = HTTPNotModified()
+            set_validators(response)
+            return response
+
+        response = handler(request)
+        if response.status_code == 200:
+            set_validators(response)
+        return response
+
+    return tween
+
+
+def includeme(config: Configurator):
+    """Add the conditional GET tween unless the ``conditional_get`` setting
+    is false."""
+    settings = config.registry.settings
+    if asbool(settings.get('conditional_get', True)):
+        config.add_tween('unsafe.conditional.conditional_get_tween_factory')
@@ -0,0 +1,94 @@
+"""
+Stateless CSRF tokens.
+
+Pyramid's ``SessionCSRFStoragePolicy`` stores a random token in the session,
+which creates a session (a database row and a cookie) for every visitor that
+is shown a page with a form. :class:`HMACCSRFStoragePolicy` instead derives
+the token from the session id and the current time window, so nothing has to
+be stored.
+"""
+import hashlib
+import hmac
+import time
+from typing import Optional
+
+from zope.interface import implementer
+from pyramid.interfaces import ICSRFStoragePolicy
+from pyramid.request import Request
+
+__all__ = ['HMACCSRFStoragePolicy']
+
+
+@implementer(ICSRFStoragePolicy)
+class HMACCSRFStoragePolicy:
+    """CSRF tokens computed as an HMAC of the session id and a time window.
+
+    Tokens have the form ``<window>-<hex digest>``. A token is accepted in
+    the window it was issued and the following one, i.e. for between
+    ``window`` and ``2 * window`` seconds.
+
+    The session id is read from the session cookie without loading the
+    session, so getting or checking a token never reads or writes session
+    data.
+
+    Tokens only protect forms of visitors with a session. Every visitor
+    without a session would get the same token, which anyone can read from
+    a page, so :meth:`check_csrf_token` rejects all tokens of requests
+    without a session. All actions of this app that change data require a
+    logged in user, who has a session. Forms for visitors without a
+    session, such as the login form, need a protection of their own, see
+    :mod:`unsafe.auth`.
+
+    :param secret: secret key, should not be shared with other uses
+    :param window: length of a time window in seconds
+    :param hashalg: HMAC digest algorithm
+    """
+
+    def __init__(self, secret: str, *, window: int = 3600,
+                 hashalg: str = 'sha256'):
+        if not secret:
+            raise ValueError('HMACCSRFStoragePolicy requires a secret')
+        self.secret = secret.encode('utf-8')
+        self.window = window
+        self.hashalg = hashlib.new(hashalg).name
+
+    def _session_id(self, request: Request) -> str:
+        session_id: Optional[str] = getattr(request.session, 'session_id',
+                                            None)
+        return session_id or ''
+
+    def _token(self, session_id: str, window: int) -> str:
+        message = f'{window}:{session_id}'.encode('utf-8')
+        digest = hmac.new(self.secret, message, self.hashalg).hexdigest()
+        return f'{window}-{digest}'
+
+    def new_csrf_token(self, request: Request) -> str:
+        """Tokens are not stored, so this is the same as
+        :meth:`get_csrf_token`."""
+        return self.get_csrf_token(request)
+
+    def get_csrf_token(self, request: Request) -> str:
+        """Return the token for the session and the current time window."""
+        window = int(time.time()) // self.window
+        return self._token(self._session_id(request), window)
+
+    def check_csrf_token(self, request: Request, supplied_token: str) -> bool:
+        """Check a token in constant time, accepting tokens from the current
+        and the previous time window. Tokens are never accepted without a
+        session."""
+        session_id = self._session_id(request)
+        window_str, _, _ = (supplied_token or '').partition('-')
+        try:
+            window = int(window_str)
+        except ValueError:
+            window = -1
+
+        current = int(time.time()) // self.window
+        if window not in (current, current - 1):
+            # Compare anyway to not reveal the reason for the failure
+            window = current
+
+        expected = self._token(session_id, window)
+        return hmac.compare_digest(expected.encode('utf-8'),
+                                   (supplied_token or '').encode('utf-8')) \
+            and bool(session_id)
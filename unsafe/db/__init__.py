@@ -1,6 +1,6 @@
 import os
 import sqlite3
-from typing import Union
+from typing import Optional, Union
 
 from pyramid.config import Configurator
 from pyramid.request import Request
@@ -9,25 +9,39 @@ from . import note
 from . import post
 from . import user
 from .db import *
+from .schema import migrate, migrations, pending_migrations, schema_version
+from .pool import ConnectionPool, PoolTimeoutError
 
 
 def init(db: Union[str, sqlite3.Connection]):
-    """Initialize database, creating tables and loading initial data."""
+    """Initialize database, creating tables, loading initial data and
+    applying all migrations."""
     pkg_path = os.path.dirname(__file__)
     sql_path =  os.path.normpath(os.path.join(pkg_path, '..', 'sql'))
     runscripts(db, 'db-create.sql', 'db-init.sql', script_path=sql_path)
+    migrate(db)
 
 
-def request_connection_factory(dbname: str):
+def request_connection_factory(dbname: str,
+                               pool: Optional[ConnectionPool] = None,
+                               busy_timeout: float = 5):
     def get_connection(request: Request):
-        conn = connect(dbname)
+        if pool:
+            conn = pool.acquire()
+        else:
+            conn = connect(dbname, timeout=busy_timeout)
 
         def commit_callback(request):
-            if request.exception is not None:
-                conn.rollback()
-            else:
-                conn.commit()
-            conn.close()
+            try:
+                if request.exception is not None:
+                    conn.rollback()
+                else:
+                    conn.commit()
+            finally:
+                if pool:
+                    pool.release(conn)
+                else:
+                    conn.close()
 
         request.add_finished_callback(commit_callback)
         return conn
@@ -45,6 +59,22 @@ def includeme(config: Configurator):
     Any transaction is commited at the end of the request unless an exception was raised, in which case
     the transaction is rolled back.
 
+    Connections are taken from a :class:`ConnectionPool` unless
+    ``db.pool.size`` is set to 0. Settings:
+
+    ``db.pool.size``
+      Maximum number of open connections. Default: ``5``.
+
+    ``db.pool.timeout``
+      Seconds to wait for a connection when all are in use. Default: ``10``.
+
+    ``db.busy_timeout``
+      Seconds to wait for the database write lock, e.g. while a migration
+      runs, see :mod:`unsafe.db.schema`. Default: ``30``.
+
+    The pool is available as ``registry.db_pool`` for reporting usage
+    statistics.
+
     Example::
 
         def view(request):
@@ -57,15 +87,40 @@ def includeme(config: Configurator):
 
     :param config: pyramid configurator
     """
+    import atexit
     import os
     import logging
 
-    dbname = os.path.normpath(config.registry.settings.get('db.app', 'app.db'))
+    settings = config.registry.settings
+    dbname = os.path.normpath(settings.get('db.app', 'app.db'))
     logging.getLogger(__name__).info('Database: %s', dbname)
 
     # Initialize database on first run
     if not os.path.exists(dbname):  # pragma: no cover
         init(dbname)
-
-    config.add_request_method(request_connection_factory(dbname), 'db',
-                              reify=True)
+    else:
+        conn = connect(dbname)
+        try:
+            pending = pending_migrations(conn)
+        finally:
+            conn.close()
+        if pending:  # pragma: no cover
+            logging.getLogger(__name__).warning(
+                'Database schema is out of date, run unsafe-initdb --migrate'
+                ' to apply: %s', ', '.join(m.name for m in pending))
+
+    busy_timeout = float(settings.get('db.busy_timeout', 30))
+    pool_size = int(settings.get('db.pool.size', 5))
+    if pool_size > 0:
+        pool = ConnectionPool(dbname,
+                              size=pool_size,
+                              timeout=float(settings.get('db.pool.timeout', 10)),
+                              busy_timeout=busy_timeout)
+        atexit.register(pool.close)
+    else:
+        pool = None
+    config.registry.db_pool = pool
+
+    config.add_request_method(
+        request_connection_factory(dbname, pool, busy_timeout), 'db',
+        reify=True)
@@ -1,17 +1,45 @@
 import logging
 import os
 import sqlite3
+import weakref
 from contextlib import contextmanager
-from typing import Iterator, Type, Union
+from typing import Iterator, Optional, Tuple, Type, Union
 
 __all__ = [
     'connect',
     'cursor',
     'fetchall',
     'fetchone',
+    'fts_query',
+    'invalidate_tables',
+    'make_cursor',
+    'parse_cursor',
     'runscripts',
+    'watch_tables',
 ]
 
+# Objects with an ``invalidate(*tables)`` method, see watch_tables
+_watchers: 'weakref.WeakSet' = weakref.WeakSet()
+
+
+def watch_tables(watcher):
+    """Register an object whose ``invalidate(*tables)`` method is called
+    when data is changed, see :func:`invalidate_tables`.
+
+    Only a weak reference to ``watcher`` is kept.
+    """
+    _watchers.add(watcher)
+
+
+def invalidate_tables(*tables: str):
+    """Tell watchers that rows of ``tables`` were changed by this process.
+
+    Called by the functions of this package that change data that pages are
+    cached from. The change may not have been committed yet.
+    """
+    for watcher in list(_watchers):
+        watcher.invalidate(*tables)
+
 
 def runscripts(db: Union[str, sqlite3.Connection], *scripts, script_path=None):
     """
@@ -89,3 +117,36 @@ def fetchall(cur: sqlite3.Cursor, mapping: Type, select: str, params: tuple):
     cur.execute(select, params)
     rows = cur.fetchall()
     return [maprow(mapping, row) for row in rows]
+
+
+def make_cursor(updated_at: str, row_id: int) -> str:
+    """Make a keyset pagination cursor from the sort key of the last row."""
+    return f'{row_id}@{updated_at}'
+
+
+def parse_cursor(value: Optional[str]) -> Optional[Tuple[str, int]]:
+    """Parse a cursor made by :func:`make_cursor`.
+
+    Returns ``(updated_at, row_id)`` or ``None`` if value is empty.
+
+    :raises ValueError: if the cursor is malformed
+    """
+    if not value:
+        return None
+    row_id, sep, updated_at = value.partition('@')
+    if not sep or not updated_at:
+        raise ValueError(f'Invalid cursor: {value!r}')
+    return updated_at, int(row_id)
+
+
+def fts_query(search: Optional[str]) -> Optional[str]:
+    """Make an FTS5 query matching all words of a search string.
+
+    Each word is quoted so that FTS5 query syntax in the search string is
+    taken literally, and matches words starting with it. Returns ``None``
+    if there are no words to search for.
+    """
+    words = (search or '').split()
+    if not words:
+        return None
+    return ' '.join('"' + word.replace('"', '""') + '"*' for word in words)
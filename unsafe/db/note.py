@@ -1,5 +1,5 @@
 from dataclasses import dataclass
-from typing import Optional, List, Union, Any, Tuple
+from typing import Optional, List, Union, Any, Tuple, Iterator
 
 from . import db
 
@@ -17,13 +17,35 @@ class Note:
         return vars(self)
 
 
-def find_notes(conn,
+def find_notes(conn, **filters) -> List[Note]:
+    """Find notes ordered by ``updated_at`` descending.
+
+    See :func:`iter_notes` for the filters.
+    """
+    return list(iter_notes(conn, **filters))
+
+
+def iter_notes(conn,
                *,
                user_id: Optional[int] = None,
                from_date: Optional[str] = None,
                to_date: Optional[str] = None,
                category: Optional[str] = None,
-               search: Optional[str] = None) -> List[Note]:
+               search: Optional[str] = None,
+               after: Optional[Tuple[str, int]] = None,
+               limit: Optional[int] = None) -> Iterator[Note]:
+    """Find notes ordered by ``updated_at`` descending, reading each row as
+    it is needed.
+
+    The statement is executed when the first note is requested and its
+    cursor is closed when the iterator is exhausted or closed.
+
+    :param search: only notes containing words starting with all words of
+        the search string, see :func:`unsafe.db.fts_query`
+    :param after: keyset cursor ``(updated_at, note_id)`` of the last note on
+        the previous page, see :func:`unsafe.db.parse_cursor`
+    :param limit: maximum number of notes to return
+    """
     conditions = []
     params: Union[tuple,Tuple[Any]] = ()
 
@@ -44,18 +66,31 @@ def find_notes(conn,
     if category:
         conditions.append(f"category = '{category}'")
 
-    # SQL-injection safe - but does not handle percent in search string
-    if search:
+    # SQL-injection safe - full-text search, see 0002-fts.sql
+    query = db.fts_query(search)
+    if query:
         #conditions.append(f"LOWER(content) LIKE '%{search.lower()}%'")
-        conditions.append(f"LOWER(content) LIKE ?")
-        params += (f'%{search.lower()}%',)
+        conditions.append('note_id IN (SELECT rowid FROM note_fts'
+                          ' WHERE note_fts MATCH ?)')
+        params += (query,)
+
+    if after:
+        conditions.append('(updated_at, note_id) < (?, ?)')
+        params += tuple(after)
 
     sql = ('SELECT note_id, user_id, category, content, created_at, updated_at'
            ' FROM note' +  # noqa
-           ' WHERE ' + ' AND '.join(conditions) + ' ORDER BY updated_at DESC')
+           ' WHERE ' + ' AND '.join(conditions) +
+           ' ORDER BY updated_at DESC, note_id DESC')
+
+    if limit:
+        sql += ' LIMIT ?'
+        params += (limit,)
 
     with db.cursor(conn) as cur:
-        return db.fetchall(cur, Note, sql, params)
+        cur.execute(sql, params)
+        for row in cur:
+            yield db.maprow(Note, row)
 
 
 def _find_note(cur, note_id):
@@ -0,0 +1,172 @@
+"""
+Bounded pool of SQLite connections shared by request threads.
+
+Opening a connection, enabling foreign keys and setting up the row factory
+for every request is wasted work when the same database file is used over
+and over again. The pool keeps up to ``size`` warmed connections around and
+hands them out to one thread at a time.
+"""
+import logging
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Union
+
+from .db import connect
+
+__all__ = [
+    'ConnectionPool',
+    'PoolTimeoutError',
+]
+
+
+class PoolTimeoutError(Exception):
+    """Error raised when no pooled connection became available in time."""
+
+
+class ConnectionPool:
+    """Bounded pool of connections to a single SQLite database.
+
+    Connections are opened lazily until ``size`` connections exist, after
+    which :meth:`acquire` waits up to ``timeout`` seconds for a connection to
+    be released.
+
+    Connections are created with ``check_same_thread=False`` since they move
+    between threads, but a connection is only ever used by the thread that
+    acquired it until it is released.
+
+    :param database: database file name
+    :param size: maximum number of open connections
+    :param timeout: seconds to wait for a connection when the pool is
+        exhausted
+    :param busy_timeout: seconds a connection waits for a database lock
+        before failing with "database is locked"
+    """
+
+    def __init__(self, database: str, *, size: int = 5, timeout: float = 10,
+                 busy_timeout: float = 5):
+        if size < 1:
+            raise ValueError('Pool size must be at least 1')
+        self.database = database
+        self.size = size
+        self.timeout = timeout
+        self.busy_timeout = busy_timeout
+        # Idle connections are used LIFO, which keeps the most recently used
+        # connections hot and lets idle ones sit at the bottom of the stack.
+        self._idle: List[sqlite3.Connection] = []
+        # Notified when a connection is released or a slot is freed
+        self._available = threading.Condition(threading.Lock())
+        self._opened = 0
+        self._closed = False
+        self._hits = 0
+        self._misses = 0
+        self._waits = 0
+        self._wait_time = 0.0
+
+    def acquire(self) -> sqlite3.Connection:
+        """Get a connection from the pool, opening a new one if allowed.
+
+        :raises PoolTimeoutError: if the pool is exhausted and no connection
+            was released within ``timeout`` seconds.
+        """
+        start = None
+        with self._available:
+            while True:
+                if self._idle:
+                    self._hits += 1
+                    conn = self._idle.pop()
+                    break
+                if self._opened < self.size:
+                    self._opened += 1
+                    self._misses += 1
+                    conn = None
+                    break
+                # Wait for a release, or for a broken connection to be
+                # discarded, which frees a slot to open a new one
+                if start is None:
+                    start = time.monotonic()
+                    self._waits += 1
+                remaining = start + self.timeout - time.monotonic()
+                if remaining <= 0 or not self._available.wait(remaining):
+                    self._wait_time += time.monotonic() - start
+                    raise PoolTimeoutError(
+                        f'No connection to {self.database} available'
+                        f' within {self.timeout} seconds')
+            if start is not None:
+                self._wait_time += time.monotonic() - start
+
+        if conn is not None:
+            return conn
+        try:
+            return connect(self.database, check_same_thread=False,
+                           timeout=self.busy_timeout)
+        except Exception:
+            with self._available:
+                self._opened -= 1
+                self._available.notify()
+            raise
+
+    def release(self, conn: sqlite3.Connection):
+        """Return a connection to the pool.
+
+        Any open transaction is rolled back so the next user starts from a
+        clean state. Connections that fail to reset, or that are released
+        after the pool was closed, are closed and dropped.
+        """
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            logging.getLogger(__name__).warning(
+                'Discarding broken connection to %s', self.database,
+                exc_info=True)
+            self._discard(conn)
+            return
+        with self._available:
+            if not self._closed:
+                self._idle.append(conn)
+                self._available.notify()
+                return
+        self._discard(conn)
+
+    def _discard(self, conn: sqlite3.Connection):
+        with self._available:
+            self._opened -= 1
+            self._available.notify()
+        try:
+            conn.close()
+        except sqlite3.Error:  # pragma: no cover
+            pass
+
+    def close(self):
+        """Close all idle connections.
+
+        Connections currently in use are closed when released.
+        """
+        with self._available:
+            self._closed = True
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            self._discard(conn)
+        logging.getLogger(__name__).debug('Connection pool %s closed: %s',
+                                          self.database, self.stats())
+
+    def stats(self) -> Dict[str, Union[int, float]]:
+        """Pool usage counters.
+
+        - ``hits``: connections served from the idle pool
+        - ``misses``: connections that had to be opened
+        - ``waits``: acquisitions that had to wait for a release
+        - ``wait_time``: total seconds spent waiting
+        - ``open``: currently open connections
+        - ``idle``: currently idle connections
+        """
+        with self._available:
+            return {
+                'hits': self._hits,
+                'misses': self._misses,
+                'waits': self._waits,
+                'wait_time': self._wait_time,
+                'open': self._opened,
+                'idle': len(self._idle),
+            }
@@ -1,5 +1,5 @@
 from dataclasses import dataclass
-from typing import Optional, List, Union, Any, Tuple
+from typing import Optional, List, Union, Any, Tuple, Iterator
 
 from . import db
 
@@ -22,7 +22,15 @@ def find_posts(conn,
                *,
                user_id: Optional[int] = None,
                reply_to: Optional[Union[int, bool]] = None,
-               order = 'DESC') -> List[Post]:
+               order = 'DESC',
+               after: Optional[Tuple[str, int]] = None,
+               limit: Optional[int] = None) -> List[Post]:
+    """Find posts ordered by ``updated_at``.
+
+    :param after: keyset cursor ``(updated_at, post_id)`` of the last post on
+        the previous page, see :func:`unsafe.db.parse_cursor`
+    :param limit: maximum number of posts to return
+    """
     conditions = []
     params: Union[tuple,Tuple[Any]] = ()
 
@@ -36,15 +44,152 @@ def find_posts(conn,
         conditions.append(f'user_id = ?')
         params += (user_id,)
 
+    if after:
+        op = '<' if order == 'DESC' else '>'
+        conditions.append(f'(updated_at, post_id) {op} (?, ?)')
+        params += tuple(after)
+
     sql = ('SELECT post_id, user_id, reply_to, content, likes,'
            ' created_at, updated_at'
            ' FROM post' +  # noqa
-           ' WHERE ' + ' AND '.join(conditions) + f' ORDER BY updated_at {order}')
+           ' WHERE ' + ' AND '.join(conditions) +
+           f' ORDER BY updated_at {order}, post_id {order}')
+
+    if limit:
+        sql += ' LIMIT ?'
+        params += (limit,)
 
     with db.cursor(conn) as cur:
         return db.fetchall(cur, Post, sql, params)
 
 
+def find_thread_forest(conn, **filters) -> List[Post]:
+    """Load top-level posts together with all their replies.
+
+    See :func:`iter_thread_forest` for the filters.
+    """
+    return list(iter_thread_forest(conn, **filters))
+
+
+def iter_thread_forest(conn,
+                       *,
+                       user_id: Optional[int] = None,
+                       after: Optional[Tuple[str, int]] = None,
+                       limit: Optional[int] = None) -> Iterator[Post]:
+    """Load top-level posts together with all their replies, yielding each
+    thread as soon as its rows have been read.
+
+    The whole forest is loaded with a single recursive query. Top-level posts
+    are ordered by ``updated_at`` descending and each post gets a ``replies``
+    attribute listing its direct replies ordered by ``updated_at`` ascending.
+
+    :param user_id: only include threads started by this user
+    :param after: keyset cursor ``(updated_at, post_id)`` of the last
+        top-level post on the previous page
+    :param limit: maximum number of threads to return
+    """
+    conditions = ['reply_to IS NULL']
+    params: Union[tuple, Tuple[Any]] = ()
+
+    if user_id:
+        conditions.append('user_id = ?')
+        params += (user_id,)
+
+    if after:
+        conditions.append('(updated_at, post_id) < (?, ?)')
+        params += tuple(after)
+
+    params += (limit or -1,)
+
+    # Rows are ordered thread by thread and, within a thread, by depth so
+    # that a parent is always seen before its replies.
+    sql = ('WITH RECURSIVE roots AS ('
+           ' SELECT post_id, user_id, reply_to, content, likes,'
+           ' created_at, updated_at'
+           ' FROM post'
+           ' WHERE ' + ' AND '.join(conditions) +
+           ' ORDER BY updated_at DESC, post_id DESC'
+           ' LIMIT ?),'
+           ' thread(post_id, user_id, reply_to, content, likes,'
+           ' created_at, updated_at, depth, root_id, root_updated_at) AS ('
+           ' SELECT post_id, user_id, reply_to, content, likes,'
+           ' created_at, updated_at, 0, post_id, updated_at'
+           ' FROM roots'
+           ' UNION ALL'
+           ' SELECT p.post_id, p.user_id, p.reply_to, p.content, p.likes,'
+           ' p.created_at, p.updated_at, t.depth + 1, t.root_id,'
+           ' t.root_updated_at'
+           ' FROM post p JOIN thread t ON p.reply_to = t.post_id)'
+           ' SELECT post_id, user_id, reply_to, content, likes,'
+           ' created_at, updated_at'
+           ' FROM thread'
+           ' ORDER BY root_updated_at DESC, root_id DESC, depth,'
+           ' updated_at, post_id')
+
+    with db.cursor(conn) as cur:
+        cur.execute(sql, params)
+        yield from _assemble_forest(cur)
+
+
+def _assemble_forest(rows) -> Iterator[Post]:
+    """Build post trees from rows where parents precede their replies and
+    threads follow each other, yielding each tree when the next starts."""
+    root: Optional[Post] = None
+    posts = {}
+    for row in rows:
+        post = db.maprow(Post, row)
+        post.replies = []
+        parent = posts.get(post.reply_to)
+        if parent is None:
+            if root is not None:
+                yield root
+            root = post
+            posts = {}
+        else:
+            parent.replies.append(post)
+        posts[post.post_id] = post
+    if root is not None:
+        yield root
+
+
+#: Marks the start and end of matches in search snippets, see
+#: :func:`search_posts`
+SNIPPET_START = '\x02'
+SNIPPET_END = '\x03'
+
+
+def search_posts(conn, search: str, *, limit: int = 20) -> List[Post]:
+    """Full-text search of posts, best matches first.
+
+    Each post has a ``snippet`` attribute with an excerpt of the content
+    around the matches. Matches are enclosed in :data:`SNIPPET_START` and
+    :data:`SNIPPET_END`, see the ``highlight`` template filter.
+
+    :param search: words to search for, see :func:`unsafe.db.fts_query`
+    :param limit: maximum number of posts to return
+    """
+    query = db.fts_query(search)
+    if not query:
+        return []
+
+    with db.cursor(conn) as cur:
+        cur.execute('SELECT post.post_id, user_id, post.content, reply_to,'
+                    ' likes, created_at, updated_at,'
+                    ' snippet(post_fts, 0, ?, ?, ?, 16) AS snippet'
+                    ' FROM post_fts JOIN post ON post.post_id = post_fts.rowid'
+                    ' WHERE post_fts MATCH ?'
+                    ' ORDER BY post_fts.rank'
+                    ' LIMIT ?',
+                    (SNIPPET_START, SNIPPET_END, '\u2026', query, limit))
+        posts = []
+        for row in cur.fetchall():
+            post = Post(*row[:-1])
+            post.snippet = row['snippet']
+            post.replies = []
+            posts.append(post)
+        return posts
+
+
 def _find_post(cur, post_id):
     return db.fetchone(cur, Post,
                        f'SELECT post_id, user_id, reply_to, content, likes,'
@@ -61,6 +206,7 @@ def find_post(conn, post_id) -> Optional[Post]:
 def delete_post(conn, post_id):
     with db.cursor(conn) as cur:
         cur.execute(f'DELETE from post WHERE post_id = ?', (post_id,))
+    db.invalidate_tables('post')
 
 
 def save_post(conn, post: Post) -> Post:
@@ -77,6 +223,7 @@ def save_post(conn, post: Post) -> Post:
             post.post_id = cur.lastrowid
         new_post = _find_post(cur, post.post_id)
 
+    db.invalidate_tables('post')
     return new_post
 
 
@@ -84,4 +231,5 @@ def like_post(conn, post_id) -> Post:
     with db.cursor(conn) as cur:
         cur.execute('UPDATE post SET likes = likes + 1 WHERE post_id = ?',
                     (post_id,))
+        db.invalidate_tables('post')
         return _find_post(cur, post_id)
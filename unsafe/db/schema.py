@@ -0,0 +1,164 @@
+"""
+Versioned schema migrations.
+
+Migration scripts live in ``unsafe/sql/migrations`` and are named
+``NNNN-description.sql`` where ``NNNN`` is the schema version the script
+migrates to. Applied versions are recorded in the ``schema_version`` table.
+
+Migrations can be applied to the database of a running application:
+
+- :func:`migrate` switches the database to WAL mode, in which readers are
+  not blocked by a writer.
+- Index builds, which take long on large tables, are each committed in a
+  transaction of their own. The other statements of a script run in one
+  transaction, so a failing script leaves them at the previous version.
+  Scripts must therefore be idempotent (``IF NOT EXISTS``), since indexes
+  built before a failure are kept.
+- Request connections wait up to ``db.busy_timeout`` seconds for the
+  write lock, which must be longer than the longest transaction of a
+  migration.
+"""
+import logging
+import os
+import re
+import sqlite3
+from typing import List, NamedTuple, Optional, Union
+
+from .db import connect
+
+__all__ = [
+    'Migration',
+    'migrate',
+    'migrations',
+    'pending_migrations',
+    'schema_version',
+]
+
+MIGRATIONS_PATH = os.path.normpath(
+    os.path.join(os.path.dirname(__file__), '..', 'sql', 'migrations'))
+
+_migration_re = re.compile(r'^(\d+)-(.+)\.sql$')
+_create_index_re = re.compile(r'^(?:\s*--[^\n]*\n)*\s*CREATE\s+'
+                              r'(?:UNIQUE\s+)?INDEX\b', re.IGNORECASE)
+
+
+class Migration(NamedTuple):
+    version: int
+    name: str
+    path: str
+
+
+def migrations(script_path: str = MIGRATIONS_PATH) -> List[Migration]:
+    """List available migrations ordered by version."""
+    result = []
+    for filename in os.listdir(script_path):
+        match = _migration_re.match(filename)
+        if match:
+            result.append(Migration(version=int(match.group(1)),
+                                    name=match.group(2),
+                                    path=os.path.join(script_path, filename)))
+    result.sort()
+    versions = [m.version for m in result]
+    if len(set(versions)) != len(versions):
+        raise ValueError(f'Duplicate migration versions in {script_path}')
+    return result
+
+
+def _ensure_version_table(conn: sqlite3.Connection):
+    conn.execute('CREATE TABLE IF NOT EXISTS schema_version ('
+                 ' version    INTEGER PRIMARY KEY,'
+                 ' name       TEXT      NOT NULL,'
+                 ' applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP'
+                 ')')
+    conn.commit()
+
+
+def schema_version(conn: sqlite3.Connection) -> int:
+    """Current schema version, 0 if no migrations have been applied.
+
+    Does not write to the database.
+    """
+    exists = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table'"
+                          " AND name = 'schema_version'").fetchone()
+    if not exists:
+        return 0
+    row = conn.execute('SELECT MAX(version) FROM schema_version').fetchone()
+    return row[0] or 0
+
+
+def pending_migrations(conn: sqlite3.Connection,
+                       script_path: str = MIGRATIONS_PATH) -> List[Migration]:
+    """Migrations newer than the current schema version."""
+    version = schema_version(conn)
+    return [m for m in migrations(script_path) if m.version > version]
+
+
+def _transactions(sql: str) -> List[str]:
+    """Split a migration script into the scripts of its transactions, each
+    index build being a transaction of its own."""
+    statements = []
+    statement = ''
+    for line in sql.splitlines(keepends=True):
+        statement += line
+        if sqlite3.complete_statement(statement):
+            statements.append(statement)
+            statement = ''
+
+    transactions = []
+    current = ''
+    for statement in statements:
+        if _create_index_re.match(statement):
+            if current:
+                transactions.append(current)
+                current = ''
+            transactions.append(statement)
+        else:
+            current += statement
+    if current or not transactions:
+        transactions.append(current)
+    return transactions
+
+
+def migrate(db: Union[str, sqlite3.Connection],
+            *,
+            target: Optional[int] = None,
+            script_path: str = MIGRATIONS_PATH) -> List[Migration]:
+    """Apply pending migrations.
+
+    :param db: database name or existing connection
+    :param target: stop after migrating to this version
+    :param script_path: directory containing the migration scripts
+    :returns: list of applied migrations
+    """
+    logger = logging.getLogger(__name__)
+    conn = connect(db) if isinstance(db, str) else db
+    applied = []
+    try:
+        # Readers are not blocked by the migration, nor requests by readers
+        conn.execute('PRAGMA journal_mode = WAL')
+        _ensure_version_table(conn)
+        for migration in pending_migrations(conn, script_path):
+            if target is not None and migration.version > target:
+                break
+            logger.info('Migrating database to version %d: %s',
+                        migration.version, migration.path)
+            with open(migration.path, encoding='utf-8') as f:
+                sql = f.read()
+            *steps, last = _transactions(sql)
+            try:
+                for step in steps:
+                    conn.executescript('BEGIN;\n' + step)
+                    conn.commit()
+                conn.executescript('BEGIN;\n' + last)
+                conn.execute('INSERT INTO schema_version(version, name)'
+                             ' VALUES (?, ?)',
+                             (migration.version, migration.name))
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            applied.append(migration)
+    finally:
+        if isinstance(db, str):
+            conn.close()
+    return applied
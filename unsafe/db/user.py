@@ -1,9 +1,19 @@
+import dataclasses
+import json
+import weakref
+
 from passlib.context import CryptContext
 
 from dataclasses import dataclass
-from typing import Optional, Union, List
+from typing import (
+    TYPE_CHECKING, Any, Optional, Union, List, Dict, Iterable, Set
+)
 
 from . import db
+from ..cache import LRUCache
+
+if TYPE_CHECKING:  # pragma: no cover
+    from ..hashing import HashPool
 
 pwdctx = CryptContext(
     # Supported password/hashing schemes in priority
@@ -24,6 +34,18 @@ pwdctx = CryptContext(
 )
 
 
+def configure_pwdctx(settings):
+    """Set password hash costs from ``passwords.<scheme>.rounds`` settings.
+
+    Hashes with fewer rounds are replaced with new hashes at login.
+    """
+    rounds = {f'{scheme}__rounds': int(settings[f'passwords.{scheme}.rounds'])
+              for scheme in pwdctx.schemes()
+              if f'passwords.{scheme}.rounds' in settings}
+    if rounds:
+        pwdctx.update(**rounds)
+
+
 @dataclass
 class User:
     """User details"""
@@ -73,9 +95,151 @@ def from_id(conn, user_id: int) -> User:
         return user
 
 
+def from_ids(conn, user_ids: Iterable[int]) -> Dict[int, User]:
+    """Lookup several users by id using a single query.
+
+    Returns a dict mapping user id to :class:`User`.
+    Ids that do not belong to any user are left out.
+    """
+
+    ids = sorted({int(user_id) for user_id in user_ids})
+    if not ids:
+        return {}
+
+    with db.cursor(conn) as cur:
+        users = db.fetchall(cur, User,
+                            'SELECT user_id, username, password, email, groups '
+                            'FROM user '
+                            'WHERE user_id IN (SELECT value FROM json_each(?))',
+                            (json.dumps(ids),))
+        return {user.user_id: user for user in users}
+
+
+#: Live user caches, invalidated by :func:`invalidate_user`
+_caches: 'weakref.WeakSet[UserCache]' = weakref.WeakSet()
+
+
+class UserCache:
+    """Process local cache of users by id.
+
+    Entries expire after ``ttl`` seconds, which bounds how long changes
+    made by other processes go unnoticed. Changes made through this module
+    invalidate the cached user in all caches of the process, see
+    :func:`invalidate_user`.
+
+    Users are copied in and out of the cache so that callers cannot modify
+    cached users.
+
+    :param maxsize: maximum number of cached users
+    :param ttl: seconds to keep a user
+    """
+
+    def __init__(self, maxsize: int = 1000, ttl: float = 60):
+        self._cache = LRUCache(maxsize, ttl=ttl)
+        _caches.add(self)
+
+    def get(self, user_id: int) -> Optional[User]:
+        user = self._cache.get(user_id)
+        return _copy_user(user) if user else None
+
+    def put(self, user: User):
+        self._cache.put(user.user_id, _copy_user(user))
+
+    def invalidate(self, user_id: int):
+        self._cache.pop(user_id)
+
+    def clear(self):
+        self._cache.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Cache counters, see :meth:`unsafe.cache.LRUCache.stats`."""
+        return self._cache.stats()
+
+
+def _copy_user(user: User) -> User:
+    return dataclasses.replace(user, groups=list(user.groups))
+
+
+def invalidate_user(user_id: int):
+    """Drop a user from all user caches after the user was changed."""
+    for cache in list(_caches):
+        cache.invalidate(user_id)
+
+
+class UserLoader:
+    """Request scoped batching user loader.
+
+    User ids are queued with :meth:`queue` as they are discovered and the
+    first lookup resolves everything queued so far with a single
+    :func:`from_ids` query. Resolved users are remembered by the loader.
+
+    If a :class:`UserCache` is given, users are looked up in the cache
+    before querying the database.
+
+    The loader can be used as a mapping from user id to :class:`User`,
+    e.g. ``users[post.user_id]`` in a template.
+    """
+
+    def __init__(self, conn, cache: Optional[UserCache] = None):
+        self._conn = conn
+        self._cache = cache
+        self._users: Dict[int, Optional[User]] = {}
+        self._pending: Set[int] = set()
+
+    def queue(self, *user_ids: int):
+        """Queue user ids to be resolved by the next lookup."""
+        for user_id in user_ids:
+            user_id = int(user_id)
+            if user_id not in self._users:
+                self._pending.add(user_id)
+
+    def load(self, user_id: int) -> User:
+        """Lookup user by id, resolving all queued ids in the same query.
+
+        :raises UserNotFoundError: if there is no user with id ``user_id``
+        """
+        user_id = int(user_id)
+        self.queue(user_id)
+        self._resolve()
+        user = self._users[user_id]
+        if not user:
+            raise UserNotFoundError('Invalid user id')
+        return user
+
+    def load_many(self, user_ids: Iterable[int]) -> Dict[int, User]:
+        """Lookup several users, leaving out ids that are not valid."""
+        user_ids = [int(user_id) for user_id in user_ids]
+        self.queue(*user_ids)
+        self._resolve()
+        return {user_id: self._users[user_id]
+                for user_id in user_ids if self._users[user_id]}
+
+    __getitem__ = load
+
+    def _resolve(self):
+        if self._pending:
+            pending, self._pending = self._pending, set()
+            if self._cache is not None:
+                for user_id in list(pending):
+                    user = self._cache.get(user_id)
+                    if user:
+                        self._users[user_id] = user
+                        pending.discard(user_id)
+                if not pending:
+                    return
+
+            users = from_ids(self._conn, pending)
+            for user_id in pending:
+                user = users.get(user_id)
+                self._users[user_id] = user
+                if user and self._cache is not None:
+                    self._cache.put(user)
+
+
 def authenticate(conn,
                  username: str,
-                 password: Union[str, bytes]) -> Optional[User]:
+                 password: Union[str, bytes],
+                 hash_pool: Optional['HashPool'] = None) -> Optional[User]:
     """User password authentication.
 
     :arg username:
@@ -84,15 +248,33 @@ def authenticate(conn,
     :arg password:
         Password to verify.
 
+    :arg hash_pool:
+        Verify the password in a :class:`unsafe.hashing.HashPool` instead
+        of the calling thread. Replacing a deprecated hash is then done in
+        the background.
+
     :returns:
         A :class:`User` object if the username and password are correct,
         otherwise ``None``.
+
+    :raises unsafe.hashing.HashingOverloadError:
+        If ``hash_pool`` is too busy.
     """
 
     user = from_username(conn, username)
     if not user:
         return None
 
+    if hash_pool is not None:
+        valid, needs_update = hash_pool.verify(password, user.password)
+        if not valid:
+            return None
+        if needs_update:
+            hash_pool.rehash_later(_database_path(conn), user.user_id,
+                                   password, user.password,
+                                   callback=invalidate_user)
+        return user
+
     valid, new_hash = pwdctx.verify_and_update(password, user.password)
     if not valid:
         return None
@@ -106,16 +288,71 @@ def authenticate(conn,
     return user
 
 
+def _database_path(conn) -> str:
+    """File name of the main database of a connection."""
+    with db.cursor(conn) as cur:
+        cur.execute('PRAGMA database_list')
+        for _, name, path in cur.fetchall():
+            if name == 'main':
+                return path
+    raise ValueError('Connection has no main database')  # pragma: no cover
+
+
 def _replace_user_hash(conn, user_id, new_hash):
+    """Replace a password hash and invalidate the cached user.
+
+    The hash is committed before the user is invalidated, otherwise a
+    concurrent request could cache the old row again in between. It is
+    therefore written in a transaction of its own, or by committing
+    ``conn`` for an in-memory database.
+    """
+    database = _database_path(conn)
+    if database:
+        update_conn = db.connect(database)
+        try:
+            with update_conn:
+                update_conn.execute('UPDATE user SET password = ?'
+                                    ' WHERE user_id = ?', (new_hash, user_id))
+        finally:
+            update_conn.close()
+    else:
+        with db.cursor(conn, commit=True) as cur:
+            cur.execute('UPDATE user SET password = ? WHERE user_id = ?',
+                        (new_hash, user_id))
+    invalidate_user(user_id)
+
+
+def existing_usernames(conn, usernames: Iterable[str]) -> Set[str]:
+    """Return the names in ``usernames`` that are already taken."""
     with db.cursor(conn) as cur:
-        cur.execute('UPDATE user SET password = ? WHERE user_id = ?',
-                    (new_hash, user_id))
+        cur.execute('SELECT username FROM user '
+                    'WHERE username IN (SELECT value FROM json_each(?))',
+                    (json.dumps(sorted(set(usernames))),))
+        return {row[0] for row in cur.fetchall()}
+
+
+def insert_many(conn, users: Iterable[User]) -> int:
+    """Insert users with already hashed passwords using a single statement.
+
+    Does not check for existing usernames, see :func:`existing_usernames`.
+    ``user_id`` of the given users is ignored.
+
+    :returns: the number of inserted users
+    """
+    with db.cursor(conn) as cur:
+        cur.executemany('INSERT INTO user(username, password, email, groups)'
+                        'VALUES(?,?,?,?)',
+                        [(user.username, user.password, user.email,
+                          ' '.join(user.groups))
+                         for user in users])
+        return cur.rowcount
 
 
 def create(conn,
            username: str,
            password: Union[str, bytes], email: Optional[str] = None,
-           groups: List[str] = None) -> User:
+           groups: List[str] = None,
+           hash_pool: Optional['HashPool'] = None) -> User:
     """Create a new user.
 
     The password is hashed by according to the default password scheme before
@@ -133,6 +370,9 @@ def create(conn,
     :arg groups:
         List of groups.
 
+    :arg hash_pool:
+        Hash the password in a :class:`unsafe.hashing.HashPool`.
+
     :returns:
         Newly created :class:`User`.
 
@@ -144,13 +384,17 @@ def create(conn,
     if user:
         raise UserExistsError()
 
-    hash = pwdctx.hash(password)
+    if hash_pool is not None:
+        hash = hash_pool.hash(password)
+    else:
+        hash = pwdctx.hash(password)
     groups_value = ' '.join(groups) if groups else ''
     with db.cursor(conn) as cur:
         cur.execute('INSERT INTO user(username, password, email, groups)'
                     'VALUES(?,?,?,?)',
                     (username, hash, email, groups_value))
         user_id = cur.lastrowid
+    invalidate_user(user_id)
 
     return User(user_id=user_id,
                 username=username,
@@ -2,6 +2,7 @@ from datetime import datetime, timezone
 from typing import Union, Dict, Callable, Optional
 
 from dateutil.relativedelta import relativedelta
+from markupsafe import Markup, escape
 from pyramid.config import Configurator
 
 
@@ -73,11 +74,35 @@ def since_filter(value: Union[datetime, str],
         return f'{seconds} sekunder' if seconds != 1 else '1 sekund'
 
 
+def highlight_filter(value: str, start='\x02', end='\x03'):
+    """Escape a search snippet and mark the matches enclosed in ``start``
+    and ``end``, see :func:`unsafe.db.post.search_posts`."""
+    if not value:
+        return value
+    return Markup(str(escape(value))
+                  .replace(start, '<mark>')
+                  .replace(end, '</mark>'))
+
+
+def thread_key_filter(post) -> tuple:
+    """Fragment cache key of a post and its replies, see
+    :mod:`unsafe.fragments`.
+
+    ``updated_at`` only has a resolution of seconds, so the content is
+    part of the key too.
+    """
+    return (post.post_id, post.updated_at, post.likes, hash(post.content),
+            tuple(thread_key_filter(reply)
+                  for reply in getattr(post, 'replies', ())))
+
+
 def jinja2_filters() -> Dict[str, Callable]:
     import pyramid_jinja2.filters
     return dict(abbrev=abbrev_filter,
                 classes=classes_filter,
+                highlight=highlight_filter,
                 since=since_filter,
+                thread_key=thread_key_filter,
                 route_url=pyramid_jinja2.filters.route_url_filter,
                 static_url=pyramid_jinja2.filters.static_url_filter,
                 )
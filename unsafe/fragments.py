@@ -0,0 +1,118 @@
+"""
+Fragment caching for Jinja2 templates.
+
+:class:`FragmentCacheExtension` adds a ``{% cache %}`` tag that renders its
+body once per key and then reuses the HTML::
+
+    {% cache post.post_id, post.updated_at, post.likes %}
+      ...
+      {{ hole('post_actions', post.post_id) }}
+    {% endcache %}
+
+Parts that depend on the viewer are left as holes in the cached HTML. The
+``hole`` global takes the name of a macro and its arguments, and the macro
+is called to fill the hole each time the fragment is output. Arguments
+must be JSON serializable.
+
+Cache blocks may be nested. Holes are filled by the outermost block only,
+so no block caches per-viewer content.
+"""
+import json
+import re
+import secrets
+import threading
+from typing import Any, Hashable, List
+
+from jinja2 import nodes
+from jinja2.ext import Extension
+from jinja2.runtime import Context
+from markupsafe import Markup
+from pyramid.config import Configurator
+from pyramid_jinja2 import EXTRAS_CONFIG_PHASE
+
+from .cache import LRUCache
+
+__all__ = ['FragmentCacheExtension']
+
+
+class FragmentCacheExtension(Extension):
+    """Jinja2 extension adding the ``{% cache key, ... %}`` tag and the
+    ``hole(macro_name, *args)`` global.
+
+    Fragments are kept in the ``fragment_cache`` attribute of the
+    environment, an :class:`unsafe.cache.LRUCache` of 5000 fragments by
+    default. Set it to ``None`` to disable caching.
+    """
+    tags = {'cache'}
+
+    def __init__(self, environment):
+        super().__init__(environment)
+        environment.extend(fragment_cache=LRUCache(5000))
+        # Holes are marked with a per-process secret, so that cached content
+        # can not fake holes
+        self._marker = f'<!--hole:{secrets.token_hex(8)}:'
+        self._hole_re = re.compile(re.escape(self._marker) + r'(.*?)-->')
+        self._depth = threading.local()
+        environment.globals['hole'] = self.hole
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        keys = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            keys.append(parser.parse_expression())
+        body = parser.parse_statements(('name:endcache',), drop_needle=True)
+        # Fragments are identified by the template and line of the tag
+        fragment_id = nodes.Const(f'{parser.name}:{lineno}')
+        call = self.call_method('_cache', [fragment_id, nodes.List(keys),
+                                           nodes.ContextReference()])
+        return nodes.CallBlock(call, [], [], body).set_lineno(lineno)
+
+    def hole(self, name: str, *args: Any) -> Markup:
+        """Mark a place where ``name(*args)`` is output."""
+        # Escape > so that the arguments can not end the comment
+        data = json.dumps([name, *args]).replace('>', '\\u003e')
+        return Markup(f'{self._marker}{data}-->')
+
+    def _fill(self, html: str, context: Context) -> Markup:
+        def fill(match):
+            name, *args = json.loads(match.group(1))
+            return str(context.resolve(name)(*args))
+
+        return Markup(self._hole_re.sub(fill, html))
+
+    def _cache(self, fragment_id: str, keys: List[Hashable],
+               context: Context, caller) -> Markup:
+        cache = self.environment.fragment_cache
+        depth = getattr(self._depth, 'value', 0)
+        self._depth.value = depth + 1
+        try:
+            key = (fragment_id, *keys)
+            html = cache.get(key) if cache is not None else None
+            if html is None:
+                html = str(caller())
+                if cache is not None:
+                    cache.put(key, html)
+        finally:
+            self._depth.value = depth
+        if depth:
+            return Markup(html)
+        return self._fill(html, context)
+
+
+def includeme(config: Configurator):
+    """Add :class:`FragmentCacheExtension` to the Jinja2 environment.
+
+    ``fragment_cache.size`` sets the number of cached fragments, ``0``
+    disables caching. The cache is available as
+    ``registry.fragment_cache`` for reporting usage statistics.
+    """
+    settings = config.registry.settings
+    size = int(settings.get('fragment_cache.size', 5000))
+    config.add_jinja2_extension(FragmentCacheExtension)
+
+    def configure():
+        env = config.get_jinja2_environment()
+        env.fragment_cache = LRUCache(size) if size > 0 else None
+        config.registry.fragment_cache = env.fragment_cache
+
+    config.action(None, configure, order=EXTRAS_CONFIG_PHASE)
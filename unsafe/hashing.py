@@ -0,0 +1,250 @@
+"""
+Password hashing in a separate process pool.
+
+Hashing and verifying passwords with bcrypt keeps a CPU core busy for a
+long time, on purpose. Done in a request thread this starves every other
+request served by the process. :class:`HashPool` runs the work in a small
+pool of worker processes instead and bounds the number of queued jobs, so a
+burst of logins fails fast with :exc:`HashingOverloadError` rather than
+piling up.
+"""
+import logging
+import math
+import multiprocessing
+import sqlite3
+import statistics
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Callable, Iterable, List, Optional, Tuple, Union
+
+from passlib.context import CryptContext
+
+__all__ = [
+    'HashingOverloadError',
+    'HashPool',
+    'calibratable_schemes',
+    'hash_many',
+    'measure_verify',
+    'recommend_rounds',
+]
+
+# CryptContext of a worker process, see _init_worker
+_worker_ctx: Optional[CryptContext] = None
+
+
+class HashingOverloadError(Exception):
+    """Error raised when the hash pool is too busy to take on more work."""
+
+
+def _init_worker(config: str):
+    global _worker_ctx
+    _worker_ctx = CryptContext.from_string(config)
+
+
+def _hash(password: Union[str, bytes]) -> str:
+    return _worker_ctx.hash(password)
+
+
+def _verify(password: Union[str, bytes], hash: str) -> Tuple[bool, bool]:
+    valid = _worker_ctx.verify(password, hash)
+    return valid, valid and _worker_ctx.needs_update(hash)
+
+
+def _rehash(database: str, user_id: int, password: Union[str, bytes],
+            old_hash: str) -> bool:
+    new_hash = _worker_ctx.hash(password)
+    conn = sqlite3.connect(database)
+    try:
+        with conn:
+            # Only replace the hash if the password was not changed meanwhile
+            cur = conn.execute('UPDATE user SET password = ?'
+                               ' WHERE user_id = ? AND password = ?',
+                               (new_hash, user_id, old_hash))
+            return cur.rowcount == 1
+    finally:
+        conn.close()
+
+
+class HashPool:
+    """Bounded pool of processes hashing and verifying passwords.
+
+    Workers are started with the ``spawn`` method and configured with
+    ``pwdctx.to_string()``, so they use the same schemes and rounds as
+    ``pwdctx``. Spawned workers import the main module, so scripts using a
+    pool must guard their entry point with ``if __name__ == '__main__'``.
+
+    At most ``queue_size`` jobs may be queued or running at once. A job
+    submitted to a full pool, or not finished within ``timeout`` seconds,
+    raises :exc:`HashingOverloadError`.
+
+    :param pwdctx: password context to replicate in the workers
+    :param workers: number of worker processes
+    :param queue_size: maximum number of queued and running jobs
+    :param timeout: seconds to wait for a result
+    """
+
+    def __init__(self, pwdctx: CryptContext, *, workers: int = 2,
+                 queue_size: int = 16, timeout: float = 5):
+        if workers < 1:
+            raise ValueError('HashPool needs at least 1 worker')
+        self.workers = workers
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(queue_size)
+        self._executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker,
+            initargs=(pwdctx.to_string(),))
+        self._lock = threading.Lock()
+        self._rejected = 0
+        self._timeouts = 0
+
+    def _submit(self, func: Callable, *args) -> Future:
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._rejected += 1
+            raise HashingOverloadError('Too many password hashing jobs')
+        try:
+            future = self._executor.submit(func, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda f: self._slots.release())
+        return future
+
+    def _result(self, future: Future):
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            with self._lock:
+                self._timeouts += 1
+            raise HashingOverloadError(
+                f'Password hashing took more than {self.timeout} seconds'
+            ) from None
+
+    def hash(self, password: Union[str, bytes]) -> str:
+        """Hash a password with the default scheme."""
+        return self._result(self._submit(_hash, password))
+
+    def verify(self, password: Union[str, bytes],
+               hash: str) -> Tuple[bool, bool]:
+        """Verify a password.
+
+        :returns: a tuple ``(valid, needs_update)`` where ``needs_update``
+            is true if the password is valid but the hash should be replaced
+        """
+        return self._result(self._submit(_verify, password, hash))
+
+    def rehash_later(self, database: str, user_id: int,
+                     password: Union[str, bytes], old_hash: str,
+                     callback: Optional[Callable[[int], None]] = None):
+        """Replace the password hash of a user in the background.
+
+        The update is skipped if the pool is busy, it will be retried at
+        the next login. ``callback`` is called with the user id after the
+        hash was replaced.
+        """
+        try:
+            future = self._submit(_rehash, database, user_id, password,
+                                  old_hash)
+        except HashingOverloadError:
+            return
+
+        def done(f: Future):
+            try:
+                replaced = f.result()
+            except Exception:
+                logging.getLogger(__name__).exception(
+                    'Failed to replace password hash of user %s', user_id)
+                return
+            if replaced and callback:
+                callback(user_id)
+
+        future.add_done_callback(done)
+
+    def stats(self):
+        """Counters of jobs rejected because the pool was full and jobs
+        that timed out."""
+        with self._lock:
+            return {
+                'rejected': self._rejected,
+                'timeouts': self._timeouts,
+            }
+
+    def close(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+
+def hash_many(pwdctx: CryptContext, passwords: Iterable[Union[str, bytes]],
+              *, workers: Optional[int] = None,
+              chunksize: int = 8) -> List[str]:
+    """Hash many passwords using all CPU cores.
+
+    Unlike :class:`HashPool` this is meant for batch jobs, there is no
+    bound on the number of queued passwords.
+
+    :param pwdctx: password context to hash with
+    :param passwords: passwords to hash
+    :param workers: number of worker processes, default one per CPU
+    :param chunksize: number of passwords sent to a worker at a time
+    :returns: hashes in the same order as ``passwords``
+    """
+    with ProcessPoolExecutor(max_workers=workers,
+                             mp_context=multiprocessing.get_context('spawn'),
+                             initializer=_init_worker,
+                             initargs=(pwdctx.to_string(),)) as executor:
+        return list(executor.map(_hash, passwords, chunksize=chunksize))
+
+
+def calibratable_schemes(pwdctx: CryptContext) -> List[str]:
+    """Schemes of ``pwdctx`` with a configurable number of rounds."""
+    return [scheme for scheme in pwdctx.schemes()
+            if 'rounds' in pwdctx.handler(scheme).setting_kwds]
+
+
+def measure_verify(pwdctx: CryptContext, scheme: str,
+                   rounds: Optional[int] = None, *,
+                   samples: int = 3) -> Tuple[int, float]:
+    """Measure the time to verify a password on this machine.
+
+    :param pwdctx: password context
+    :param scheme: scheme to measure
+    :param rounds: rounds to measure, default the rounds configured in
+        ``pwdctx``
+    :param samples: number of verifications to time
+    :returns: a tuple ``(rounds, seconds)`` of the measured rounds and the
+        median verification time
+    """
+    settings = {f'{scheme}__rounds': rounds} if rounds else {}
+    ctx = pwdctx.copy(default=scheme, **settings)
+    password = 'calibration password'
+    hash = ctx.hash(password)
+    rounds = ctx.handler(scheme).from_string(hash).rounds
+
+    times = []
+    for _ in range(samples):
+        start = time.perf_counter()
+        ctx.verify(password, hash)
+        times.append(time.perf_counter() - start)
+    return rounds, statistics.median(times)
+
+
+def recommend_rounds(pwdctx: CryptContext, scheme: str, rounds: int,
+                     seconds: float, target: float) -> int:
+    """Rounds expected to take ``target`` seconds to verify, given that
+    ``rounds`` took ``seconds``.
+
+    The cost of bcrypt is logarithmic, so its recommendation is the nearest
+    power of two. Linear costs are rounded to two significant digits.
+    """
+    handler = pwdctx.handler(scheme)
+    if handler.rounds_cost == 'log2':
+        recommended = rounds + round(math.log2(target / seconds))
+    else:
+        recommended = rounds * target / seconds
+        digits = max(0, int(math.log10(recommended)) - 1)
+        recommended = int(round(recommended, -digits))
+    return max(handler.min_rounds, min(handler.max_rounds, recommended))
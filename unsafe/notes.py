@@ -6,6 +6,8 @@ from pyramid.view import view_config
 from . import db
 from .app import RootContextFactory
 from .embed import embeddable
+from .paging import PageRows, page_params
+from .streaming import render_stream, streaming_enabled
 
 
 class NotesFactory(RootContextFactory):
@@ -59,19 +61,27 @@ def notes_listing(request):
     from_date = request.params.get('from', '')
     to_date = request.params.get('to', '')
     category = request.params.get('category')
-    notes = db.note.find_notes(request.db,
-                               user_id=request.user.user_id,
-                               from_date=from_date,
-                               to_date=to_date,
-                               category=category,
-                               search=search)
-
-    return {
-        'notes': notes,
+    after, limit = page_params(request)
+    stream = streaming_enabled(request)
+    find = db.note.iter_notes if stream else db.note.find_notes
+    notes = find(request.db,
+                 user_id=request.user.user_id,
+                 from_date=from_date,
+                 to_date=to_date,
+                 category=category,
+                 search=search,
+                 after=after,
+                 limit=limit)
+
+    value = {
+        'notes': PageRows(request, notes, limit, 'note_id'),
         'from': from_date,
         'to': to_date,
         'search': search
     }
+    if stream:
+        return render_stream('notes/list-notes.jinja2', value, request)
+    return value
 
 
 @view_config(route_name='note', permission='edit', request_method='GET',
@@ -0,0 +1,356 @@
+"""
+Full-page cache for anonymous visitors.
+
+Most requests are logged-out visitors reading the start page, the topics
+and the posts listing, which are the same for everyone. :class:`PageCache`
+keeps rendered responses in memory, within a byte budget, and optionally
+spills the least recently used pages to files in a directory.
+
+Pages are tagged with the tables they are rendered from. The functions of
+:mod:`unsafe.db` that write to a table call
+:func:`unsafe.db.invalidate_tables`, which makes all pages tagged with the
+table stale. Changes made by other processes are not seen, they show up
+when a page expires after ``ttl`` seconds.
+"""
+import hashlib
+import logging
+import os
+import pickle
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, Hashable, Iterable, List, Optional, Set, Tuple
+
+from pyramid.config import Configurator
+from pyramid.csrf import get_csrf_token
+from pyramid.interfaces import IRoutesMapper
+from pyramid.request import Request
+from pyramid.response import Response
+from pyramid.settings import asbool
+from pyramid.tweens import INGRESS
+
+from . import db
+from .cache import LRUCache
+
+__all__ = [
+    'BYPASS_ENVIRON_KEY',
+    'CachedPage',
+    'CachedRoute',
+    'PageCache',
+    'page_cache_tween_factory',
+]
+
+
+@dataclass
+class CachedPage:
+    status: str
+    headerlist: List[Tuple[str, str]]
+    body: bytes
+    #: Versions of the tags when rendering started, see PageCache.versions
+    versions: Tuple[int, ...]
+    #: Time after which the page must be rendered again
+    expires: float
+
+
+@dataclass
+class CachedRoute:
+    """How to cache the pages of a route.
+
+    :param tags: tables the pages are rendered from
+    :param csrf: the pages include a CSRF token, which is then part of the
+        cache key
+    """
+    tags: Tuple[str, ...] = ()
+    csrf: bool = False
+
+
+#: Routes whose pages are cached for anonymous visitors
+CACHED_ROUTES: Dict[str, CachedRoute] = {
+    'index': CachedRoute(),
+    'posts': CachedRoute(tags=('post',), csrf=True),
+    'topic': CachedRoute(),
+    'topics': CachedRoute(),
+}
+
+
+#: WSGI environ key of requests that must neither be served from the cache
+#: nor fill it, such as the warm-up requests of :mod:`unsafe.precompile`
+BYPASS_ENVIRON_KEY = 'unsafe.page_cache.bypass'
+
+
+def _page_size(page: CachedPage) -> int:
+    return len(page.body) + sum(len(name) + len(value)
+                                for name, value in page.headerlist)
+
+
+class PageCache:
+    """Two tier cache of rendered pages.
+
+    Pages are kept in memory up to a total of ``maxbytes``. If a
+    ``directory`` is given, pages evicted from memory are written to files
+    there, up to a total of ``disk_maxbytes``, and moved back to memory
+    when requested. Files left by an earlier process are removed at
+    startup, since their tags may have been invalidated since.
+
+    :param maxbytes: memory budget in bytes
+    :param ttl: seconds until a page expires
+    :param directory: directory for the disk tier, ``None`` to only cache
+        pages in memory
+    :param disk_maxbytes: disk budget in bytes
+    :param maxsize: maximum number of pages in memory
+    """
+
+    def __init__(self, maxbytes: int = 16 * 1024 * 1024, *, ttl: float = 60,
+                 directory: Optional[str] = None,
+                 disk_maxbytes: int = 256 * 1024 * 1024,
+                 maxsize: int = 10000):
+        self.ttl = ttl
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._versions: Dict[str, int] = {}
+        self._pending = threading.local()
+        self._hits = 0
+        self._misses = 0
+        self._stale = 0
+        self._disk_hits = 0
+
+        self._disk: Optional[LRUCache] = None
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            for filename in os.listdir(directory):
+                if filename.endswith('.page'):
+                    os.remove(os.path.join(directory, filename))
+            # key -> file size
+            self._disk = LRUCache(1000000, maxbytes=disk_maxbytes,
+                                  sizeof=lambda size: size,
+                                  on_evict=self._remove_file)
+        self._memory = LRUCache(maxsize, maxbytes=maxbytes, sizeof=_page_size,
+                                on_evict=self._spill if directory else None)
+        db.watch_tables(self)
+
+    def versions(self, tags: Iterable[str]) -> Tuple[int, ...]:
+        """Current versions of ``tags``, which change on invalidation."""
+        with self._lock:
+            return tuple(self._versions.get(tag, 0) for tag in tags)
+
+    def invalidate(self, *tags: str):
+        """Make all pages tagged with any of ``tags`` stale.
+
+        The tags are also remembered for the current thread, see
+        :meth:`take_pending`, since the change that caused the
+        invalidation may not be committed yet.
+        """
+        self._bump(tags)
+        pending = getattr(self._pending, 'tags', None)
+        if pending is None:
+            pending = self._pending.tags = set()
+        pending.update(tags)
+
+    def take_pending(self) -> Set[str]:
+        """Return and forget the tags invalidated by the current thread."""
+        pending = getattr(self._pending, 'tags', None) or set()
+        self._pending.tags = set()
+        return pending
+
+    def _bump(self, tags: Iterable[str]):
+        with self._lock:
+            for tag in tags:
+                self._versions[tag] = self._versions.get(tag, 0) + 1
+
+    def get(self, key: Hashable,
+            tags: Tuple[str, ...]) -> Optional[CachedPage]:
+        """Get a page that is neither expired nor invalidated."""
+        page = self._memory.get(key)
+        if page is None and self._disk is not None and key in self._disk:
+            page = self._load(key)
+            if page is not None:
+                with self._lock:
+                    self._disk_hits += 1
+                self._memory.put(key, page)
+        if page is None:
+            with self._lock:
+                self._misses += 1
+            return None
+        if (page.expires <= time.time()
+                or page.versions != self.versions(tags)):
+            self._memory.pop(key)
+            self._discard_file(key)
+            with self._lock:
+                self._misses += 1
+                self._stale += 1
+            return None
+        with self._lock:
+            self._hits += 1
+        return page
+
+    def put(self, key: Hashable, page: CachedPage):
+        self._memory.put(key, page)
+
+    def _path(self, key: Hashable) -> str:
+        name = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, name + '.page')
+
+    def _spill(self, key: Hashable, page: CachedPage):
+        if page.expires <= time.time() or key in self._disk:
+            return
+        path = self._path(key)
+        try:
+            with open(path + '.tmp', 'wb') as f:
+                pickle.dump(page, f, pickle.HIGHEST_PROTOCOL)
+            os.replace(path + '.tmp', path)
+        except OSError:
+            logging.getLogger(__name__).exception(
+                'Failed to write cached page %s', path)
+            return
+        self._disk.put(key, _page_size(page))
+
+    def _load(self, key: Hashable) -> Optional[CachedPage]:
+        try:
+            with open(self._path(key), 'rb') as f:
+                return pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            self._disk.pop(key)
+            return None
+
+    def _discard_file(self, key: Hashable):
+        if self._disk is not None and self._disk.pop(key) is not None:
+            self._remove_file(key)
+
+    def _remove_file(self, key: Hashable, size: int = 0):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def stats(self) -> Dict[str, object]:
+        """Cache counters.
+
+        - ``hits``, ``misses``: lookups that did or did not find a page
+          that could be served
+        - ``hit_rate``: fraction of lookups that were hits
+        - ``stale``: pages dropped because they expired or were invalidated
+        - ``disk_hits``: pages moved back to memory from the disk tier
+        - ``disk_bytes``: total size of the pages in the disk tier
+
+        and the ``evictions``, ``size`` and ``bytes`` counters of the memory
+        tier, see :meth:`unsafe.cache.LRUCache.stats`.
+        """
+        stats = self._memory.stats()
+        with self._lock:
+            lookups = self._hits + self._misses
+            stats.update(hits=self._hits,
+                         misses=self._misses,
+                         hit_rate=self._hits / lookups if lookups else 0.0,
+                         stale=self._stale,
+                         disk_hits=self._disk_hits)
+        stats['disk_bytes'] = (self._disk.stats()['bytes']
+                               if self._disk is not None else 0)
+        return stats
+
+    def clear(self):
+        self._memory.clear()
+        if self._disk is not None:
+            for filename in os.listdir(self.directory):
+                if filename.endswith('.page'):
+                    os.remove(os.path.join(self.directory, filename))
+            self._disk.clear()
+
+
+def _cache_key(request: Request, route_name: str, route: CachedRoute):
+    params = tuple(sorted((name, value)
+                          for name, value in request.GET.items()
+                          if name != 'embedded'))
+    # Pages contain absolute URLs
+    key = (route_name, request.host_url, request.path, params,
+           request.embedded)
+    if route.csrf:
+        key += (get_csrf_token(request),)
+    return key
+
+
+def page_cache_tween_factory(handler, registry):
+    """Tween serving the pages of :data:`CACHED_ROUTES` from
+    ``registry.page_cache`` to anonymous visitors.
+
+    Pages are cached if the response is a ``200 OK`` that does not set a
+    cookie. Authenticated requests always reach the view.
+
+    Pages are made stale again after the request that changed a table has
+    committed its transaction, so that a page rendered from the old data
+    in the meantime is not kept.
+    """
+    cache: PageCache = registry.page_cache
+
+    def tween(request: Request) -> Response:
+        cache.take_pending()
+        response = _cached_response(request)
+        tags = cache.take_pending()
+        if tags:
+            request.add_finished_callback(lambda request: cache._bump(tags))
+        return response
+
+    def _cached_response(request: Request) -> Response:
+        if (request.method != 'GET'
+                or request.environ.get(BYPASS_ENVIRON_KEY)):
+            return handler(request)
+        mapper = registry.queryUtility(IRoutesMapper)
+        info = mapper(request) if mapper else None
+        route_name = info['route'].name if info and info['route'] else None
+        route = CACHED_ROUTES.get(route_name)
+        if route is None or request.unauthenticated_userid is not None:
+            return handler(request)
+
+        key = _cache_key(request, route_name, route)
+        page = cache.get(key, route.tags)
+        if page is not None:
+            return Response(status=page.status,
+                            headerlist=list(page.headerlist),
+                            body=page.body)
+
+        versions = cache.versions(route.tags)
+        response = handler(request)
+        if (response.status_code == 200
+                and 'Set-Cookie' not in response.headers):
+            cache.put(key, CachedPage(status=response.status,
+                                      headerlist=list(response.headerlist),
+                                      body=response.body,
+                                      versions=versions,
+                                      expires=time.time() + cache.ttl))
+        return response
+
+    return tween
+
+
+def includeme(config: Configurator):
+    """Cache pages for anonymous visitors if the ``page_cache`` setting is
+    true. Settings:
+
+    ``page_cache.maxbytes``
+      Memory budget in bytes. Default: 16 MiB.
+
+    ``page_cache.ttl``
+      Seconds until a page expires. Default: ``60``.
+
+    ``page_cache.directory``
+      Directory for pages evicted from memory. Default: none.
+
+    ``page_cache.disk_maxbytes``
+      Disk budget in bytes. Default: 256 MiB.
+
+    The cache is available as ``registry.page_cache`` for reporting usage
+    statistics.
+    """
+    settings = config.registry.settings
+    if not asbool(settings.get('page_cache', False)):
+        config.registry.page_cache = None
+        return
+
+    config.registry.page_cache = PageCache(
+        int(settings.get('page_cache.maxbytes', 16 * 1024 * 1024)),
+        ttl=float(settings.get('page_cache.ttl', 60)),
+        directory=settings.get('page_cache.directory') or None,
+        disk_maxbytes=int(settings.get('page_cache.disk_maxbytes',
+                                       256 * 1024 * 1024)))
+    config.add_tween(
+        'unsafe.pagecache.page_cache_tween_factory',
+        under=('unsafe.conditional.conditional_get_tween_factory', INGRESS))
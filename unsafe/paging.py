@@ -0,0 +1,96 @@
+"""
+Keyset pagination helpers for listing views.
+
+Listings are paged with the query parameters ``after``, a cursor made from
+the sort key of the last row on the previous page, and ``limit``.
+"""
+from typing import Any, Iterable, Iterator, Optional, Sequence, Tuple
+
+from pyramid.httpexceptions import HTTPBadRequest
+from pyramid.request import Request
+
+from . import db
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 200
+
+
+def page_params(request: Request,
+                default_limit=DEFAULT_LIMIT) -> Tuple[Optional[Tuple[str, int]], int]:
+    """Get ``(after, limit)`` from the request parameters.
+
+    :raises HTTPBadRequest: if ``after`` is not a valid cursor
+    """
+    try:
+        after = db.parse_cursor(request.params.get('after'))
+    except ValueError:
+        raise HTTPBadRequest('Invalid cursor')
+
+    try:
+        limit = int(request.params.get('limit', default_limit))
+    except ValueError:
+        limit = default_limit
+    limit = min(max(limit, 1), MAX_LIMIT)
+
+    return after, limit
+
+
+def next_page_url(request: Request, rows: Sequence, limit: int,
+                  id_attr: str) -> Optional[str]:
+    """URL of the page following ``rows``, or ``None`` on the last page.
+
+    A full page is assumed to be followed by another page, so the last page
+    may turn out to be empty when the row count is a multiple of ``limit``.
+    """
+    if len(rows) < limit:
+        return None
+    return _after_url(request, rows[-1], id_attr)
+
+
+def _after_url(request: Request, last: Any, id_attr: str) -> str:
+    cursor = db.make_cursor(last.updated_at, getattr(last, id_attr))
+    query = [(k, v) for k, v in request.GET.items() if k != 'after']
+    query.append(('after', cursor))
+    return request.current_route_url(_query=query)
+
+
+class PageRows:
+    """Rows of a page that are read while a template iterates over them.
+
+    Once iterated, ``len()`` is the number of rows and :attr:`next_url` the
+    URL of the following page, as with :func:`next_page_url`. Rows from a
+    lazy iterator can only be iterated once.
+
+    :param request: current request
+    :param rows: rows of the page
+    :param limit: page size, ``None`` if there is no next page
+    :param id_attr: name of the id attribute of the rows
+    """
+
+    def __init__(self, request: Request, rows: Iterable, limit: Optional[int],
+                 id_attr: str):
+        self.request = request
+        self.rows = rows
+        self.limit = limit
+        self.id_attr = id_attr
+        self.count = 0
+        self.last = None
+
+    def __iter__(self) -> Iterator:
+        self.count = 0
+        for row in self.rows:
+            self.count += 1
+            self.last = row
+            yield row
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __bool__(self) -> bool:
+        return self.count > 0
+
+    @property
+    def next_url(self) -> Optional[str]:
+        if self.limit is None or self.count < self.limit:
+            return None
+        return _after_url(self.request, self.last, self.id_attr)
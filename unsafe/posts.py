@@ -1,9 +1,6 @@
-import hmac
-from typing import Set
-
-from pyramid.csrf import get_csrf_token
 from pyramid.exceptions import BadCSRFToken
 from pyramid.httpexceptions import HTTPFound
+from pyramid.interfaces import ICSRFStoragePolicy
 from pyramid.request import Request
 from pyramid.security import Allow, Everyone, Authenticated
 from pyramid.view import view_config
@@ -11,6 +8,8 @@ from pyramid.view import view_config
 from . import db
 from .app import RootContextFactory
 from .embed import embeddable
+from .paging import PageRows, page_params
+from .streaming import render_stream, streaming_enabled
 
 
 class PostsFactory(RootContextFactory):
@@ -44,30 +43,59 @@ class PostResource:
              permission='view',
              renderer='posts/list-posts.jinja2')
 def posts_listing(request: Request):
-    """Main posts listing"""
+    """Main posts listing, or search results ranked by relevance if there
+    is a ``q`` parameter."""
+    query = request.params.get('q', '').strip()
     user_id = request.params.get('user')
-    posts = db.post.find_posts(request.db, user_id=user_id)
-
-    unique_userids: Set[int] = set()
+    after, limit = page_params(request)
+    stream = streaming_enabled(request)
+    if query:
+        posts = db.post.search_posts(request.db, query, limit=limit)
+    elif stream:
+        posts = db.post.iter_thread_forest(request.db,
+                                           user_id=user_id,
+                                           after=after,
+                                           limit=limit)
+    else:
+        posts = db.post.find_thread_forest(request.db,
+                                           user_id=user_id,
+                                           after=after,
+                                           limit=limit)
+
+    if stream:
+        posts = _queue_users_in_batches(request, posts)
+    else:
+        for post in posts:
+            _queue_users(request, post)
+
+    value = {
+        'users': request.users,
+        'posts': PageRows(request, posts, None if query else limit,
+                          'post_id'),
+        'query': query,
+    }
+    if stream:
+        return render_stream('posts/list-posts.jinja2', value, request)
+    return value
 
-    def load_replies(post):
-        post.replies = db.post.find_posts(request.db, reply_to=post.post_id,
-                                          order='ASC')
-        unique_userids.update(reply.user_id for reply in post.replies)
-        unique_userids.add(post.user_id)
-        for reply in post.replies:
-            load_replies(reply)
 
-    for post in posts:
-        load_replies(post)
+def _queue_users(request: Request, post: db.post.Post):
+    request.users.queue(post.user_id)
+    for reply in post.replies:
+        _queue_users(request, reply)
 
-    users = {user_id: db.user.from_id(request.db, user_id)
-             for user_id in unique_userids}
 
-    return {
-        'users': users,
-        'posts': posts
-    }
+def _queue_users_in_batches(request: Request, posts, batch_size=20):
+    """Queue the users of threads read lazily, ``batch_size`` threads at a
+    time, so that users are still loaded with one query per batch."""
+    batch = []
+    for post in posts:
+        _queue_users(request, post)
+        batch.append(post)
+        if len(batch) >= batch_size:
+            yield from batch
+            batch = []
+    yield from batch
 
 
 @view_config(route_name='post',
@@ -109,8 +137,8 @@ def like_post_json(context: PostResource, request):
     # Calling pyramid.csrf.check_csrf_token would also achieve the same thing
     # by checking the X-CSRF-Token header.
     csrf_token = request_body.get('csrf_token', '')
-    expected_csrf_token = get_csrf_token(request)
-    if not hmac.compare_digest(csrf_token, expected_csrf_token):
+    policy = request.registry.getUtility(ICSRFStoragePolicy)
+    if not policy.check_csrf_token(request, csrf_token):
         raise BadCSRFToken()
 
     post = db.post.like_post(request.db, context.post.post_id)
@@ -174,7 +202,7 @@ def post_reply(context: PostResource, request: Request):
         return HTTPFound(location=request.route_url('posts',
                                                     _anchor=f'post-{post.post_id}'))
 
-    reply_to_user = db.user.from_id(request.db, context.post.user_id)
+    reply_to_user = request.users.load(context.post.user_id)
 
     return {
         'title': 'Svara på inlägg',
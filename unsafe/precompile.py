@@ -0,0 +1,123 @@
+"""
+Template precompilation and warm-up.
+
+Jinja2 compiles a template the first time it is rendered, so the first
+requests to each page after a deploy or worker restart are slow. With the
+``jinja2.bytecode_caching`` setting compiled templates are stored in
+``jinja2.bytecode_caching_directory``, where all workers find them.
+:func:`precompile` fills that cache with every template of the app, and
+:func:`warm_up` renders the topic pages once before serving traffic.
+"""
+import logging
+import os
+import time
+from typing import Dict, List, Optional, Set
+
+from jinja2 import Environment, meta
+from pyramid.request import Request
+from pyramid.router import Router
+from pyramid.settings import asbool
+from pyramid_jinja2 import IJinja2Environment
+
+from .pagecache import BYPASS_ENVIRON_KEY
+from .topics import MENU
+
+__all__ = [
+    'precompile',
+    'prepare_templates',
+    'template_names',
+    'warm_up',
+]
+
+TEMPLATE_PATH = os.path.join(os.path.dirname(__file__), 'templates')
+
+
+def template_names(path: str = TEMPLATE_PATH) -> List[str]:
+    """Names of all templates under ``path``, relative to ``path``."""
+    names = []
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            if filename.endswith('.jinja2'):
+                name = os.path.relpath(os.path.join(dirpath, filename), path)
+                names.append(name.replace(os.sep, '/'))
+    return sorted(names)
+
+
+def precompile(env: Environment,
+               names: Optional[List[str]] = None) -> List[str]:
+    """Compile templates and the templates they extend, include or import.
+
+    Templates are loaded through the bytecode cache of ``env``, if any,
+    which stores them. Referenced templates are loaded by the name they get
+    when rendered from the referencing template.
+
+    :param env: Jinja2 environment of the app
+    :param names: templates to compile, default :func:`template_names`
+    :returns: names of the compiled templates
+    """
+    compiled: Set[str] = set()
+
+    def load(name: str):
+        if name in compiled:
+            return
+        compiled.add(name)
+        env.get_template(name)
+        source, _, _ = env.loader.get_source(env, name)
+        for ref in meta.find_referenced_templates(env.parse(source)):
+            if ref is not None:
+                load(env.join_path(ref, name))
+
+    for name in template_names() if names is None else names:
+        load(name)
+    return sorted(compiled)
+
+
+def topic_paths() -> List[str]:
+    """Paths of the topic pages."""
+    return ['/topics'] + [f'/topics/{menu["topic"]}'
+                          for section in MENU
+                          for menu in section['menu']]
+
+
+def warm_up(app: Router, paths: Optional[List[str]] = None) -> Dict[str, int]:
+    """Render pages by sending requests to the app.
+
+    The requests are sent to ``http://localhost``, so the pages are not put
+    in the page cache, where they would only take up space.
+
+    :param app: the app
+    :param paths: paths to request, default the start page and
+        :func:`topic_paths`
+    :returns: response status codes by path
+    """
+    if paths is None:
+        paths = ['/'] + topic_paths()
+    statuses = {}
+    for path in paths:
+        request = Request.blank(path, environ={BYPASS_ENVIRON_KEY: True})
+        response = request.get_response(app)
+        statuses[path] = response.status_code
+        if response.status_code != 200:
+            logging.getLogger(__name__).warning(
+                'Warm-up request to %s failed: %s', path, response.status)
+    return statuses
+
+
+def prepare_templates(app: Router):
+    """Precompile templates and warm up pages at startup, as configured by
+    the ``templates.precompile`` and ``templates.warm_up`` settings."""
+    settings = app.registry.settings
+    logger = logging.getLogger(__name__)
+
+    if asbool(settings.get('templates.precompile', False)):
+        start = time.perf_counter()
+        env = app.registry.getUtility(IJinja2Environment, name='.jinja2')
+        names = precompile(env)
+        logger.info('Precompiled %d templates in %.2f s', len(names),
+                    time.perf_counter() - start)
+
+    if asbool(settings.get('templates.warm_up', False)):
+        start = time.perf_counter()
+        statuses = warm_up(app)
+        logger.info('Warmed up %d pages in %.2f s', len(statuses),
+                    time.perf_counter() - start)
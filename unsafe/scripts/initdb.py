@@ -3,8 +3,14 @@ Database initialization utility.
 
 Creates database and loads initial data. Invokes `unsafe.db.init`.
 
-Database name is given as the first argument and defaults to `app.db`
-in the current directory.
+Database name is given with ``--db`` or read from the ``db.app`` setting of
+the configuration file given as the first argument.
+
+With ``--migrate`` pending schema migrations are applied to an existing
+database instead, leaving its data in place. This can be run against the
+database of a running application, see :mod:`unsafe.db.schema`: readers
+are not blocked, and requests wait up to ``db.busy_timeout`` seconds for
+each index build to commit.
 
 """
 import argparse
@@ -19,6 +25,8 @@ import unsafe.db as db
 def main(argv=sys.argv):
     parser = argparse.ArgumentParser()
     parser.add_argument('--reset', '-r', action='store_true')
+    parser.add_argument('--migrate', '-m', action='store_true',
+                        help='apply pending migrations to existing database')
     parser.add_argument('--db', '-db')
     parser.add_argument('config', default='production.ini', nargs='?')
     args = parser.parse_args(argv[1:])
@@ -34,7 +42,17 @@ def main(argv=sys.argv):
     if args.reset and os.path.exists(dbname):
         os.remove(dbname)
 
-    db.init(dbname)
+    if args.migrate and os.path.exists(dbname):
+        applied = db.migrate(dbname)
+        conn = db.connect(dbname)
+        try:
+            version = db.schema_version(conn)
+        finally:
+            conn.close()
+        print(f'Applied {len(applied)} migrations to {dbname},'
+              f' schema version is {version}')
+    else:
+        db.init(dbname)
 
 
 if __name__ == '__main__':  # pragma: no cover
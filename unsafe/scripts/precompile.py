@@ -0,0 +1,53 @@
+"""
+Template precompilation utility.
+
+Compiles all templates into the bytecode cache configured with the
+``jinja2.bytecode_caching`` and ``jinja2.bytecode_caching_directory``
+settings of the configuration file given as the first argument, so that
+workers started afterwards load compiled templates instead of compiling
+them on the first requests.
+"""
+import argparse
+import sys
+import time
+
+from pyramid.config import Configurator
+from pyramid.paster import get_appsettings
+from pyramid.settings import asbool
+
+from unsafe.app import configure_templates
+from unsafe.precompile import precompile
+
+
+def main(argv=sys.argv):
+    parser = argparse.ArgumentParser(
+        description='Compile templates into the bytecode cache')
+    parser.add_argument('config', default='production.ini', nargs='?')
+    parser.add_argument('--verbose', '-v', action='store_true',
+                        help='list the compiled templates')
+    args = parser.parse_args(argv[1:])
+
+    settings = get_appsettings(args.config)
+    if not settings:
+        settings = get_appsettings(args.config, name='unsafe')
+    if not asbool(settings.get('jinja2.bytecode_caching', False)):
+        sys.exit(f'jinja2.bytecode_caching is not enabled in {args.config}')
+
+    config = Configurator(settings=settings)
+    configure_templates(config)
+    config.commit()
+
+    start = time.perf_counter()
+    names = precompile(config.get_jinja2_environment())
+    elapsed = time.perf_counter() - start
+    if args.verbose:
+        for name in names:
+            print(name)
+    directory = (settings.get('jinja2.bytecode_caching_directory')
+                 or 'the default directory')
+    print(f'Compiled {len(names)} templates in {elapsed:.2f} s into'
+          f' {directory}')
+
+
+if __name__ == '__main__':  # pragma: no cover
+    sys.exit(main() or 0)
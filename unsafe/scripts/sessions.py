@@ -4,35 +4,119 @@ import sys
 
 from pyramid.paster import get_appsettings
 
-from unsafe.session import expire_sessions, purge_sessions, remove_sessions
+from unsafe.session import (
+    expire_sessions,
+    optimize_sessions,
+    purge_sessions,
+    remove_sessions,
+    remove_user_sessions,
+    session_stats,
+    user_session_counts,
+)
+from unsafe.session_backend import SQLiteSessionBackend, shard_databases
+
+
+def print_stats(dbname):
+    stats = session_stats(dbname)
+    free = stats['freelist_count'] * stats['page_size']
+    print(f'{dbname}:')
+    print(f'  sessions: {stats["rows"]} ({stats["expired"]} expired,'
+          f' {stats["users"]} users)')
+    lower = 0
+    for size, count in stats['sizes'].items():
+        label = f'{lower}-{size - 1}' if size else f'{lower}-'
+        print(f'  {label:>12} bytes: {count}')
+        lower = size
+    print(f'  file size: {stats["file_size"]} bytes'
+          f' ({stats["page_count"]} pages, {stats["freelist_count"]} free,'
+          f' {free} bytes reclaimable)')
 
 
 def main(argv=sys.argv):
-    parser = argparse.ArgumentParser()
+    parser = argparse.ArgumentParser(
+        description='Remove sessions or maintain the session database.'
+                    ' Removes expired sessions by default, or all sessions'
+                    ' with "all", or the given session ids. "users" lists'
+                    ' session counts per user, "stats" reports on the'
+                    ' database and "optimize" frees unused space.')
     parser.add_argument('--db', '-db')
+    parser.add_argument('--shards', type=int,
+                        help='number of shards of a sharded session store')
     parser.add_argument('--time')
+    parser.add_argument('--user', type=int,
+                        help='remove all sessions of a user, running'
+                             ' applications log the user out within'
+                             ' session.cache_ttl seconds')
+    parser.add_argument('--batch-size', type=int, default=1000,
+                        help='delete at most this many sessions per'
+                             ' transaction, 0 for no limit')
+    parser.add_argument('--pause', type=float, default=0.1,
+                        help='seconds to pause between batches')
+    parser.add_argument('--full', action='store_true',
+                        help='rebuild the database when optimizing'
+                             ' (blocks the application while running)')
     parser.add_argument('--config', default='production.ini')
     parser.add_argument('session', default='expired', nargs='*')
     args = parser.parse_args(argv[1:])
 
     if args.db:
         dbname = args.db
+        shards = args.shards
     else:
         settings = get_appsettings(args.config)
         if not settings:
             settings = get_appsettings(args.config, name='unsafe')
         dbname = settings['db.sessions']
+        shards = args.shards
+        if shards is None and settings.get('session.backend') == 'sharded':
+            shards = int(settings.get('session.shards', 4))
 
-    if not os.path.exists(dbname):
-        count = 0
-    elif args.session == ['all']:
-        count = purge_sessions(database=dbname)
-    elif args.session == 'expired':
-        count = expire_sessions(expiry_time=args.time, database=dbname)
+    if shards:
+        dbnames = shard_databases(dbname, shards)
     else:
-        count = remove_sessions(args.session, database=dbname)
+        dbnames = [dbname]
+
+    total = 0
+    for dbname in dbnames:
+        if os.path.exists(dbname):
+            # Add columns missing in older session databases
+            SQLiteSessionBackend(dbname, pool_size=1).close()
+
+        if not os.path.exists(dbname):
+            count = 0
+        elif args.session == ['stats']:
+            print_stats(dbname)
+            continue
+        elif args.session == ['optimize']:
+            count = optimize_sessions(dbname, full=args.full)
+            print(f'Freed {count} pages of {dbname}')
+            continue
+        elif args.session == ['users']:
+            counts = user_session_counts(database=dbname)
+            for user_id, user_count in counts.items():
+                print(f'{user_id}\t{user_count}')
+            print(f'{sum(counts.values())} sessions of {len(counts)} users'
+                  f' in {dbname}')
+            continue
+        elif args.user is not None:
+            count = remove_user_sessions(args.user, database=dbname)
+        elif args.session == ['all']:
+            count = purge_sessions(database=dbname,
+                                   batch_size=args.batch_size,
+                                   pause=args.pause)
+        elif args.session == 'expired':
+            count = expire_sessions(expiry_time=args.time, database=dbname,
+                                    batch_size=args.batch_size,
+                                    pause=args.pause)
+        else:
+            count = remove_sessions(args.session, database=dbname)
+
+        print(f'Purged {count} sessions from {dbname}')
+        total += count
 
-    print(f'Purged {count} sessions from {dbname}')
+    if len(dbnames) > 1 and args.session not in (['stats'], ['optimize'],
+                                                  ['users']):
+        print(f'Purged {total} sessions in total')
 
 
 if __name__ == '__main__':  # pragma: no cover
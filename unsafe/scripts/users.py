@@ -0,0 +1,247 @@
+"""
+User administration utility.
+
+``import`` creates users from a CSV file with the columns ``username``,
+``password``, ``email`` and ``groups`` (space separated), or from a JSON
+lines file with the same keys where ``groups`` may also be a list. Files
+ending with ``.jsonl`` or ``.json`` are read as JSON lines, anything else
+as CSV, unless ``--format`` is given.
+
+Passwords are hashed on all CPU cores and users are inserted in
+transactions of ``--batch-size`` users. Users whose name is already taken
+are skipped.
+
+``calibrate`` measures how long verifying a password takes with each
+password scheme on this machine and recommends the number of rounds that
+gives a verification time of ``--target-ms`` milliseconds. With ``--write``
+the recommendations are written to the ``passwords.<scheme>.rounds``
+settings of the configuration file.
+
+Password hash costs are read from the configuration file given with
+``--config``, if it exists, and are the defaults of
+:data:`unsafe.db.user.pwdctx` otherwise. Database name is given with
+``--db`` or read from the ``db.app`` setting of the configuration file.
+"""
+import argparse
+import csv
+import json
+import os
+import re
+import sys
+import time
+from typing import Dict, Iterator, List, Optional, TextIO
+
+from pyramid.paster import get_appsettings
+
+import unsafe.db as db
+from unsafe.db.user import (
+    User,
+    configure_pwdctx,
+    existing_usernames,
+    insert_many,
+    pwdctx,
+)
+from unsafe.hashing import (
+    calibratable_schemes,
+    hash_many,
+    measure_verify,
+    recommend_rounds,
+)
+
+
+def read_users(file: TextIO, format: str) -> Iterator[dict]:
+    if format == 'jsonl':
+        for line in file:
+            if line.strip():
+                yield json.loads(line)
+    else:
+        yield from csv.DictReader(file)
+
+
+def parse_user(row: dict, line: int) -> User:
+    username = (row.get('username') or '').strip()
+    password = row.get('password') or ''
+    if not username or not password:
+        raise ValueError(f'Line {line}: username and password are required')
+    groups = row.get('groups') or []
+    if isinstance(groups, str):
+        groups = groups.split()
+    return User(user_id=None,
+                username=username,
+                email=row.get('email') or None,
+                password=password,
+                groups=list(groups))
+
+
+def import_users(dbname: str, users: List[User], *, batch_size: int = 500,
+                 workers: Optional[int] = None, out=sys.stdout) -> int:
+    """Hash passwords and insert users that do not exist yet.
+
+    :returns: the number of created users
+    """
+    conn = db.connect(dbname)
+    try:
+        taken = existing_usernames(conn, (user.username for user in users))
+        new_users = []
+        for user in users:
+            if user.username in taken:
+                print(f'Skipping existing user {user.username}', file=out)
+            else:
+                taken.add(user.username)
+                new_users.append(user)
+        if not new_users:
+            return 0
+
+        start = time.perf_counter()
+        hashes = hash_many(pwdctx, [user.password for user in new_users],
+                           workers=workers)
+        for user, hash in zip(new_users, hashes):
+            user.password = hash
+        hashed = time.perf_counter()
+
+        count = 0
+        for i in range(0, len(new_users), batch_size):
+            with conn:
+                count += insert_many(conn, new_users[i:i + batch_size])
+        inserted = time.perf_counter()
+    finally:
+        conn.close()
+
+    hash_time = hashed - start
+    insert_time = inserted - hashed
+    print(f'Hashed {count} passwords in {hash_time:.2f} s'
+          f' ({count / hash_time:.1f} users/s)', file=out)
+    print(f'Inserted {count} users in {insert_time:.2f} s'
+          f' ({count / insert_time if insert_time else count:.0f} users/s)',
+          file=out)
+    return count
+
+
+def import_command(args, dbname):
+    format = args.format
+    if not format:
+        ext = os.path.splitext(args.file)[1].lower()
+        format = 'jsonl' if ext in ('.jsonl', '.json') else 'csv'
+
+    if args.file == '-':
+        rows = list(read_users(sys.stdin, format))
+    else:
+        with open(args.file, newline='', encoding='utf-8') as f:
+            rows = list(read_users(f, format))
+
+    try:
+        users = [parse_user(row, line) for line, row in enumerate(rows, 1)]
+    except ValueError as e:
+        sys.exit(str(e))
+    count = import_users(dbname, users, batch_size=args.batch_size,
+                         workers=args.workers)
+    print(f'Created {count} of {len(users)} users in {dbname}')
+
+
+def update_ini(path: str, values: Dict[str, object]):
+    """Set settings in the app section of an ini file, keeping comments and
+    the order of other lines. Missing settings are added at the end of the
+    section."""
+    with open(path, encoding='utf-8') as f:
+        lines = f.read().splitlines()
+
+    section = None
+    for name in ('app:main', 'app:unsafe'):
+        if f'[{name}]' in lines:
+            section = lines.index(f'[{name}]')
+            break
+    if section is None:
+        raise ValueError(f'No app section in {path}')
+
+    end = section + 1
+    while end < len(lines) and not lines[end].startswith('['):
+        end += 1
+
+    remaining = dict(values)
+    for i in range(section + 1, end):
+        match = re.match(r'([\w.]+)\s*=', lines[i])
+        if match and match.group(1) in remaining:
+            key = match.group(1)
+            lines[i] = f'{key} = {remaining.pop(key)}'
+
+    # Insert after the last setting of the section
+    insert_at = end
+    while insert_at > section + 1 and not lines[insert_at - 1].strip():
+        insert_at -= 1
+    lines[insert_at:insert_at] = [f'{key} = {value}'
+                                  for key, value in remaining.items()]
+
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(lines) + '\n')
+
+
+def calibrate_command(args, dbname):
+    target = args.target_ms / 1000
+    recommended = {}
+    print(f'{"scheme":<16}{"rounds":>10}{"ms":>8}{"recommended":>13}'
+          f'{"est. ms":>9}')
+    for scheme in calibratable_schemes(pwdctx):
+        rounds, seconds = measure_verify(pwdctx, scheme,
+                                         samples=args.samples)
+        new_rounds = recommend_rounds(pwdctx, scheme, rounds, seconds,
+                                      target)
+        if pwdctx.handler(scheme).rounds_cost == 'log2':
+            estimate = seconds * 2 ** (new_rounds - rounds)
+        else:
+            estimate = seconds * new_rounds / rounds
+        print(f'{scheme:<16}{rounds:>10}{seconds * 1000:>8.0f}'
+              f'{new_rounds:>13}{estimate * 1000:>9.0f}')
+        recommended[f'passwords.{scheme}.rounds'] = new_rounds
+
+    if args.write:
+        update_ini(args.config, recommended)
+        print(f'Wrote recommended rounds to {args.config}')
+
+
+def main(argv=sys.argv):
+    parser = argparse.ArgumentParser(description='User administration')
+    parser.add_argument('--db', '-db')
+    parser.add_argument('--config', default='production.ini')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    import_parser = commands.add_parser(
+        'import', help='create users from a CSV or JSON lines file')
+    import_parser.add_argument('file', help='file to read, - for stdin')
+    import_parser.add_argument('--format', choices=('csv', 'jsonl'))
+    import_parser.add_argument('--batch-size', type=int, default=500,
+                               help='users inserted per transaction')
+    import_parser.add_argument('--workers', type=int,
+                               help='hashing processes, default one per CPU')
+    import_parser.set_defaults(func=import_command)
+
+    calibrate_parser = commands.add_parser(
+        'calibrate', help='recommend password hash rounds for this machine')
+    calibrate_parser.add_argument('--target-ms', type=float, default=250,
+                                  help='target verification time')
+    calibrate_parser.add_argument('--samples', type=int, default=3,
+                                  help='verifications to time per scheme')
+    calibrate_parser.add_argument('--write', action='store_true',
+                                  help='write recommendations to --config')
+    calibrate_parser.set_defaults(func=calibrate_command)
+
+    args = parser.parse_args(argv[1:])
+
+    if getattr(args, 'write', False) and not os.path.exists(args.config):
+        sys.exit(f'Configuration file {args.config} not found')
+
+    # Password hash costs are taken from the configuration file if there is
+    # one, also when the database is given with --db
+    if args.db and not os.path.exists(args.config):
+        dbname = args.db
+    else:
+        settings = get_appsettings(args.config)
+        if not settings:
+            settings = get_appsettings(args.config, name='unsafe')
+        configure_pwdctx(settings)
+        dbname = args.db or settings['db.app']
+
+    args.func(args, dbname)
+
+
+if __name__ == '__main__':  # pragma: no cover
+    sys.exit(main() or 0)
@@ -10,19 +10,36 @@ Setting ``query_param`` allows setting the session id with a query parameter.
 
 Setting ``accept_client_session_id`` to *True* accepts session ids that were
 not generated by the server (or session that have been deleted).
+
+Setting ``cookie_store`` to *True* keeps small sessions in the signed cookie
+instead of the session database.
 """
-import json
+import atexit
+import logging
 import os
+import threading
 import time
-from typing import Optional
+from typing import Dict, Optional, Union
 import datetime
 
 from pyramid.config import Configurator
 from pyramid.interfaces import ISession
+from pyramid.settings import asbool
 from webob.cookies import SignedSerializer
 from zope.interface import implementer
 
 from . import db
+from .cache import LRUCache
+from .session_backend import (
+    MemorySessionBackend,
+    SessionBackend,
+    SessionRecord,
+    SessionSweeper,
+    ShardedSQLiteSessionBackend,
+    SQLiteSessionBackend,
+)
+from .session_serializer import SessionSerializer
+from .tasks import PeriodicTask
 
 
 def MySessionFactory(secret: str,
@@ -33,16 +50,28 @@ def MySessionFactory(secret: str,
                      path='/',
                      domain: Optional[str] = None,
                      database='sessions.db',
+                     backend: Optional[SessionBackend] = None,
+                     serializer: Union[str, SessionSerializer] = 'json',
+                     compress_threshold=0,
                      timeout=1200,
                      samesite='Lax',
                      httponly=False,
                      secure=False,
                      query_param: Optional[str] = None,
-                     accept_client_session_id=False
+                     accept_client_session_id=False,
+                     cache_size=0,
+                     cache_ttl=10,
+                     refresh_threshold=0.0,
+                     refresh_delay=0,
+                     cookie_store=False,
+                     cookie_max_size=4000,
+                     revocations: Optional['RevocationList'] = None,
+                     userid_key='auth.userid'
                      ):
     """
     Configure a :term:`session factory` which will provide a sqlite-backed
-    session store.
+    session store, or a session store using another
+    :class:`unsafe.session_backend.SessionBackend`.
 
     The return value of this function is a :term:`session factory`, which may
     be provided as the ``session_factory`` argument of a :class:`pyramid.config.Configurator`
@@ -77,6 +106,24 @@ def MySessionFactory(secret: str,
     ``domain``
       The domain used for the session cookie.  Default: ``None`` (no domain).
 
+    ``database``
+      The SQLite database used by the default backend.
+      Default: ``'sessions.db'``.
+
+    ``backend``
+      The :class:`unsafe.session_backend.SessionBackend` storing sessions.
+      Default: a :class:`unsafe.session_backend.SQLiteSessionBackend` using
+      ``database``.
+
+    ``serializer``
+      Format of stored session data, ``'json'`` or ``'marshal'``, or a
+      :class:`unsafe.session_serializer.SessionSerializer`. Sessions stored
+      in any format can be loaded. Default: ``'json'``.
+
+    ``compress_threshold``
+      Compress session data larger than this number of bytes. Ignored if
+      ``serializer`` is a ``SessionSerializer``. Default: ``0`` (never).
+
     ``secure``
       The 'secure' flag of the session cookie.
 
@@ -92,18 +139,73 @@ def MySessionFactory(secret: str,
       A number of seconds of inactivity before a session times out.
       Default: ``1200``.
 
+    ``cache_size``
+      Number of session records to keep in an in-process LRU cache in front
+      of the backend. Writes go through to the backend. Default: ``0`` (no
+      cache).
+
+    ``cache_ttl``
+      Seconds a cached session record is used before it is loaded from the
+      backend again. The cache is not shared between processes, so a
+      session deleted by another process, e.g. by ``unsafe-sessions`` or
+      the sweeper of another worker, is accepted for up to this long, or
+      until the session is next written. Default: ``10``.
+
+    ``refresh_threshold``
+      Fraction of ``timeout`` that must pass before the expiry time of an
+      accessed but unchanged session is pushed forward. With the default
+      ``0.0`` the expiry time is refreshed on every access.
+
+    ``refresh_delay``
+      Maximum number of seconds a refresh of the expiry time may be queued
+      before being written. Queued refreshes are coalesced and written in a
+      single transaction by a background thread. Sessions close to expiry
+      are still refreshed immediately. Default: ``0`` (write immediately).
+
+    An expiry time is thus at most ``refresh_threshold * timeout +
+    refresh_delay`` seconds behind, which must be less than ``timeout``.
+
+    ``cookie_store``
+      Store session data in the signed session cookie instead of the
+      backend, saving a database round trip per request. Sessions that do
+      not fit in ``cookie_max_size`` bytes, or that cannot be serialized as
+      JSON, are stored in the backend as usual. Requires ``secret``, since
+      an unsigned cookie could be modified by the client. Default:
+      ``False``.
+
+    ``cookie_max_size``
+      Maximum size in bytes of a session cookie with session data.
+      Default: ``4000``.
+
+    ``revocations``
+      The :class:`RevocationList` recording cookie stored sessions that
+      were invalidated before they expired. Default: a ``RevocationList``
+      using ``database``.
+
+    ``userid_key``
+      Session key holding the authenticated user id, which is also stored
+      in an indexed column so that the sessions of a user can be found
+      without decoding session data. Default: ``'auth.userid'``, the key
+      used by :class:`pyramid.authentication.SessionAuthenticationPolicy`.
+
     """
+    if refresh_threshold * timeout + refresh_delay >= timeout:
+        raise ValueError('refresh_threshold * timeout + refresh_delay must be'
+                         ' less than timeout')
 
-    # Create database and session_store table if needed
-    with db.cursor(database) as cur:
-        cur.execute('''
-            CREATE TABLE IF NOT EXISTS session_store (
-                session_id TEXT PRIMARY KEY,
-                expires_at INTEGER NOT NULL,
-                created_at INTEGER NOT NULL,
-                userdata TEXT NOT NULL
-                );
-            ''')
+    if cookie_store and not secret:
+        raise ValueError('cookie_store requires a secret')
+
+    if backend is None:
+        # Creates database and session_store table if needed
+        backend = SQLiteSessionBackend(database)
+
+    if cookie_store and revocations is None:
+        revocations = RevocationList(database)
+
+    if isinstance(serializer, str):
+        serializer = SessionSerializer(serializer,
+                                       compress_threshold=compress_threshold)
 
     if secret:
         cookie_serializer = SignedSerializer(secret, salt=salt,
@@ -115,44 +217,292 @@ def MySessionFactory(secret: str,
                             cookie_name=cookie_name,
                             path=path,
                             domain=domain,
-                            database=database,
+                            backend=backend,
+                            serializer=serializer,
                             timeout=timeout,
                             samesite=samesite,
                             httponly=httponly,
                             secure=secure,
                             query_param=query_param,
-                            accept_client_session_id=accept_client_session_id)
+                            accept_client_session_id=accept_client_session_id,
+                            cache_size=cache_size,
+                            cache_ttl=cache_ttl,
+                            refresh_threshold=refresh_threshold,
+                            refresh_delay=refresh_delay,
+                            cookie_store=cookie_store,
+                            cookie_max_size=cookie_max_size,
+                            revocations=revocations,
+                            userid_key=userid_key)
+
+
+def _delete_in_batches(database, where, params=(), batch_size=None,
+                       pause=0):
+    """Delete matching sessions, at most ``batch_size`` per transaction."""
+    if not batch_size:
+        with db.cursor(database) as cur:
+            cur.execute(f'DELETE FROM session_store WHERE {where}', params)
+            return cur.rowcount
+
+    total = 0
+    conn = db.connect(database)
+    try:
+        while True:
+            with db.cursor(conn, commit=True) as cur:
+                cur.execute('DELETE FROM session_store WHERE rowid IN ('
+                            ' SELECT rowid FROM session_store'
+                            f' WHERE {where} LIMIT ?)',
+                            (*params, batch_size))
+                count = cur.rowcount
+            total += count
+            if count < batch_size:
+                return total
+            if pause:
+                time.sleep(pause)
+    finally:
+        conn.close()
+
+
+def purge_sessions(database='sessions.db', *, batch_size=None, pause=0):
+    """Delete all sessions."""
+    return _delete_in_batches(database, '1', (), batch_size, pause)
 
 
-def purge_sessions(database='sessions.db'):
+def remove_sessions(session_ids, database='sessions.db'):
     with db.cursor(database) as cur:
-        now = int(time.time())
-        cur.execute('DELETE FROM session_store WHERE expires_at >= ?', (now,))
+        cur.executemany('DELETE FROM session_store WHERE session_id = ?',
+                        [(session_id,) for session_id in session_ids])
         return cur.rowcount
 
 
-def remove_sessions(session_ids, database='sessions.db'):
+def remove_user_sessions(user_id, database='sessions.db'):
+    """Delete all sessions of a user from a session database.
+
+    Processes caching sessions (see ``cache_ttl`` of
+    :func:`MySessionFactory`) may accept the sessions until their cached
+    records expire. Within the application use the
+    ``remove_user_sessions`` method of the session factory instead, which
+    logs the user out everywhere at once. Sessions stored in cookies are not
+    affected.
+    """
     with db.cursor(database) as cur:
-        cur.executemany('DELETE FROM session_store WHERE session_id = ?',
-                        (session_ids,))
+        cur.execute('DELETE FROM session_store WHERE user_id = ?', (user_id,))
         return cur.rowcount
 
 
-def expire_sessions(expiry_time=None, database='sessions.db'):
+def user_session_counts(database='sessions.db') -> Dict[int, int]:
+    """Number of unexpired sessions per authenticated user."""
     with db.cursor(database) as cur:
-        if expiry_time is None:
-            expiry_time = time.time()
-        elif isinstance(expiry_time, datetime.date):
-            expiry_time = time.mktime(expiry_time.timetuple())
-        elif isinstance(expiry_time, str):
-            dt = datetime.datetime.fromisoformat(expiry_time)
-            expiry_time = time.mktime(dt.timetuple())
-        elif not isinstance(expiry_time, (int, float)):
-            raise ValueError()
-        expiry_time = int(expiry_time)
-        cur.execute('DELETE FROM session_store WHERE expires_at >= ?',
-                    (expiry_time,))
-        return cur.rowcount
+        cur.execute('SELECT user_id, COUNT(*) FROM session_store'
+                    ' WHERE user_id IS NOT NULL AND expires_at >= ?'
+                    ' GROUP BY user_id ORDER BY user_id', (int(time.time()),))
+        return dict(cur.fetchall())
+
+
+def expire_sessions(expiry_time=None, database='sessions.db', *,
+                    batch_size=None, pause=0):
+    """Delete sessions that expired before ``expiry_time`` (default now)."""
+    if expiry_time is None:
+        expiry_time = time.time()
+    elif isinstance(expiry_time, datetime.date):
+        expiry_time = time.mktime(expiry_time.timetuple())
+    elif isinstance(expiry_time, str):
+        dt = datetime.datetime.fromisoformat(expiry_time)
+        expiry_time = time.mktime(dt.timetuple())
+    elif not isinstance(expiry_time, (int, float)):
+        raise ValueError()
+    expiry_time = int(expiry_time)
+    return _delete_in_batches(database, 'expires_at < ?', (expiry_time,),
+                              batch_size, pause)
+
+
+class ExpiryRefresher:
+    """Write-behind queue for session expiry time refreshes.
+
+    Refreshes are queued per session, a later refresh replacing an earlier
+    one, and written with a single
+    :meth:`~unsafe.session_backend.SessionBackend.touch_many` call by a
+    background thread every ``max_delay`` seconds. Queued refreshes are also
+    written at interpreter exit.
+
+    :param backend: session backend
+    :param max_delay: maximum number of seconds a refresh stays queued
+    """
+
+    def __init__(self, backend: SessionBackend, max_delay: float):
+        self.backend = backend
+        self._pending: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._task = PeriodicTask(self.flush, max_delay,
+                                  name='session-expiry-refresher')
+        atexit.register(self.close)
+
+    def queue(self, session_id: str, expires_at: int):
+        """Queue a refresh of the expiry time of a session."""
+        with self._lock:
+            self._pending[session_id] = expires_at
+        self._task.start()
+
+    def flush(self) -> int:
+        """Write queued refreshes, returning the number of sessions
+        updated."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+        return self.backend.touch_many(pending)
+
+    def close(self):
+        """Stop the background thread and write any queued refreshes."""
+        self._task.stop()
+        self.flush()
+
+
+#: Upper bounds of the payload size buckets reported by
+#: :func:`session_stats`
+SIZE_BUCKETS = (256, 1024, 4096, 16384)
+
+
+def session_stats(database='sessions.db') -> Dict[str, object]:
+    """Report on the contents and storage of a session database.
+
+    - ``rows``: number of sessions
+    - ``expired``: number of expired sessions
+    - ``users``: number of users with a session
+    - ``sizes``: number of sessions per payload size bucket, keyed by the
+      upper bound of the bucket (``None`` for larger payloads)
+    - ``file_size``: size of the database file in bytes
+    - ``page_size``, ``page_count``, ``freelist_count``: storage used by the
+      database, free pages can be reclaimed by :func:`optimize_sessions`
+    """
+    with db.cursor(database) as cur:
+        cur.execute('SELECT COUNT(*), COUNT(DISTINCT user_id),'
+                    ' COALESCE(SUM(expires_at < ?), 0)'
+                    ' FROM session_store', (int(time.time()),))
+        rows, users, expired = cur.fetchone()
+
+        bucket = ' '.join(f'WHEN size < {size} THEN {size}'
+                          for size in SIZE_BUCKETS)
+        cur.execute(f'SELECT CASE {bucket} END, COUNT(*) FROM'
+                    ' (SELECT length(userdata) AS size FROM session_store)'
+                    ' GROUP BY 1')
+        counts = dict(cur.fetchall())
+        sizes = {size: counts.get(size, 0) for size in SIZE_BUCKETS + (None,)}
+
+        pragmas = {}
+        for pragma in ('page_size', 'page_count', 'freelist_count'):
+            cur.execute(f'PRAGMA {pragma}')
+            pragmas[pragma] = cur.fetchone()[0]
+
+    return {
+        'rows': rows,
+        'expired': expired,
+        'users': users,
+        'sizes': sizes,
+        'file_size': os.path.getsize(database),
+        **pragmas,
+    }
+
+
+def optimize_sessions(database='sessions.db', *, full=False) -> int:
+    """Update query planner statistics and free unused pages.
+
+    :param full: rebuild the database with ``VACUUM``, which also enables
+        incremental vacuuming of databases created before it was the
+        default. Blocks all writers while running.
+    :returns: the number of pages freed
+    """
+    conn = db.connect(database)
+    try:
+        conn.isolation_level = None
+        conn.execute('ANALYZE')
+        freelist_count = conn.execute('PRAGMA freelist_count').fetchone()[0]
+        page_count = conn.execute('PRAGMA page_count').fetchone()[0]
+        if full:
+            conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+            conn.execute('VACUUM')
+        else:
+            conn.execute('PRAGMA incremental_vacuum').fetchall()
+        freed = page_count - conn.execute('PRAGMA page_count').fetchone()[0]
+        logging.getLogger(__name__).info(
+            'Optimized %s: %d free pages, %d freed', database, freelist_count,
+            freed)
+        return freed
+    finally:
+        conn.close()
+
+
+class RevocationList:
+    """Ids of cookie stored sessions that were invalidated.
+
+    A session stored in a cookie stays valid until it expires, even if the
+    session is invalidated at logout. Invalidated session ids are therefore
+    recorded until their expiry time in the ``session_revoked`` table.
+
+    Lookups only use an in-memory copy of the table which is refreshed
+    every ``refresh_interval`` seconds by a background thread, so a session
+    revoked by another process may be accepted for up to that long.
+
+    :param database: database file name, ``None`` to only keep revoked
+        sessions in memory
+    :param refresh_interval: seconds between reloading revoked sessions
+    """
+
+    def __init__(self, database: Optional[str] = None, *,
+                 refresh_interval: float = 10):
+        self.database = database
+        self._revoked: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._task = PeriodicTask(self.refresh, refresh_interval,
+                                  name='session-revocations')
+        if database:
+            with db.cursor(database) as cur:
+                cur.execute('''
+                    CREATE TABLE IF NOT EXISTS session_revoked (
+                        session_id TEXT PRIMARY KEY,
+                        expires_at INTEGER NOT NULL
+                        );
+                    ''')
+            self.refresh()
+            self._task.start()
+            atexit.register(self.close)
+
+    def __contains__(self, session_id: str) -> bool:
+        return session_id in self._revoked
+
+    def __len__(self):
+        return len(self._revoked)
+
+    def revoke(self, session_id: str, expires_at: int):
+        """Reject the session until it expires."""
+        with self._lock:
+            if self.database:
+                with db.cursor(self.database) as cur:
+                    cur.execute('INSERT OR REPLACE INTO session_revoked'
+                                ' (session_id, expires_at) VALUES (?, ?)',
+                                (session_id, expires_at))
+            self._revoked = {**self._revoked, session_id: expires_at}
+
+    def refresh(self):
+        """Forget expired sessions and reload sessions revoked by other
+        processes."""
+        now = int(time.time())
+        with self._lock:
+            if self.database:
+                with db.cursor(self.database) as cur:
+                    cur.execute('DELETE FROM session_revoked'
+                                ' WHERE expires_at < ?', (now,))
+                    cur.execute('SELECT session_id, expires_at'
+                                ' FROM session_revoked')
+                    self._revoked = dict(cur.fetchall())
+            else:
+                self._revoked = {session_id: expires_at
+                                 for session_id, expires_at
+                                 in self._revoked.items()
+                                 if expires_at >= now}
+
+    def close(self):
+        """Stop the background thread."""
+        self._task.stop()
 
 
 class IdentityCookieSerializer:
@@ -168,14 +518,31 @@ def _session_factory(*,
                      cookie_name: str,
                      path: str,
                      domain: Optional[str],
-                     database: str,
+                     backend: SessionBackend,
+                     serializer: SessionSerializer,
                      timeout: int,
                      samesite: str,
                      httponly: bool,
                      secure: bool,
                      query_param: Optional[str],
-                     accept_client_session_id: bool
+                     accept_client_session_id: bool,
+                     cache_size: int,
+                     cache_ttl: float,
+                     refresh_threshold: float,
+                     refresh_delay: float,
+                     cookie_store: bool,
+                     cookie_max_size: int,
+                     revocations: Optional[RevocationList],
+                     userid_key: str
                      ):
+    cache = None
+    if cache_size:
+        cache = LRUCache(cache_size, ttl=cache_ttl or None)
+    if refresh_delay:
+        refresher = ExpiryRefresher(backend, refresh_delay)
+    else:
+        refresher = None
+
     def new_expiry_time():
         return int(time.time()) + timeout
 
@@ -196,11 +563,25 @@ def _session_factory(*,
 
     @implementer(ISession)
     class MySession(dict):
+        #: Backend storing session records
+        backend: SessionBackend = None
+
+        #: Session record cache, ``None`` if caching is disabled
+        cache: Optional[LRUCache] = None
+
+        #: Write-behind queue of expiry refreshes, ``None`` if disabled
+        refresher: Optional[ExpiryRefresher] = None
+
+        #: Invalidated cookie stored sessions, ``None`` unless
+        #: ``cookie_store`` is enabled
+        revocations: Optional[RevocationList] = None
 
         def __init__(self, request):
             super().__init__()
 
             self._session_id = None
+            # Cookie contents if the session is stored in the cookie
+            self._payload: Optional[dict] = None
 
             # DO NOT put session ids in the URL or body.
             #
@@ -210,10 +591,16 @@ def _session_factory(*,
                 cookie_val: str = request.cookies.get(cookie_name)
                 if cookie_val:
                     try:
-                        self._session_id = cookie_serializer.loads(cookie_val)
+                        value = cookie_serializer.loads(cookie_val)
                     except ValueError:
                         # Signature check failed
                         pass
+                    else:
+                        if not isinstance(value, dict):
+                            self._session_id = value
+                        elif cookie_store:
+                            self._session_id = value.get('id')
+                            self._payload = value
 
             self._dirty = False
             self._created = None
@@ -225,6 +612,15 @@ def _session_factory(*,
 
             request.add_response_callback(self._save)
 
+        @property
+        def session_id(self) -> Optional[str]:
+            """The session id from the cookie, or ``None`` for a new session.
+
+            Does not load the session, so the session may turn out to be
+            expired.
+            """
+            return self._session_id
+
         @property
         def created(self) -> int:
             """Integer representing Epoch time when the session was created."""
@@ -252,8 +648,7 @@ def _session_factory(*,
             attacks.
             """
             if self._session_id:
-                with db.cursor(database) as cur:
-                    self._delete_session(cur)
+                self._delete_session()
 
             super().clear()
             self._accessed = False
@@ -286,74 +681,200 @@ def _session_factory(*,
             if self._dirty:
                 if self._new:
                     self._store_new_session(request, response)
+                elif self._payload is not None:
+                    if not self._store_in_cookie(request, response):
+                        # Grown too large for the cookie
+                        self._store_in_backend(request, response)
                 else:
-                    self._store_modified_session()
+                    self._store_modified_session(request, response)
             elif self._reset_cookie:
                 set_session_cookie(request, response, '', 0)
             elif self._accessed:
-                self._update_expiry_time()
+                if self._payload is not None:
+                    self._refresh_cookie(request, response)
+                else:
+                    self._refresh_expiry_time(request, response)
 
         def _store_new_session(self, request, response):
             """Persist session data and set session cookie"""
             if not self._session_id:
                 self._session_id = new_session_id()
+            if not (cookie_store and self._store_in_cookie(request, response)):
+                self._store_in_backend(request, response)
+
+        def _store_in_cookie(self, request, response) -> bool:
+            """Store session data in the session cookie if it fits"""
             expires_at = new_expiry_time()
-            userdata = json.dumps(self)
-            with db.cursor(database) as cur:
-                cur.execute('INSERT INTO session_store'
-                            '(session_id, expires_at, created_at, userdata)'
-                            'VALUES (?, ?, ?, ?)',
-                            (self._session_id, expires_at, self._created,
-                             userdata))
+            payload = {
+                'id': self._session_id,
+                'c': self._created,
+                'e': expires_at,
+                'd': dict.copy(self),
+            }
+            try:
+                cookie_val = cookie_serializer.dumps(payload)
+            except (TypeError, ValueError):
+                return False
+            if len(cookie_val) > cookie_max_size:
+                return False
+
+            self._payload = payload
+            self._expires = expires_at
+            set_session_cookie(request, response, cookie_val)
+            return True
+
+        def _store_in_backend(self, request, response):
+            """Persist session data in the backend and set session cookie"""
+            if self._payload is not None:
+                # Moved from the cookie, the old cookie must not be reused
+                revocations.revoke(self._session_id, self._payload['e'])
+                self._payload = None
+            expires_at = new_expiry_time()
+            userdata = serializer.dumps(dict.copy(self))
+            record = SessionRecord(expires_at, self._created, userdata,
+                                   self._user_id())
+            backend.insert(self._session_id, record)
+
+            if cache is not None:
+                cache.put(self._session_id, record)
 
             cookie_val = cookie_serializer.dumps(self._session_id)
             set_session_cookie(request, response, cookie_val)
 
-        def _store_modified_session(self):
+        def _store_modified_session(self, request, response):
             """Persist modified session data and update expiry time"""
             expires_at = new_expiry_time()
-            userdata = json.dumps(self)
-            with db.cursor(database) as cur:
-                cur.execute(
-                    'UPDATE session_store SET expires_at = ?, userdata = ?'
-                    'WHERE session_id = ?',
-                    (expires_at, userdata, self._session_id))
-
-        def _update_expiry_time(self):
+            userdata = serializer.dumps(dict.copy(self))
+            user_id = self._user_id()
+            if not backend.update(self._session_id, expires_at, userdata,
+                                  user_id):
+                self._drop_deleted_session(request, response)
+                return
+
+            if cache is not None:
+                cache.put(self._session_id,
+                          SessionRecord(expires_at, self._created, userdata,
+                                        user_id))
+
+        def _user_id(self) -> Optional[int]:
+            """The authenticated user id for the ``user_id`` column"""
+            user_id = dict.get(self, userid_key)
+            return user_id if isinstance(user_id, int) else None
+
+        def _refresh_expiry_time(self, request, response):
+            """Push the expiry time forward unless it was done recently"""
+            if not self._session_id:
+                return
+
+            now = time.time()
+            if self._expires is not None:
+                remaining = self._expires - now
+                if timeout - remaining < refresh_threshold * timeout:
+                    return
+                if refresher is not None and remaining > refresh_delay:
+                    expires_at = new_expiry_time()
+                    refresher.queue(self._session_id, expires_at)
+                    self._update_cached_expiry_time(expires_at)
+                    return
+
+            self._update_expiry_time(request, response)
+
+        def _refresh_cookie(self, request, response):
+            """Reissue the session cookie with a new expiry time unless it
+            was done recently"""
+            remaining = self._expires - time.time()
+            if timeout - remaining < refresh_threshold * timeout:
+                return
+            if not self._store_in_cookie(request, response):
+                self._store_in_backend(request, response)
+
+        def _update_expiry_time(self, request, response):
             """Update expiry time for session"""
             expires_at = new_expiry_time()
-            with db.cursor(database) as cur:
-                cur.execute(
-                    'UPDATE session_store SET expires_at = ? '
-                    'WHERE session_id = ?',
-                    (expires_at, self._session_id))
+            if backend.touch(self._session_id, expires_at):
+                self._update_cached_expiry_time(expires_at)
+            else:
+                self._drop_deleted_session(request, response)
+
+        def _update_cached_expiry_time(self, expires_at):
+            # Keeps the time the record was cached, so that it is reloaded
+            # from the backend after cache_ttl seconds
+            if cache is not None:
+                record = cache.get(self._session_id)
+                if record:
+                    cache.replace(self._session_id,
+                                  record._replace(expires_at=expires_at))
+
+        def _drop_deleted_session(self, request, response):
+            """Forget a session that was deleted from the backend behind the
+            cache's back, e.g. by another process"""
+            self.invalidate()
+            set_session_cookie(request, response, '', 0)
 
         def _load(self):
-            """Load session state from sqlite database if not yet loaded"""
+            """Load session state from the backend if not yet loaded"""
             if not self._loaded:
                 self._loaded = True
-                with db.cursor(database) as cur:
-                    cur.execute(
-                        'SELECT expires_at, created_at, userdata'
-                        ' FROM session_store WHERE session_id = ?',
-                        (self._session_id,))
-                    row = cur.fetchone()
-                    if row and time.time() < row[0]:
-                        # Existing non-expired session
-                        self._created = int(row[1])
+                record = self._fetch()
+                if record and time.time() < record.expires_at:
+                    # Existing non-expired session
+                    self._created = int(record.created_at)
+                    self._expires = int(record.expires_at)
+                    self._reset_cookie = False
+                    if self._payload is not None:
+                        userdata = self._payload['d']
+                    else:
+                        userdata = serializer.loads(record.userdata)
+                    self._update(userdata)
+                else:
+                    # Non-existing or expired session
+                    if accept_client_session_id:
+                        # Using client session id --> session fixation
+                        self._created = int(time.time())
+                        self._new = record is None
                         self._reset_cookie = False
-                        userdata = json.loads(row[2])
-                        self._update(userdata)
                     else:
-                        # Non-existing or expired session
-                        if accept_client_session_id:
-                            # Using client session id --> session fixation
-                            self._created = int(time.time())
-                            self._new = row is None
-                            self._reset_cookie = False
-                        else:
-                            self._delete_session(cur)
-                            self.invalidate()
+                        self._delete_session()
+                        self.invalidate()
+
+        def _fetch(self) -> Optional[SessionRecord]:
+            """Get the session record from the cookie, the cache or the
+            backend"""
+            if self._payload is not None:
+                if self._session_id in revocations:
+                    return None
+                try:
+                    return SessionRecord(int(self._payload['e']),
+                                         int(self._payload['c']), '')
+                except (KeyError, TypeError, ValueError):
+                    return None
+
+            if cache is not None:
+                record = cache.get(self._session_id)
+                if record and time.time() < record.expires_at:
+                    return record
+
+            record = backend.load(self._session_id)
+            if not record:
+                return None
+
+            if cache is not None and time.time() < record.expires_at:
+                cache.put(self._session_id, record)
+            return record
+
+        @classmethod
+        def remove_user_sessions(cls, user_id: int) -> int:
+            """Delete all sessions of a user from the backend and the cache,
+            logging the user out everywhere.
+
+            Returns the number of sessions deleted from the backend.
+            Sessions stored in cookies are not affected.
+            """
+            count = backend.delete_user(user_id)
+            if cache is not None:
+                cache.pop_matching(
+                    lambda session_id, record: record.user_id == user_id)
+            return count
 
         def _update(self, values):
             # Avoid triggering changed() which is called as a side-effect
@@ -362,11 +883,20 @@ def _session_factory(*,
             for k, v in values.items():
                 _dict_setitem(self, k, v)
 
-        def _delete_session(self, cur):
-            """Delete session state using the given database cursor"""
-            if self._session_id:
-                cur.execute('DELETE FROM session_store WHERE session_id = ?',
-                            (self._session_id,))
+        def _delete_session(self):
+            """Delete persisted session state"""
+            if self._payload is not None:
+                expires_at = self._payload.get('e')
+                if (isinstance(expires_at, int) and expires_at > time.time()
+                        and self._session_id not in revocations):
+                    revocations.revoke(self._session_id, expires_at)
+                self._payload = None
+                self._session_id = None
+                self._reset_cookie = True
+            elif self._session_id:
+                if cache is not None:
+                    cache.pop(self._session_id)
+                backend.delete(self._session_id)
                 self._session_id = None
                 self._reset_cookie = True
 
@@ -387,6 +917,10 @@ def _session_factory(*,
         __setitem__ = manage_changed(dict.__setitem__)
         __delitem__ = manage_changed(dict.__delitem__)
 
+    MySession.backend = backend
+    MySession.cache = cache
+    MySession.refresher = refresher
+    MySession.revocations = revocations
     return MySession
 
 
@@ -414,14 +948,49 @@ def manage_changed(wrapped):
     return changed
 
 
+def session_backend_from_settings(settings) -> SessionBackend:
+    """Create the session backend selected by ``session.backend``.
+
+    ``sqlite``
+      A single SQLite database given by ``db.sessions`` (default).
+
+    ``sharded``
+      ``session.shards`` SQLite databases (default 4) named after
+      ``db.sessions``.
+
+    ``memory``
+      Sessions in memory with a snapshot in ``db.sessions`` every
+      ``session.snapshot_interval`` seconds (default 60).
+    """
+    database = os.path.normpath(settings.get('db.sessions', 'sessions.db'))
+    name = settings.get('session.backend', 'sqlite')
+    if name == 'sqlite':
+        return SQLiteSessionBackend(database)
+    elif name == 'sharded':
+        shards = int(settings.get('session.shards', 4))
+        return ShardedSQLiteSessionBackend(database, shards)
+    elif name == 'memory':
+        interval = float(settings.get('session.snapshot_interval', 60))
+        return MemorySessionBackend(database, snapshot_interval=interval)
+    else:
+        raise ValueError(f'Unknown session backend: {name}')
+
+
 def includeme(config: Configurator):
     from pyramid.csrf import SessionCSRFStoragePolicy
+    from .csrf import HMACCSRFStoragePolicy
 
-    session_dbname = os.path.normpath(
-        config.registry.settings.get('db.sessions', 'sessions.db'))
+    settings = config.registry.settings
     session_secret = os.environ.get('UNSAFE_SESSION_SECRET', 'secret')
+    backend = session_backend_from_settings(settings)
+    revocations = None
+    if asbool(settings.get('session.cookie_store', False)):
+        revocations = RevocationList(
+            os.path.normpath(settings.get('db.sessions', 'sessions.db')),
+            refresh_interval=float(
+                settings.get('session.revocation_interval', 10)))
     session_factory = MySessionFactory(
-        database=session_dbname,
+        backend=backend,
         secret=session_secret,
         # secret=None, # No cookie signing!
         httponly=True,
@@ -429,6 +998,33 @@ def includeme(config: Configurator):
         samesite=None,
         # secure=True,
         # query_param='session',
-        accept_client_session_id=False)
+        accept_client_session_id=False,
+        serializer=settings.get('session.serializer', 'json'),
+        compress_threshold=int(settings.get('session.compress_threshold', 0)),
+        cache_size=int(settings.get('session.cache_size', 0)),
+        cache_ttl=float(settings.get('session.cache_ttl', 10)),
+        refresh_threshold=float(settings.get('session.refresh_threshold', 0)),
+        refresh_delay=float(settings.get('session.refresh_delay', 0)),
+        cookie_store=asbool(settings.get('session.cookie_store', False)),
+        cookie_max_size=int(settings.get('session.cookie_max_size', 4000)),
+        revocations=revocations)
     config.set_session_factory(session_factory)
-    config.set_csrf_storage_policy(SessionCSRFStoragePolicy())
+    csrf_policy = settings.get('csrf.policy', 'hmac')
+    if csrf_policy == 'hmac':
+        config.set_csrf_storage_policy(HMACCSRFStoragePolicy(
+            os.environ.get('UNSAFE_CSRF_SECRET', session_secret + '.csrf'),
+            window=int(settings.get('csrf.window', 3600))))
+    elif csrf_policy == 'session':
+        config.set_csrf_storage_policy(SessionCSRFStoragePolicy())
+    else:
+        raise ValueError(f'Unknown CSRF policy: {csrf_policy}')
+
+    sweep_interval = float(settings.get('session.sweep_interval', 300))
+    if sweep_interval > 0:
+        sweeper = SessionSweeper(
+            backend,
+            interval=sweep_interval,
+            batch_size=int(settings.get('session.sweep_batch_size', 500)),
+            pause=float(settings.get('session.sweep_pause', 0.1)))
+        sweeper.start()
+        config.registry.session_sweeper = sweeper
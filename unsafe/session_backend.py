@@ -0,0 +1,564 @@
+"""
+Session storage backends.
+
+A backend stores :class:`SessionRecord` objects keyed by session id and is
+used by the session factory in :mod:`unsafe.session`. The session object
+itself only deals with cookies, expiry and serialization.
+
+Available backends:
+
+- :class:`SQLiteSessionBackend` stores sessions in a single SQLite database
+  (the default)
+- :class:`ShardedSQLiteSessionBackend` spreads sessions over several SQLite
+  databases to reduce contention on the database write lock
+- :class:`MemorySessionBackend` keeps sessions in memory and periodically
+  saves a snapshot to SQLite, for deployments with a single process
+
+Expired sessions are deleted in the background by a :class:`SessionSweeper`.
+"""
+import abc
+import atexit
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from typing import (
+    Dict,
+    Iterator,
+    List,
+    Mapping,
+    NamedTuple,
+    Optional,
+    Union,
+)
+
+from .db import ConnectionPool
+from .tasks import PeriodicTask
+
+__all__ = [
+    'MemorySessionBackend',
+    'SessionBackend',
+    'SessionRecord',
+    'SessionSweeper',
+    'ShardedSQLiteSessionBackend',
+    'SQLiteSessionBackend',
+    'shard_databases',
+]
+
+
+class SessionRecord(NamedTuple):
+    """Persisted session state.
+
+    ``userdata`` is serialized by :mod:`unsafe.session_serializer`.
+    ``user_id`` is the authenticated user, if any, kept outside of
+    ``userdata`` so sessions can be found by user.
+    """
+    expires_at: int
+    created_at: int
+    userdata: Union[str, bytes]
+    user_id: Optional[int] = None
+
+
+class SessionBackend(abc.ABC):
+    """Interface of session storage backends.
+
+    Backends must be safe to use from several threads at once.
+    """
+
+    @abc.abstractmethod
+    def load(self, session_id: str) -> Optional[SessionRecord]:
+        """Get a session record, expired or not, or ``None`` if there is no
+        such session."""
+
+    @abc.abstractmethod
+    def insert(self, session_id: str, record: SessionRecord):
+        """Store a new session."""
+
+    @abc.abstractmethod
+    def update(self, session_id: str, expires_at: int,
+               userdata: Union[str, bytes],
+               user_id: Optional[int] = None) -> bool:
+        """Replace the data, user and expiry time of a session.
+
+        Returns ``False`` if there is no such session, e.g. because it was
+        deleted by another process.
+        """
+
+    @abc.abstractmethod
+    def touch(self, session_id: str, expires_at: int) -> bool:
+        """Update the expiry time of a session.
+
+        Returns ``False`` if there is no such session.
+        """
+
+    def touch_many(self, expiry_times: Mapping[str, int]) -> int:
+        """Update the expiry time of several sessions.
+
+        Expiry times are never moved backwards. Returns the number of
+        sessions updated.
+        """
+        count = 0
+        for session_id, expires_at in expiry_times.items():
+            record = self.load(session_id)
+            if record and record.expires_at < expires_at:
+                self.touch(session_id, expires_at)
+                count += 1
+        return count
+
+    @abc.abstractmethod
+    def delete(self, session_id: str):
+        """Delete a session."""
+
+    @abc.abstractmethod
+    def delete_user(self, user_id: int) -> int:
+        """Delete all sessions of a user, returning the number deleted."""
+
+    @abc.abstractmethod
+    def user_counts(self) -> Dict[int, int]:
+        """Number of unexpired sessions per authenticated user."""
+
+    @abc.abstractmethod
+    def expire(self, expiry_time: Optional[int] = None,
+               limit: Optional[int] = None) -> int:
+        """Delete sessions that expired before ``expiry_time`` (default now).
+
+        :param limit: delete at most this many sessions
+        :returns: the number of deleted sessions
+        """
+
+    def vacuum(self, pages: Optional[int] = None):
+        """Return free storage to the operating system, if applicable.
+
+        :param pages: maximum number of database pages to free
+        """
+
+    def close(self):
+        """Release resources held by the backend."""
+
+
+def _create_schema(cur: sqlite3.Cursor):
+    # Only has an effect on new databases, existing databases must be
+    # converted with VACUUM (see unsafe-sessions).
+    cur.execute('PRAGMA auto_vacuum = INCREMENTAL')
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS session_store (
+            session_id TEXT PRIMARY KEY,
+            expires_at INTEGER NOT NULL,
+            created_at INTEGER NOT NULL,
+            userdata TEXT NOT NULL,
+            user_id INTEGER
+            );
+        ''')
+    cur.execute('CREATE INDEX IF NOT EXISTS session_store_expires_at'
+                ' ON session_store(expires_at)')
+
+    # Added after the table, so may be missing in existing databases
+    cur.execute('PRAGMA table_info(session_store)')
+    if 'user_id' not in {row[1] for row in cur.fetchall()}:
+        cur.execute('ALTER TABLE session_store ADD COLUMN user_id INTEGER')
+    cur.execute('CREATE INDEX IF NOT EXISTS session_store_user_id'
+                ' ON session_store(user_id)')
+
+
+class SQLiteSessionBackend(SessionBackend):
+    """Store sessions in the ``session_store`` table of a SQLite database.
+
+    The table is created if it does not exist. Connections are taken from a
+    :class:`unsafe.db.ConnectionPool`.
+
+    :param database: database file name
+    :param pool_size: maximum number of open connections
+    """
+
+    def __init__(self, database: str, *, pool_size=5):
+        self.database = database
+        self._pool = ConnectionPool(database, size=pool_size)
+        with self._cursor() as cur:
+            _create_schema(cur)
+
+    @contextmanager
+    def _cursor(self) -> Iterator[sqlite3.Cursor]:
+        conn = self._pool.acquire()
+        try:
+            cur = conn.cursor()
+            try:
+                yield cur
+                conn.commit()
+            finally:
+                cur.close()
+        finally:
+            self._pool.release(conn)
+
+    def load(self, session_id):
+        with self._cursor() as cur:
+            cur.execute('SELECT expires_at, created_at, userdata, user_id'
+                        ' FROM session_store WHERE session_id = ?',
+                        (session_id,))
+            row = cur.fetchone()
+        return SessionRecord(*row) if row else None
+
+    def insert(self, session_id, record):
+        with self._cursor() as cur:
+            cur.execute('INSERT INTO session_store'
+                        '(session_id, expires_at, created_at, userdata,'
+                        ' user_id) VALUES (?, ?, ?, ?, ?)',
+                        (session_id, record.expires_at, record.created_at,
+                         record.userdata, record.user_id))
+
+    def update(self, session_id, expires_at, userdata, user_id=None):
+        with self._cursor() as cur:
+            cur.execute('UPDATE session_store SET expires_at = ?, userdata = ?,'
+                        ' user_id = ? WHERE session_id = ?',
+                        (expires_at, userdata, user_id, session_id))
+            return cur.rowcount > 0
+
+    def touch(self, session_id, expires_at):
+        with self._cursor() as cur:
+            cur.execute('UPDATE session_store SET expires_at = ? '
+                        'WHERE session_id = ?',
+                        (expires_at, session_id))
+            return cur.rowcount > 0
+
+    def touch_many(self, expiry_times):
+        with self._cursor() as cur:
+            cur.executemany('UPDATE session_store SET expires_at = ?'
+                            ' WHERE session_id = ? AND expires_at < ?',
+                            [(expires_at, session_id, expires_at)
+                             for session_id, expires_at
+                             in expiry_times.items()])
+            return cur.rowcount
+
+    def delete(self, session_id):
+        with self._cursor() as cur:
+            cur.execute('DELETE FROM session_store WHERE session_id = ?',
+                        (session_id,))
+
+    def delete_user(self, user_id):
+        with self._cursor() as cur:
+            cur.execute('DELETE FROM session_store WHERE user_id = ?',
+                        (user_id,))
+            return cur.rowcount
+
+    def user_counts(self):
+        with self._cursor() as cur:
+            cur.execute('SELECT user_id, COUNT(*) FROM session_store'
+                        ' WHERE user_id IS NOT NULL AND expires_at >= ?'
+                        ' GROUP BY user_id', (int(time.time()),))
+            return dict(cur.fetchall())
+
+    def expire(self, expiry_time=None, limit=None):
+        if expiry_time is None:
+            expiry_time = int(time.time())
+        with self._cursor() as cur:
+            if limit:
+                cur.execute('DELETE FROM session_store WHERE rowid IN ('
+                            ' SELECT rowid FROM session_store'
+                            ' WHERE expires_at < ? LIMIT ?)',
+                            (expiry_time, limit))
+            else:
+                cur.execute('DELETE FROM session_store WHERE expires_at < ?',
+                            (expiry_time,))
+            return cur.rowcount
+
+    def vacuum(self, pages=None):
+        with self._cursor() as cur:
+            if pages:
+                cur.execute(f'PRAGMA incremental_vacuum({int(pages)})')
+            else:
+                cur.execute('PRAGMA incremental_vacuum')
+            cur.fetchall()
+
+    def close(self):
+        self._pool.close()
+
+
+def shard_databases(database: str, shards: int) -> List[str]:
+    """Database file names used by a sharded backend.
+
+    ``sessions.db`` with 2 shards gives ``sessions-0.db`` and
+    ``sessions-1.db``.
+    """
+    base, ext = os.path.splitext(database)
+    return [f'{base}-{shard}{ext}' for shard in range(shards)]
+
+
+class ShardedSQLiteSessionBackend(SessionBackend):
+    """Spread sessions over several SQLite databases.
+
+    Each database has its own write lock, so writes of sessions in different
+    shards do not wait for each other. A session is stored in the shard
+    given by the CRC32 of its session id, which is stable across processes.
+
+    :param database: base database file name, see :func:`shard_databases`
+    :param shards: number of shards
+    """
+
+    def __init__(self, database: str, shards: int, *, pool_size=5):
+        if shards < 1:
+            raise ValueError('Number of shards must be at least 1')
+        self.databases = shard_databases(database, shards)
+        self.shards = [SQLiteSessionBackend(name, pool_size=pool_size)
+                       for name in self.databases]
+
+    def _shard(self, session_id: str) -> SQLiteSessionBackend:
+        index = zlib.crc32(session_id.encode('utf-8')) % len(self.shards)
+        return self.shards[index]
+
+    def load(self, session_id):
+        return self._shard(session_id).load(session_id)
+
+    def insert(self, session_id, record):
+        self._shard(session_id).insert(session_id, record)
+
+    def update(self, session_id, expires_at, userdata, user_id=None):
+        return self._shard(session_id).update(session_id, expires_at,
+                                              userdata, user_id)
+
+    def touch(self, session_id, expires_at):
+        return self._shard(session_id).touch(session_id, expires_at)
+
+    def touch_many(self, expiry_times):
+        by_shard: Dict[int, Dict[str, int]] = {}
+        for session_id, expires_at in expiry_times.items():
+            shard = self._shard(session_id)
+            by_shard.setdefault(id(shard), {})[session_id] = expires_at
+        return sum(shard.touch_many(by_shard[id(shard)])
+                   for shard in self.shards if id(shard) in by_shard)
+
+    def delete(self, session_id):
+        self._shard(session_id).delete(session_id)
+
+    def delete_user(self, user_id):
+        return sum(shard.delete_user(user_id) for shard in self.shards)
+
+    def user_counts(self):
+        counts: Dict[int, int] = {}
+        for shard in self.shards:
+            for user_id, count in shard.user_counts().items():
+                counts[user_id] = counts.get(user_id, 0) + count
+        return counts
+
+    def expire(self, expiry_time=None, limit=None):
+        count = 0
+        for shard in self.shards:
+            if limit:
+                if count >= limit:
+                    break
+                count += shard.expire(expiry_time, limit - count)
+            else:
+                count += shard.expire(expiry_time)
+        return count
+
+    def vacuum(self, pages=None):
+        for shard in self.shards:
+            shard.vacuum(pages)
+
+    def close(self):
+        for shard in self.shards:
+            shard.close()
+
+
+class MemorySessionBackend(SessionBackend):
+    """Keep sessions in memory.
+
+    Only suitable when a single process serves all requests. Expired
+    sessions are dropped every ``snapshot_interval`` seconds.
+
+    If a ``snapshot_database`` is given, sessions are loaded from it at
+    startup and all sessions are written to it every ``snapshot_interval``
+    seconds and at interpreter exit, so sessions survive restarts. Sessions
+    changed after the last snapshot are lost if the process dies.
+
+    :param snapshot_database: SQLite database for snapshots
+    :param snapshot_interval: seconds between snapshots
+    """
+
+    def __init__(self, snapshot_database: Optional[str] = None, *,
+                 snapshot_interval: float = 60):
+        self.snapshot_database = snapshot_database
+        self._records: Dict[str, SessionRecord] = {}
+        self._lock = threading.Lock()
+
+        if snapshot_database:
+            self._restore()
+        self._task: Optional[PeriodicTask] = PeriodicTask(
+            self._maintain, snapshot_interval, name='session-snapshot')
+        self._task.start()
+        atexit.register(self.close)
+
+    def _maintain(self):
+        self.expire()
+        if self.snapshot_database:
+            self.snapshot()
+
+    def _restore(self):
+        backend = SQLiteSessionBackend(self.snapshot_database, pool_size=1)
+        try:
+            with backend._cursor() as cur:
+                cur.execute('SELECT session_id, expires_at, created_at,'
+                            ' userdata, user_id FROM session_store'
+                            ' WHERE expires_at >= ?', (int(time.time()),))
+                rows = cur.fetchall()
+        finally:
+            backend.close()
+        with self._lock:
+            for row in rows:
+                self._records[row[0]] = SessionRecord(*row[1:])
+        logging.getLogger(__name__).info('Restored %d sessions from %s',
+                                         len(rows), self.snapshot_database)
+
+    def snapshot(self) -> int:
+        """Replace the snapshot database contents with all sessions.
+
+        Returns the number of sessions written.
+        """
+        with self._lock:
+            records = list(self._records.items())
+        backend = SQLiteSessionBackend(self.snapshot_database, pool_size=1)
+        try:
+            with backend._cursor() as cur:
+                cur.execute('DELETE FROM session_store')
+                cur.executemany('INSERT INTO session_store'
+                                '(session_id, expires_at, created_at,'
+                                ' userdata, user_id) VALUES (?, ?, ?, ?, ?)',
+                                [(session_id,) + tuple(record)
+                                 for session_id, record in records])
+        finally:
+            backend.close()
+        return len(records)
+
+    def load(self, session_id):
+        with self._lock:
+            return self._records.get(session_id)
+
+    def insert(self, session_id, record):
+        with self._lock:
+            self._records[session_id] = SessionRecord(*record)
+
+    def update(self, session_id, expires_at, userdata, user_id=None):
+        with self._lock:
+            record = self._records.get(session_id)
+            if record:
+                self._records[session_id] = record._replace(
+                    expires_at=expires_at, userdata=userdata,
+                    user_id=user_id)
+            return record is not None
+
+    def touch(self, session_id, expires_at):
+        with self._lock:
+            record = self._records.get(session_id)
+            if record:
+                self._records[session_id] = record._replace(
+                    expires_at=expires_at)
+            return record is not None
+
+    def touch_many(self, expiry_times):
+        count = 0
+        with self._lock:
+            for session_id, expires_at in expiry_times.items():
+                record = self._records.get(session_id)
+                if record and record.expires_at < expires_at:
+                    self._records[session_id] = record._replace(
+                        expires_at=expires_at)
+                    count += 1
+        return count
+
+    def delete(self, session_id):
+        with self._lock:
+            self._records.pop(session_id, None)
+
+    def delete_user(self, user_id):
+        with self._lock:
+            session_ids = [session_id
+                           for session_id, record in self._records.items()
+                           if record.user_id == user_id]
+            for session_id in session_ids:
+                del self._records[session_id]
+        return len(session_ids)
+
+    def user_counts(self):
+        now = int(time.time())
+        counts: Dict[int, int] = {}
+        with self._lock:
+            for record in self._records.values():
+                if record.user_id is not None and record.expires_at >= now:
+                    counts[record.user_id] = counts.get(record.user_id, 0) + 1
+        return counts
+
+    def expire(self, expiry_time=None, limit=None):
+        if expiry_time is None:
+            expiry_time = int(time.time())
+        with self._lock:
+            expired = [session_id
+                       for session_id, record in self._records.items()
+                       if record.expires_at < expiry_time]
+            if limit:
+                expired = expired[:limit]
+            for session_id in expired:
+                del self._records[session_id]
+        return len(expired)
+
+    def close(self):
+        if self._task:
+            self._task.stop()
+            self._task = None
+            if self.snapshot_database:
+                self.snapshot()
+
+
+class SessionSweeper:
+    """Delete expired sessions in the background.
+
+    Every ``interval`` seconds expired sessions are deleted in batches of
+    ``batch_size`` with a pause of ``pause`` seconds between batches, so
+    that requests get a chance to write to the database in between. After
+    sweeping, up to ``vacuum_pages`` free pages are returned to the
+    operating system.
+
+    :param backend: session backend
+    :param interval: seconds between sweeps
+    :param batch_size: maximum number of sessions deleted per transaction
+    :param pause: seconds to pause between batches
+    :param vacuum_pages: maximum number of pages to free per sweep, ``0``
+        to free all, ``None`` to skip vacuuming
+    """
+
+    def __init__(self, backend: SessionBackend, *, interval: float = 300,
+                 batch_size: int = 500, pause: float = 0.1,
+                 vacuum_pages: Optional[int] = 0):
+        self.backend = backend
+        self.batch_size = batch_size
+        self.pause = pause
+        self.vacuum_pages = vacuum_pages
+        self._stopping = False
+        self._task = PeriodicTask(self.sweep, interval, name='session-sweeper')
+
+    def start(self):
+        self._task.start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        self._stopping = True
+        self._task.stop()
+
+    def sweep(self) -> int:
+        """Delete expired sessions, returning the number deleted."""
+        expiry_time = int(time.time())
+        total = 0
+        while not self._stopping:
+            count = self.backend.expire(expiry_time, self.batch_size)
+            total += count
+            if count < self.batch_size:
+                break
+            time.sleep(self.pause)
+
+        if self.vacuum_pages is not None and not self._stopping:
+            self.backend.vacuum(self.vacuum_pages or None)
+
+        if total:
+            logging.getLogger(__name__).info('Swept %d expired sessions',
+                                             total)
+        return total
@@ -0,0 +1,100 @@
+"""
+Serialization of session data stored by the session backends.
+
+Session data is stored either as text, which is plain JSON and the format
+used by earlier versions, or as bytes starting with a format byte:
+
+- bits 0-6 identify the encoding, see :data:`FORMAT_JSON` and
+  :data:`FORMAT_MARSHAL`
+- bit 7 (:data:`COMPRESSED`) is set if the rest is compressed with zlib
+
+Any supported format can be loaded regardless of the configured format, so
+the format can be changed without invalidating existing sessions.
+"""
+import json
+import marshal
+import zlib
+from typing import Union
+
+__all__ = [
+    'COMPRESSED',
+    'FORMAT_JSON',
+    'FORMAT_MARSHAL',
+    'SessionSerializer',
+]
+
+#: UTF-8 encoded JSON without whitespace
+FORMAT_JSON = 0x01
+
+#: :mod:`marshal` version 4, a compact binary format for builtin types
+FORMAT_MARSHAL = 0x02
+
+#: Flag set in the format byte if the payload is zlib compressed
+COMPRESSED = 0x80
+
+_MARSHAL_VERSION = 4
+
+_formats = {
+    'json': FORMAT_JSON,
+    'marshal': FORMAT_MARSHAL,
+}
+
+
+class SessionSerializer:
+    """Serialize session data.
+
+    ``format``
+      ``'json'`` stores plain JSON text, readable by any version of the
+      application. ``'marshal'`` stores a compact binary encoding which is
+      faster to encode and decode, but only supports builtin types and is
+      specific to Python. Default: ``'json'``.
+
+    ``compress_threshold``
+      Compress payloads larger than this many bytes with zlib. Compressed
+      JSON is stored as bytes. Default: ``0`` (no compression).
+
+    ``compress_level``
+      zlib compression level. Default: ``1`` (fastest).
+    """
+
+    def __init__(self, format='json', *, compress_threshold=0,
+                 compress_level=1):
+        try:
+            self.format = _formats[format]
+        except KeyError:
+            raise ValueError(f'Unknown session serializer format: {format}')
+        self.compress_threshold = compress_threshold
+        self.compress_level = compress_level
+
+    def dumps(self, data: dict) -> Union[str, bytes]:
+        if self.format == FORMAT_MARSHAL:
+            payload = marshal.dumps(data, _MARSHAL_VERSION)
+        else:
+            text = json.dumps(data, separators=(',', ':'))
+            if not self.compress_threshold or \
+                    len(text) <= self.compress_threshold:
+                return text
+            payload = text.encode('utf-8')
+
+        if self.compress_threshold and len(payload) > self.compress_threshold:
+            compressed = zlib.compress(payload, self.compress_level)
+            if len(compressed) < len(payload):
+                return bytes((self.format | COMPRESSED,)) + compressed
+
+        return bytes((self.format,)) + payload
+
+    def loads(self, value: Union[str, bytes]) -> dict:
+        if isinstance(value, str):
+            return json.loads(value)
+
+        header = value[0]
+        payload = value[1:]
+        if header & COMPRESSED:
+            payload = zlib.decompress(payload)
+        fmt = header & ~COMPRESSED
+        if fmt == FORMAT_JSON:
+            return json.loads(payload.decode('utf-8'))
+        elif fmt == FORMAT_MARSHAL:
+            return marshal.loads(payload)
+        else:
+            raise ValueError(f'Unknown session data format: {header:#x}')
@@ -0,0 +1,10 @@
+-- Indexes for lookups on the request hot path:
+-- - login and user creation look up users by username
+-- - the notes listing filters on user and orders by update time
+-- - the posts listing loads top-level posts and replies ordered by update time
+
+CREATE INDEX IF NOT EXISTS user_username ON user(username);
+
+CREATE INDEX IF NOT EXISTS note_user_id_updated_at ON note(user_id, updated_at);
+
+CREATE INDEX IF NOT EXISTS post_reply_to_updated_at ON post(reply_to, updated_at);
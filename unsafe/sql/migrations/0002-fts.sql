@@ -0,0 +1,54 @@
+-- Full-text search of notes and posts.
+--
+-- The FTS5 tables are external content tables indexing the content column
+-- of note and post, so the text is not stored twice. Triggers keep the
+-- indexes in sync, and the rebuild commands index existing rows.
+
+CREATE VIRTUAL TABLE IF NOT EXISTS note_fts USING fts5(
+  content,
+  content='note',
+  content_rowid='note_id',
+  tokenize='unicode61 remove_diacritics 2'
+);
+
+CREATE TRIGGER IF NOT EXISTS note_fts_insert AFTER INSERT ON note BEGIN
+  INSERT INTO note_fts(rowid, content) VALUES (new.note_id, new.content);
+END;
+
+CREATE TRIGGER IF NOT EXISTS note_fts_delete AFTER DELETE ON note BEGIN
+  INSERT INTO note_fts(note_fts, rowid, content)
+  VALUES ('delete', old.note_id, old.content);
+END;
+
+CREATE TRIGGER IF NOT EXISTS note_fts_update AFTER UPDATE OF content ON note BEGIN
+  INSERT INTO note_fts(note_fts, rowid, content)
+  VALUES ('delete', old.note_id, old.content);
+  INSERT INTO note_fts(rowid, content) VALUES (new.note_id, new.content);
+END;
+
+INSERT INTO note_fts(note_fts) VALUES ('rebuild');
+
+CREATE VIRTUAL TABLE IF NOT EXISTS post_fts USING fts5(
+  content,
+  content='post',
+  content_rowid='post_id',
+  tokenize='unicode61 remove_diacritics 2'
+);
+
+CREATE TRIGGER IF NOT EXISTS post_fts_insert AFTER INSERT ON post BEGIN
+  INSERT INTO post_fts(rowid, content) VALUES (new.post_id, new.content);
+END;
+
+CREATE TRIGGER IF NOT EXISTS post_fts_delete AFTER DELETE ON post BEGIN
+  INSERT INTO post_fts(post_fts, rowid, content)
+  VALUES ('delete', old.post_id, old.content);
+END;
+
+-- Likes update the post row too, only content changes need reindexing
+CREATE TRIGGER IF NOT EXISTS post_fts_update AFTER UPDATE OF content ON post BEGIN
+  INSERT INTO post_fts(post_fts, rowid, content)
+  VALUES ('delete', old.post_id, old.content);
+  INSERT INTO post_fts(rowid, content) VALUES (new.post_id, new.content);
+END;
+
+INSERT INTO post_fts(post_fts) VALUES ('rebuild');
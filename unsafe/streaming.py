@@ -0,0 +1,136 @@
+"""
+Streaming template rendering.
+
+A renderer builds the whole page in memory before the server sends the
+first byte, so time to first byte and memory use grow with the number of
+rows on a page. :func:`render_stream` instead renders with Jinja2's
+``Template.generate`` and returns a response whose ``app_iter`` renders the
+page while it is sent. Combined with rows fetched lazily from the database,
+e.g. :func:`unsafe.db.note.iter_notes`, the head of the page and the first
+rows are sent while later rows are still being read.
+
+The rows are read from the request's database connection as the page is
+sent, so the request's finished callbacks, which commit and release the
+connection, are run when the server closes the ``app_iter``.
+
+Templates can not know the number of rows before they have all been
+output, see :class:`unsafe.paging.PageRows`, so counts and the link to the
+next page go after the loop.
+"""
+from functools import partial
+from typing import Iterator
+
+from pyramid.config import Configurator
+from pyramid.csrf import get_csrf_token
+from pyramid.events import BeforeRender
+from pyramid.renderers import RendererHelper
+from pyramid.request import Request
+from pyramid.response import Response
+from pyramid.settings import asbool
+
+__all__ = [
+    'StreamingAppIter',
+    'render_stream',
+    'streaming_enabled',
+]
+
+
+class StreamingAppIter:
+    """``app_iter`` joining template output into chunks of at least
+    ``chunk_size`` bytes.
+
+    The finished callbacks registered on the request so far are taken over
+    and called when the server closes the ``app_iter``, after the last
+    chunk was sent or the client went away.
+    """
+
+    def __init__(self, request: Request, output: Iterator[str], *,
+                 chunk_size: int = 8192, encoding: str = 'utf-8'):
+        self.request = request
+        self.output = output
+        self.chunk_size = chunk_size
+        self.encoding = encoding
+        self.finished_callbacks = list(request.finished_callbacks)
+        request.finished_callbacks.clear()
+
+    def __iter__(self) -> Iterator[bytes]:
+        buffer = []
+        size = 0
+        try:
+            for text in self.output:
+                data = text.encode(self.encoding)
+                buffer.append(data)
+                size += len(data)
+                if size >= self.chunk_size:
+                    yield b''.join(buffer)
+                    buffer = []
+                    size = 0
+        except Exception as e:
+            # Let the finished callbacks roll back
+            self.request.exception = e
+            raise
+        if buffer:
+            yield b''.join(buffer)
+
+    def close(self):
+        try:
+            close = getattr(self.output, 'close', None)
+            if close:
+                close()
+        finally:
+            for callback in self.finished_callbacks:
+                callback(self.request)
+            self.finished_callbacks = []
+
+
+def streaming_enabled(request: Request) -> bool:
+    """Whether listing views should stream their pages, see the
+    ``templates.streaming`` setting."""
+    return getattr(request.registry, 'streaming', False)
+
+
+def render_stream(renderer_name: str, value: dict,
+                  request: Request) -> Response:
+    """Render a Jinja2 template into a streaming response.
+
+    The template gets the same system values as with a ``renderer`` of a
+    view, and :class:`pyramid.events.BeforeRender` subscribers are
+    notified.
+
+    :param renderer_name: template name, e.g. ``'notes/list-notes.jinja2'``
+    :param value: template variables
+    :param request: current request
+    """
+    registry = request.registry
+    helper = RendererHelper(name=renderer_name, registry=registry)
+    system = BeforeRender({
+        'view': None,
+        'renderer_name': renderer_name,
+        'renderer_info': helper,
+        'context': getattr(request, 'context', None),
+        'request': request,
+        'req': request,
+        'get_csrf_token': partial(get_csrf_token, request),
+    }, value)
+    registry.notify(system)
+    system.update(value)
+    template = helper.renderer.template_loader()
+
+    response = request.response
+    response.content_type = 'text/html'
+    response.charset = 'utf-8'
+    response.app_iter = StreamingAppIter(
+        request, template.generate(system),
+        chunk_size=getattr(registry, 'streaming_chunk_size', 8192))
+    return response
+
+
+def includeme(config: Configurator):
+    """Enable streaming of listing pages if ``templates.streaming`` is true.
+    ``templates.streaming_chunk_size`` sets the minimum number of bytes
+    sent at a time, default ``8192``."""
+    settings = config.registry.settings
+    config.registry.streaming = asbool(
+        settings.get('templates.streaming', False))
+    config.registry.streaming_chunk_size = int(
+        settings.get('templates.streaming_chunk_size', 8192))
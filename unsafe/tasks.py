@@ -0,0 +1,73 @@
+"""
+Background tasks running in daemon threads.
+"""
+import logging
+import threading
+from typing import Callable, Optional
+
+__all__ = ['PeriodicTask']
+
+
+class PeriodicTask:
+    """Call a function periodically from a daemon thread.
+
+    The thread is started by :meth:`start`, which may be called any number of
+    times, and runs ``func`` every ``interval`` seconds until :meth:`stop` is
+    called. Exceptions raised by ``func`` are logged and do not stop the task.
+
+    :param func: function called without arguments
+    :param interval: seconds between calls
+    :param name: thread name
+    """
+
+    def __init__(self, func: Callable[[], object], interval: float, *,
+                 name: Optional[str] = None):
+        self.func = func
+        self.interval = interval
+        self.name = name or getattr(func, '__name__', 'periodic-task')
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = False
+
+    def start(self):
+        """Start the background thread unless already running."""
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None and not self._stopping:
+                self._thread = threading.Thread(target=self._run,
+                                                name=self.name,
+                                                daemon=True)
+                self._thread.start()
+
+    def wake(self):
+        """Run the function as soon as possible instead of waiting for the
+        interval to pass."""
+        self._wakeup.set()
+
+    def stop(self, timeout: Optional[float] = None):
+        """Stop the background thread, waiting for a running call to
+        complete."""
+        with self._lock:
+            self._stopping = True
+            thread = self._thread
+        self._wakeup.set()
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(timeout)
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def _run(self):
+        logger = logging.getLogger(__name__)
+        while True:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            if self._stopping:
+                break
+            try:
+                self.func()
+            except Exception:
+                logger.exception('Background task %s failed', self.name)
@@ -0,0 +1,198 @@
+"""
+Login throttling.
+
+Every login attempt costs a deliberately slow password verification, so
+unlimited attempts let a script pin all CPU cores (and guess passwords).
+:class:`LoginThrottle` limits attempts per client address and per username
+with token buckets and rejects excess attempts before the password is
+checked.
+"""
+import atexit
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional, Tuple
+
+from pyramid.httpexceptions import HTTPTooManyRequests
+
+from . import db
+from .tasks import PeriodicTask
+
+__all__ = [
+    'LoginThrottle',
+    'TokenBucket',
+]
+
+
+class TokenBucket:
+    """Token buckets for any number of keys.
+
+    Each key has a bucket holding at most ``burst`` tokens which refills
+    with ``rate`` tokens per second. An attempt takes a token and is
+    rejected if the bucket is empty.
+
+    Only the ``max_keys`` most recently used buckets are kept. A forgotten
+    bucket starts over full, which is also the state an unused bucket ends
+    up in.
+
+    :param rate: tokens added per second
+    :param burst: bucket capacity
+    :param max_keys: maximum number of buckets to keep
+    """
+
+    def __init__(self, rate: float, burst: float, *, max_keys: int = 10000):
+        if rate <= 0 or burst < 1:
+            raise ValueError('Token bucket needs a positive rate and a burst'
+                             ' of at least 1')
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        # key -> (tokens, time of last update)
+        self._buckets: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key: str, now: Optional[float] = None) -> bool:
+        """Take a token for ``key``, returning ``False`` if there was none."""
+        if now is None:
+            now = time.time()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return allowed
+
+    def items(self) -> Iterable[Tuple[str, float, float]]:
+        """Buckets that are not full as ``(key, tokens, updated)``."""
+        now = time.time()
+        with self._lock:
+            buckets = list(self._buckets.items())
+        return [(key, tokens, updated)
+                for key, (tokens, updated) in buckets
+                if tokens + (now - updated) * self.rate < self.burst]
+
+    def restore(self, items: Iterable[Tuple[str, float, float]]):
+        """Restore buckets saved with :meth:`items`."""
+        with self._lock:
+            for key, tokens, updated in items:
+                self._buckets[key] = (tokens, updated)
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class LoginThrottle:
+    """Per client address and per username limits on login attempts.
+
+    Rates are given in attempts per minute. An attempt must get a token
+    from both the client address bucket and the username bucket.
+
+    If a ``database`` is given, buckets are saved to it every
+    ``save_interval`` seconds and at exit, and loaded at startup, so that
+    restarting the server does not reset the limits.
+
+    :param ip_rate: attempts per minute per client address
+    :param ip_burst: attempts a client address may make in a burst
+    :param user_rate: attempts per minute per username
+    :param user_burst: attempts a username may get in a burst
+    :param database: SQLite database to save buckets in
+    :param save_interval: seconds between saving buckets
+    """
+
+    def __init__(self, *, ip_rate: float = 10, ip_burst: float = 20,
+                 user_rate: float = 5, user_burst: float = 10,
+                 database: Optional[str] = None, save_interval: float = 60):
+        self.ip_buckets = TokenBucket(ip_rate / 60, ip_burst)
+        self.user_buckets = TokenBucket(user_rate / 60, user_burst)
+        self.database = database
+        self._lock = threading.Lock()
+        self._allowed = 0
+        self._rejected_ip = 0
+        self._rejected_user = 0
+
+        self._task: Optional[PeriodicTask] = None
+        if database:
+            self._restore()
+            self._task = PeriodicTask(self.save, save_interval,
+                                      name='login-throttle')
+            self._task.start()
+            atexit.register(self.close)
+
+    def allow(self, client_addr: Optional[str], username: str) -> bool:
+        """Record a login attempt, returning ``False`` if it exceeds a
+        limit."""
+        if not self.ip_buckets.take(client_addr or ''):
+            with self._lock:
+                self._rejected_ip += 1
+            return False
+        if not self.user_buckets.take(username.strip().lower()):
+            with self._lock:
+                self._rejected_user += 1
+            return False
+        with self._lock:
+            self._allowed += 1
+        return True
+
+    def check(self, request, username: str):
+        """Record a login attempt of a request.
+
+        :raises HTTPTooManyRequests: if the attempt exceeds a limit
+        """
+        if not self.allow(request.client_addr, username):
+            logging.getLogger(__name__).warning(
+                'Throttled login attempt for %r from %s', username,
+                request.client_addr)
+            raise HTTPTooManyRequests(headers={'Retry-After': '60'})
+
+    def stats(self) -> Dict[str, int]:
+        """Counters of allowed and rejected login attempts."""
+        with self._lock:
+            return {
+                'allowed': self._allowed,
+                'rejected_ip': self._rejected_ip,
+                'rejected_user': self._rejected_user,
+            }
+
+    def _create_schema(self, cur: sqlite3.Cursor):
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS login_throttle (
+                kind TEXT NOT NULL,
+                key TEXT NOT NULL,
+                tokens REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (kind, key)
+                );
+            ''')
+
+    def _restore(self):
+        with db.cursor(self.database) as cur:
+            self._create_schema(cur)
+            for kind, buckets in (('ip', self.ip_buckets),
+                                  ('user', self.user_buckets)):
+                cur.execute('SELECT key, tokens, updated_at'
+                            ' FROM login_throttle WHERE kind = ?'
+                            ' ORDER BY updated_at', (kind,))
+                buckets.restore(cur.fetchall())
+
+    def save(self):
+        """Save buckets that are not full to ``database``."""
+        with db.cursor(self.database) as cur:
+            cur.execute('DELETE FROM login_throttle')
+            for kind, buckets in (('ip', self.ip_buckets),
+                                  ('user', self.user_buckets)):
+                cur.executemany('INSERT INTO login_throttle'
+                                ' (kind, key, tokens, updated_at)'
+                                ' VALUES (?, ?, ?, ?)',
+                                [(kind,) + item for item in buckets.items()])
+
+    def close(self):
+        if self._task:
+            self._task.stop()
+            self._task = None
+            self.save()